@@ -0,0 +1,336 @@
+# benchmark_suite.py
+"""
+Performance baseline of the recommendation, training, model exchange and ingestion paths.
+Runs on synthetic catalogs and ratings against in-process stand-ins for Fuseki (the rdflib store backend)
+and Mastodon (a local HTTP server), and stores the results as JSON so they can be compared across commits:
+
+    python benchmark_suite.py --sizes 1000 100000 1000000
+    python benchmark_suite.py --compare benchmark_results/<earlier run>.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+import torch
+from machine_learning_service import MLService, fit_model
+from mastodon_client import MastodonClient
+from model_aggregation import aggregate_model_states
+from model_state_codec import decode_model_state, encode_model_state
+from rdf_knowledge_graph import RDFKnowledgeGraph
+from rdf_store_backend import RdflibStoreBackend
+from reply_state_store import ReplyStateStore
+from request_scheduler import RateLimitScheduler
+
+GENRES = ("Pop", "Rock", "Jazz", "Hip-Hop", "Electronic", "Classical", "Country", "Metal", "Folk", "R&B")
+
+
+def synthetic_catalog(size, seed=0):
+    """Returns a catalog of `size` songs with roughly ten songs per artist."""
+    rng = np.random.default_rng(seed)
+    song_ids = np.arange(1, size + 1, dtype=np.int64)
+    return pd.DataFrame({
+        "song_id": song_ids,
+        "title": [f"Song {i}" for i in song_ids],
+        "genre": np.asarray(GENRES, dtype=object)[rng.integers(0, len(GENRES), size)],
+        "artist": [f"Artist {i}" for i in rng.integers(0, max(size // 10, 1), size)],
+        "tempo": rng.integers(60, 200, size),
+        "duration": rng.integers(120, 420, size),
+    })
+
+
+def synthetic_ratings(catalog, users, ratings_per_user, seed=0):
+    rng = np.random.default_rng(seed)
+    count = users * ratings_per_user
+    return pd.DataFrame({
+        "user_id": np.repeat(np.arange(1, users + 1), ratings_per_user),
+        "song_id": catalog["song_id"].values[rng.integers(0, len(catalog), count)],
+        "rating": np.round(rng.uniform(1.0, 5.0, count), 1),
+    })
+
+
+class SyntheticKnowledgeGraph:
+    """Holds the catalog the way RDFKnowledgeGraph does, without a store behind it."""
+
+    def __init__(self, songs_data):
+        self.songs_data = songs_data
+
+
+def percentiles(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(milliseconds, 50)), "p99_ms": float(np.percentile(milliseconds, 99)),
+            "mean_ms": float(milliseconds.mean())}
+
+
+def best_of(function, repeats):
+    """Returns the fastest of `repeats` runs in seconds and the last result."""
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_recommendations(service, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    titles = service.rdf_knowledge_graph.songs_data["title"].values
+    # The first request computes the embeddings and builds the similarity index
+    start = time.perf_counter()
+    service.get_song_recommendations(titles[0], 3)
+    index_build = time.perf_counter() - start
+    latencies = []
+    for title in titles[rng.integers(0, len(titles), queries)]:
+        start = time.perf_counter()
+        service.get_song_recommendations(title, 3)
+        latencies.append(time.perf_counter() - start)
+    return {"queries": queries, "index_build_seconds": index_build, **percentiles(latencies)}
+
+
+def benchmark_training(service, epochs):
+    features, target = service.build_training_examples()
+    start = time.perf_counter()
+    # No validation split and no early stopping, so every run trains the same number of samples
+    trained_epochs = fit_model(service.model, features, target, service.criterion, service.optimizer,
+                               num_epochs=epochs, batch_size=service.batch_size, validation_split=0.0,
+                               patience=epochs, seed=0)
+    elapsed = time.perf_counter() - start
+    samples = len(target) * trained_epochs
+    return {"examples": len(target), "epochs": trained_epochs, "seconds": elapsed,
+            "samples_per_second": samples / max(elapsed, 1e-9)}
+
+
+def benchmark_serialization(model_state, repeats):
+    results = {}
+    variants = [("json", {"encoding": "json"})]
+    variants += [(f"binary-{precision}", {"encoding": "binary", "precision": precision, "compression": "zlib"})
+                 for precision in ("float32", "float16", "int8")]
+    for name, options in variants:
+        encode_seconds, encoded = best_of(lambda: encode_model_state(model_state, **options), repeats)
+        decode_seconds, _ = best_of(lambda: decode_model_state(encoded), repeats)
+        results[name] = {"bytes": len(encoded), "encode_ms": encode_seconds * 1000,
+                         "decode_ms": decode_seconds * 1000}
+    return results
+
+
+def benchmark_aggregation(model_state, peer_counts, strategies, repeats, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    results = []
+    for peers in peer_counts:
+        peer_states = [{"model": f"peer-{i}", "modelState": {name: tensor + 0.01 * torch.randn(
+            tensor.shape, generator=generator) for name, tensor in model_state.items()}} for i in range(peers)]
+        for strategy in strategies:
+            seconds, _ = best_of(lambda: aggregate_model_states(model_state, peer_states, strategy=strategy),
+                                 repeats)
+            results.append({"peers": peers, "strategy": strategy, "ms": seconds * 1000})
+    return results
+
+
+def benchmark_ingest(catalog, chunk_size, modes=("gsp",)):
+    """
+    Bulk inserts the catalog into a fresh in-process store with each bulk mode and reads it back.
+    "sparql" is not run by default: on the rdflib stand-in it measures rdflib's SPARQL parser, which is
+    superlinear in the size of an INSERT DATA request, rather than anything Fuseki would do.
+    """
+    songs = catalog.astype({"tempo": np.int64, "duration": np.int64}).to_dict("records")
+    results = {"songs": len(songs)}
+    for mode in modes:
+        knowledge_graph = RDFKnowledgeGraph(None, store=RdflibStoreBackend(), node_id="benchmark", load_songs=False)
+        start = time.perf_counter()
+        inserted = knowledge_graph.insert_songs_bulk(songs, mode=mode, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        results[mode] = {"seconds": elapsed, "songs_per_second": inserted / max(elapsed, 1e-9)}
+    start = time.perf_counter()
+    loaded = knowledge_graph.get_all_songs()
+    elapsed = time.perf_counter() - start
+    results["read"] = {"seconds": elapsed, "songs_per_second": len(loaded) / max(elapsed, 1e-9)}
+    return results
+
+
+class FakeMastodonServer:
+    """Serves a hashtag timeline of `statuses` statuses and accepts replies, like a Mastodon instance."""
+
+    def __init__(self, statuses):
+        self.statuses = [{"id": str(1000 + i), "content": f"Recommend something like Song {i + 1}",
+                          "account": {"username": f"user{i}"}} for i in range(statuses)]
+        self.replies = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not urlparse(self.path).path.startswith("/api/v1/timelines/tag/"):
+                    self.send_error(404)
+                    return
+                self.send_json(list(reversed(server.statuses)))
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server.lock:
+                    server.replies += 1
+                    reply_id = str(10 ** 6 + server.replies)
+                self.send_json({"id": reply_id})
+
+            def send_json(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def benchmark_mastodon(service, statuses):
+    """Fetches new statuses from the fake instance and answers each with recommendations."""
+    server = FakeMastodonServer(statuses)
+    client = MastodonClient(reply_state=ReplyStateStore(":memory:"),
+                            scheduler=RateLimitScheduler(limit=10 ** 6, window_seconds=1, burst=10 ** 6))
+    client.instance_url = server.url
+    client.page_size = max(statuses, 1)
+    try:
+        start = time.perf_counter()
+        fetched = client.fetch_new_statuses("benchmark")
+        fetch_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        replies = [(status["id"], status["account"]["username"], "[FUNGUS] " + str(
+            service.get_song_recommendations(service.extract_song_from_string(status["content"]), 3)))
+            for status in fetched]
+        sent = sum(client.reply_to_statuses(replies))
+        reply_seconds = time.perf_counter() - start
+    finally:
+        client.executor.shutdown()
+        server.close()
+    return {"statuses": len(fetched), "fetch_seconds": fetch_seconds, "replies": sent,
+            "replies_per_second": sent / max(reply_seconds, 1e-9)}
+
+
+def run_benchmarks(sizes=(1000, 10000), queries=200, users=200, ratings_per_user=20, epochs=3,
+                   peer_counts=(1, 4, 16, 64), strategies=("mean", "median"), ingest_size=10000,
+                   ingest_chunk_size=1000, ingest_modes=("gsp",), statuses=100, repeats=5):
+    results = {"catalogs": {}}
+    service = None
+    for size in sizes:
+        logging.warning(f"[BENCHMARK] Catalog of {size} songs")
+        catalog = synthetic_catalog(size)
+        start = time.perf_counter()
+        service = MLService(SyntheticKnowledgeGraph(catalog))
+        preprocessing = time.perf_counter() - start
+        service.user_ratings_data = synthetic_ratings(catalog, users, ratings_per_user)
+        results["catalogs"][str(size)] = {
+            "preprocessing_seconds": preprocessing,
+            "training": benchmark_training(service, epochs),
+            "recommendation": benchmark_recommendations(service, queries),
+        }
+
+    logging.warning("[BENCHMARK] Model exchange")
+    model_state = service.model.get_state()
+    results["serialization"] = benchmark_serialization(model_state, repeats)
+    results["aggregation"] = benchmark_aggregation(model_state, peer_counts, strategies, repeats)
+
+    logging.warning(f"[BENCHMARK] Bulk ingest of {ingest_size} songs")
+    results["ingest"] = benchmark_ingest(synthetic_catalog(ingest_size), ingest_chunk_size, ingest_modes)
+
+    logging.warning(f"[BENCHMARK] Answering {statuses} statuses")
+    results["mastodon"] = benchmark_mastodon(service, statuses)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """Flattens the numeric results into {"catalogs.1000.training.seconds": value}."""
+    flat = {}
+    if isinstance(results, list):
+        # Rows such as {"peers": 4, "strategy": "mean", "ms": 1.2} become "4/mean.ms"
+        keys = ("peers", "strategy")
+        results = {"/".join(str(entry[key]) for key in keys if key in entry):
+                   {key: value for key, value in entry.items() if key not in keys} for entry in results}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Returns (metric, baseline value, current value, relative change) for the metrics both runs share."""
+    before, after = flatten(baseline["results"]), flatten(current["results"])
+    return [(name, before[name], after[name], (after[name] - before[name]) / before[name] if before[name] else None)
+            for name in sorted(before.keys() & after.keys())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks MusicRecommendationFungus on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="catalog sizes (songs)")
+    parser.add_argument("--queries", type=int, default=200, help="recommendation requests per catalog")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ratings-per-user", type=int, default=20)
+    parser.add_argument("--epochs", type=int, default=3, help="training epochs per catalog")
+    parser.add_argument("--peers", type=int, nargs="+", default=[1, 4, 16, 64], help="peer counts to aggregate")
+    parser.add_argument("--strategies", nargs="+", default=["mean", "median"])
+    parser.add_argument("--ingest-size", type=int, default=10000, help="songs bulk inserted into the store")
+    parser.add_argument("--ingest-modes", nargs="+", default=["gsp"], choices=["gsp", "sparql"],
+                        help="bulk insert modes (sparql is slow on the rdflib stand-in, keep --ingest-size small)")
+    parser.add_argument("--ingest-chunk-size", type=int, default=1000)
+    parser.add_argument("--statuses", type=int, default=100, help="statuses answered via the fake Mastodon")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="result file (default: benchmark_results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.queries, args.users, args.ratings_per_user, args.epochs,
+                             args.peers, args.strategies, args.ingest_size, args.ingest_chunk_size,
+                             args.ingest_modes, args.statuses, args.repeats)
+    now = datetime.now(timezone.utc)
+    commit = git_commit()
+    report = {"commit": commit, "timestamp": now.isoformat(), "python": platform.python_version(),
+              "torch": torch.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+              "config": vars(args), "results": results}
+
+    output = args.output or os.path.join("benchmark_results", f"{now:%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+        for name, before, after, change in compare(baseline, report):
+            change = f"{change:+.1%}" if change is not None else "n/a"
+            print(f"  {name}: {before:.4g} -> {after:.4g} ({change})")
+    return report
+
+
+if __name__ == "__main__":
+    # The imported modules configure INFO logging, which would flood the output
+    logging.getLogger().setLevel(logging.WARNING)
+    main()
@@ -0,0 +1,42 @@
+import json
+import os
+import tempfile
+import unittest
+from benchmark_suite import compare, flatten, main, synthetic_catalog, synthetic_ratings
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_synthetic_data(self):
+        catalog = synthetic_catalog(100)
+        ratings = synthetic_ratings(catalog, users=5, ratings_per_user=4)
+
+        self.assertEqual(list(catalog["song_id"]), list(range(1, 101)))
+        self.assertEqual(len(ratings), 20)
+        self.assertTrue(ratings["song_id"].isin(catalog["song_id"]).all())
+
+    def test_small_run_writes_comparable_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            arguments = ["--sizes", "50", "--queries", "5", "--users", "5", "--ratings-per-user", "4",
+                         "--epochs", "1", "--peers", "1", "2", "--ingest-size", "20", "--ingest-modes", "gsp", "sparql",
+                         "--ingest-chunk-size", "10", "--statuses", "3",
+                         "--repeats", "1", "--output", output]
+            report = main(arguments)
+
+            with open(output) as file:
+                stored = json.load(file)
+            results = stored["results"]
+            self.assertEqual(results["catalogs"]["50"]["recommendation"]["queries"], 5)
+            self.assertGreater(results["catalogs"]["50"]["training"]["samples_per_second"], 0)
+            self.assertIn("binary-int8", results["serialization"])
+            self.assertEqual(len(results["aggregation"]), 4)
+            self.assertEqual(results["ingest"]["songs"], 20)
+            self.assertEqual(results["mastodon"]["replies"], 3)
+
+            changes = compare(stored, report)
+            self.assertIn("catalogs.50.recommendation.p99_ms", [name for name, *_ in changes])
+            self.assertIn("aggregation.2/median.ms", flatten(results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# caching.py
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small least-recently-used cache with a size bound."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire ttl seconds after they were stored."""
+
+    def __init__(self, maxsize=128, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (expiry time, value)
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= self.clock():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,43 @@
+import unittest
+from caching import LRUCache, TTLCache
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_get_default(self):
+        self.assertIsNone(LRUCache().get("missing"))
+
+class TestTTLCache(unittest.TestCase):
+    def test_entries_expire(self):
+        now = [0.0]
+        cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        now[0] = 9.0
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 10.0
+        self.assertIsNone(cache.get("a"))
+        self.assertNotIn("a", cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+if __name__ == '__main__':
+    unittest.main()
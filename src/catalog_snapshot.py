@@ -0,0 +1,95 @@
+# catalog_snapshot.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_FORMAT_VERSION = 2
+STRING_COLUMNS = ("title", "genre", "artist")
+NUMERIC_COLUMNS = ("song_id", "tempo", "duration")
+
+
+class CatalogSnapshot:
+    """Song catalog and its encoded feature arrays as loaded from disk (arrays are memory-mapped)."""
+
+    def __init__(self, songs_data, arrays, metadata):
+        self.songs_data = songs_data
+        self.arrays = arrays
+        self.metadata = metadata
+
+
+def catalog_fingerprint(*sources):
+    """Hashes the catalog sources (file paths are hashed by content, anything else by its string value)."""
+    digest = hashlib.sha256(f"catalog-snapshot-v{SNAPSHOT_FORMAT_VERSION}".encode('utf-8'))
+    for source in sources:
+        if isinstance(source, str) and os.path.isfile(source):
+            with open(source, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            digest.update(repr(source).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def save_catalog_snapshot(directory, fingerprint, songs_data, arrays, metadata):
+    """
+    Writes the catalog as one .npy file per column plus the encoded feature arrays, so they can be memory-mapped.
+    The snapshot directory is replaced atomically.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".catalog-", dir=parent)
+    try:
+        for column in NUMERIC_COLUMNS:
+            np.save(os.path.join(staging, f"{column}.npy"), np.asarray(songs_data[column], dtype=np.int64))
+        for column in STRING_COLUMNS:
+            np.save(os.path.join(staging, f"{column}.npy"), np.asarray(songs_data[column], dtype=str))
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"array-{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(staging, "meta.json"), 'w') as file:
+            json.dump({"fingerprint": fingerprint, "version": SNAPSHOT_FORMAT_VERSION,
+                       "songs": len(songs_data), "arrays": sorted(arrays), "metadata": metadata}, file)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(staging, directory)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    logging.info(f"[SNAPSHOT] Saved catalog snapshot with {len(songs_data)} songs to {directory}")
+
+
+def load_catalog_snapshot(directory, fingerprint):
+    """Memory-maps the snapshot in directory, or returns None if it is missing or was taken of another catalog."""
+    try:
+        with open(os.path.join(directory, "meta.json")) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("fingerprint") != fingerprint or meta.get("version") != SNAPSHOT_FORMAT_VERSION:
+        logging.info("[SNAPSHOT] Catalog changed, ignoring snapshot")
+        return None
+
+    try:
+        columns = {column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode='r')
+                   for column in NUMERIC_COLUMNS + STRING_COLUMNS}
+        # Copy-on-write mapping: pages are read lazily and the arrays stay writable for torch
+        arrays = {name: np.load(os.path.join(directory, f"array-{name}.npy"), mmap_mode='c')
+                  for name in meta["arrays"]}
+    except (OSError, ValueError) as e:
+        logging.warning(f"[SNAPSHOT] Could not read catalog snapshot: {e}")
+        return None
+    songs_data = pd.DataFrame({
+        "song_id": columns["song_id"],
+        "title": columns["title"].astype(object),
+        "genre": columns["genre"].astype(object),
+        "artist": columns["artist"].astype(object),
+        "tempo": columns["tempo"],
+        "duration": columns["duration"],
+    })
+    logging.info(f"[SNAPSHOT] Loaded catalog snapshot with {len(songs_data)} songs from {directory}")
+    return CatalogSnapshot(songs_data, arrays, meta["metadata"])
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from catalog_snapshot import catalog_fingerprint, save_catalog_snapshot, load_catalog_snapshot
+
+class TestCatalogSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_dir = os.path.join(self.tmp_dir.name, "snapshot")
+        self.songs_data = pd.DataFrame({
+            'song_id': [1, 2], 'title': ['Song A', 'Söng B'], 'genre': ['Rock', 'Pop'],
+            'artist': ['Artist1', 'Artist2'], 'tempo': [120, 130], 'duration': [200, 220]
+        })
+        self.arrays = {"columns": np.arange(6).reshape(2, 3), "values": np.ones((2, 3), dtype=np.float32)}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip_is_memory_mapped(self):
+        save_catalog_snapshot(self.snapshot_dir, "fp", self.songs_data, self.arrays, {"columns": ["a", "b", "c"]})
+
+        snapshot = load_catalog_snapshot(self.snapshot_dir, "fp")
+
+        for name, array in self.arrays.items():
+            self.assertIsInstance(snapshot.arrays[name], np.memmap)
+            np.testing.assert_array_equal(snapshot.arrays[name], array)
+        pd.testing.assert_frame_equal(snapshot.songs_data, self.songs_data, check_dtype=False)
+        self.assertEqual(snapshot.metadata, {"columns": ["a", "b", "c"]})
+
+    def test_fingerprint_mismatch_or_missing_snapshot(self):
+        save_catalog_snapshot(self.snapshot_dir, "fp", self.songs_data, self.arrays, {})
+        self.assertIsNone(load_catalog_snapshot(self.snapshot_dir, "other"))
+        self.assertIsNone(load_catalog_snapshot(os.path.join(self.tmp_dir.name, "missing"), "fp"))
+
+    def test_catalog_fingerprint_hashes_file_content(self):
+        csv_path = os.path.join(self.tmp_dir.name, "songs.csv")
+        self.songs_data.to_csv(csv_path, index=False)
+        fingerprint = catalog_fingerprint(csv_path, "http://fuseki")
+        self.assertEqual(fingerprint, catalog_fingerprint(csv_path, "http://fuseki"))
+        self.assertNotEqual(fingerprint, catalog_fingerprint(csv_path, "http://other"))
+
+        with open(csv_path, 'a') as file:
+            file.write("3,Song C,Jazz,Artist3,140,180\n")
+        self.assertNotEqual(fingerprint, catalog_fingerprint(csv_path, "http://fuseki"))
+
+if __name__ == '__main__':
+    unittest.main()
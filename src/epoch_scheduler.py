@@ -0,0 +1,105 @@
+# epoch_scheduler.py
+import logging
+import os
+import random
+import time
+
+
+class AdaptiveInterval:
+    """
+    Epoch interval that follows the arrival rate of statuses (an exponentially weighted moving average):
+    busy hashtags are polled about every target_statuses arrivals, idle ones less and less often.
+    The interval shrinks right away when traffic picks up but at most doubles per epoch when it calms down.
+    """
+
+    def __init__(self, initial=None, min_interval=None, max_interval=None, target_statuses=None, smoothing=0.3):
+        # Settings are read when the interval is created, after the .env file was loaded
+        if initial is None:
+            initial = float(os.getenv("EPOCH_SECONDS", 20))
+        if min_interval is None:
+            min_interval = float(os.getenv("EPOCH_MIN_SECONDS", 5))
+        if max_interval is None:
+            max_interval = float(os.getenv("EPOCH_MAX_SECONDS", 120))
+        if target_statuses is None:
+            target_statuses = float(os.getenv("EPOCH_TARGET_STATUSES", 1))
+        self.interval = initial
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_statuses = target_statuses
+        self.smoothing = smoothing
+        self.rate = None
+
+    def observe(self, statuses, elapsed):
+        """Records that `statuses` arrived within `elapsed` seconds and returns the next interval."""
+        if elapsed <= 0:
+            return self.interval
+        rate = statuses / elapsed
+        self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        wanted = self.target_statuses / self.rate if self.rate > 0 else self.max_interval
+        self.interval = max(self.min_interval, min(wanted, self.interval * 2, self.max_interval))
+        return self.interval
+
+
+class SubsystemBackoff:
+    """Exponential backoff with full jitter for one external dependency."""
+
+    def __init__(self, name, initial=None, maximum=None, clock=time.monotonic):
+        if initial is None:
+            initial = float(os.getenv("BACKOFF_INITIAL_SECONDS", 5))
+        if maximum is None:
+            maximum = float(os.getenv("BACKOFF_MAX_SECONDS", 300))
+        self.name = name
+        self.initial = initial
+        self.maximum = maximum
+        self.clock = clock
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def ready(self):
+        return self.clock() >= self.retry_at
+
+    def failed(self):
+        self.failures += 1
+        delay = random.uniform(0, min(self.maximum, self.initial * 2 ** (self.failures - 1)))
+        self.retry_at = self.clock() + delay
+        return delay
+
+    def succeeded(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class EpochScheduler:
+    """
+    Decides how long the main loop waits between epochs and isolates failures per subsystem:
+    while a subsystem backs off, only the stages that need it are skipped.
+    """
+
+    def __init__(self, subsystems=("fuseki", "mastodon"), interval=None, clock=time.monotonic):
+        self.interval = interval or AdaptiveInterval()
+        self.backoffs = {name: SubsystemBackoff(name, clock=clock) for name in subsystems}
+
+    def call(self, subsystem, function, *args, default=None, **kwargs):
+        """
+        Runs a stage that depends on the subsystem. Returns default without calling it while the
+        subsystem backs off, or if it raises (which starts or extends the backoff).
+        """
+        backoff = self.backoffs[subsystem]
+        name = getattr(function, '__name__', repr(function))
+        if not backoff.ready():
+            logging.info(f"[BACKOFF] Skipping {name}, {subsystem} is backing off")
+            return default
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            delay = backoff.failed()
+            logging.error(f"[BACKOFF] {subsystem} failed in {name} ({backoff.failures} in a row), "
+                          f"retrying in {delay:.0f}s: {e}", exc_info=True)
+            return default
+        backoff.succeeded()
+        return result
+
+    def next_interval(self, statuses, elapsed):
+        interval = self.interval.observe(statuses, elapsed)
+        logging.info(f"[SCHEDULE] {statuses} statuses in {elapsed:.0f}s, next epoch in {interval:.0f}s")
+        return interval
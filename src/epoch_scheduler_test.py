@@ -0,0 +1,88 @@
+import os
+import unittest
+from unittest.mock import patch
+from epoch_scheduler import AdaptiveInterval, EpochScheduler, SubsystemBackoff
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+    def test_busy_hashtags_are_polled_more_often(self):
+        interval = AdaptiveInterval(initial=20, min_interval=5, max_interval=120, target_statuses=1)
+        self.assertEqual(interval.observe(10, 20), 5)
+
+    def test_idle_interval_grows_gradually(self):
+        interval = AdaptiveInterval(initial=20, min_interval=5, max_interval=120, target_statuses=1)
+        self.assertEqual(interval.observe(0, 20), 40)
+        self.assertEqual(interval.observe(0, 40), 80)
+        self.assertEqual(interval.observe(0, 80), 120)
+        self.assertEqual(interval.observe(0, 120), 120)
+
+    def test_rate_is_smoothed(self):
+        interval = AdaptiveInterval(initial=20, min_interval=1, max_interval=1000, target_statuses=1, smoothing=0.5)
+        interval.observe(4, 20)
+        interval.observe(0, 20)
+        # The burst of the previous epoch still counts half
+        self.assertAlmostEqual(interval.rate, 0.1)
+        self.assertAlmostEqual(interval.interval, 10)
+
+
+class TestSubsystemBackoff(unittest.TestCase):
+    def test_backoff_grows_and_resets(self):
+        clock = FakeClock()
+        backoff = SubsystemBackoff("fuseki", initial=1, maximum=8, clock=clock)
+        delays = [backoff.failed() for _ in range(6)]
+        self.assertTrue(all(0 <= delay <= 8 for delay in delays))
+        self.assertLessEqual(delays[0], 1)
+        self.assertEqual(backoff.failures, 6)
+
+        clock.now = backoff.retry_at
+        self.assertTrue(backoff.ready())
+        backoff.succeeded()
+        self.assertEqual(backoff.failures, 0)
+
+
+class TestEpochScheduler(unittest.TestCase):
+    def test_failing_subsystem_is_skipped_but_others_run(self):
+        clock = FakeClock()
+        scheduler = EpochScheduler(clock=clock)
+        calls = []
+
+        def fuseki_down():
+            calls.append("fuseki")
+            raise ConnectionError("Fuseki unavailable")
+
+        def mastodon_up():
+            calls.append("mastodon")
+            return "ok"
+
+        scheduler.backoffs["fuseki"].initial = 10
+        self.assertEqual(scheduler.call("fuseki", fuseki_down, default=[]), [])
+        clock.now = 0.0
+        scheduler.backoffs["fuseki"].retry_at = 5.0
+        self.assertIsNone(scheduler.call("fuseki", fuseki_down))
+        self.assertEqual(scheduler.call("mastodon", mastodon_up), "ok")
+        self.assertEqual(calls, ["fuseki", "mastodon"])
+
+        clock.now = 5.0
+        scheduler.call("fuseki", fuseki_down)
+        self.assertEqual(calls, ["fuseki", "mastodon", "fuseki"])
+        self.assertEqual(scheduler.backoffs["fuseki"].failures, 2)
+
+
+    def test_settings_are_read_when_created(self):
+        with patch.dict(os.environ, {"EPOCH_SECONDS": "7", "BACKOFF_MAX_SECONDS": "42"}):
+            scheduler = EpochScheduler()
+
+        self.assertEqual(scheduler.interval.interval, 7.0)
+        self.assertEqual(scheduler.backoffs["fuseki"].maximum, 42.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
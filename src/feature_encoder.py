@@ -0,0 +1,100 @@
+# feature_encoder.py
+import os
+import zlib
+import numpy as np
+import torch
+
+
+class SparseFeatures:
+    """
+    Encoded songs with a fixed number of (column, value) entries per song.
+    Appending songs never touches existing rows, and batches convert to torch sparse COO tensors.
+    """
+
+    def __init__(self, columns, values, dim):
+        self.columns = np.asarray(columns, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.dim = dim
+
+    @property
+    def shape(self):
+        return len(self.columns), self.dim
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, rows):
+        return SparseFeatures(self.columns[rows], self.values[rows], self.dim)
+
+    def append(self, other):
+        if other.dim != self.dim:
+            raise ValueError(f"Cannot append features of width {other.dim} to width {self.dim}")
+        return SparseFeatures(np.concatenate([self.columns, other.columns]),
+                              np.concatenate([self.values, other.values]), self.dim)
+
+    def to_sparse_tensor(self):
+        return sparse_batch(torch.from_numpy(self.columns), torch.from_numpy(self.values), self.dim)
+
+    def to_dense(self):
+        return self.to_sparse_tensor().to_dense()
+
+
+def sparse_batch(columns, values, dim):
+    """Builds a (rows x dim) sparse COO tensor from per-row column indices and values."""
+    rows = torch.arange(len(columns)).unsqueeze(1).expand_as(columns)
+    indices = torch.stack([rows.reshape(-1), columns.reshape(-1)])
+    return torch.sparse_coo_tensor(indices, values.reshape(-1), (len(columns), dim), check_invariants=False).coalesce()
+
+
+class HashedSongFeatureEncoder:
+    """
+    Fixed-width song encoder: standardized tempo and duration plus signed feature hashing of genre and artist.
+    The width does not depend on the catalog, so the model has the same shape on every node, and songs can be
+    encoded one batch at a time without refitting. Hashing uses CRC32, which is stable across processes.
+    """
+
+    def __init__(self, genre_buckets=None, artist_buckets=None,
+                 tempo_mean=120.0, tempo_std=30.0, duration_mean=240.0, duration_std=60.0):
+        # Settings are read when the encoder is created, after the .env file was loaded
+        if genre_buckets is None:
+            genre_buckets = int(os.getenv("FEATURE_GENRE_BUCKETS", 16))
+        if artist_buckets is None:
+            artist_buckets = int(os.getenv("FEATURE_ARTIST_BUCKETS", 256))
+        self.genre_buckets = genre_buckets
+        self.artist_buckets = artist_buckets
+        self.tempo_mean = tempo_mean
+        self.tempo_std = tempo_std
+        self.duration_mean = duration_mean
+        self.duration_std = duration_std
+        self.dim = 2 + genre_buckets + artist_buckets
+
+    def config(self):
+        """Returns the parameters that determine the encoding (used to fingerprint encoded catalogs)."""
+        return {"encoder": "hashed-v1", "genre_buckets": self.genre_buckets, "artist_buckets": self.artist_buckets,
+                "tempo": [self.tempo_mean, self.tempo_std], "duration": [self.duration_mean, self.duration_std]}
+
+    def encode(self, songs):
+        """Encodes a DataFrame with genre, artist, tempo and duration columns."""
+        num_songs = len(songs)
+        columns = np.empty((num_songs, 4), dtype=np.int64)
+        values = np.empty((num_songs, 4), dtype=np.float32)
+
+        columns[:, 0] = 0
+        columns[:, 1] = 1
+        values[:, 0] = (self._numeric(songs['tempo']) - self.tempo_mean) / self.tempo_std
+        values[:, 1] = (self._numeric(songs['duration']) - self.duration_mean) / self.duration_std
+        columns[:, 2], values[:, 2] = self._hash(songs['genre'], 2, self.genre_buckets)
+        columns[:, 3], values[:, 3] = self._hash(songs['artist'], 2 + self.genre_buckets, self.artist_buckets)
+        return SparseFeatures(columns, values, self.dim)
+
+    @staticmethod
+    def _numeric(column):
+        return np.nan_to_num(np.asarray(column, dtype=np.float64), nan=0.0)
+
+    @staticmethod
+    def _hash(column, offset, buckets):
+        hashes = np.fromiter((zlib.crc32(str(value).strip().casefold().encode('utf-8')) for value in column),
+                             dtype=np.int64, count=len(column))
+        # The top bit picks the sign so that collisions tend to cancel out instead of adding up
+        signs = np.where(hashes & (1 << 31), -1.0, 1.0).astype(np.float32)
+        return offset + hashes % buckets, signs
@@ -0,0 +1,47 @@
+import os
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+import torch
+from feature_encoder import HashedSongFeatureEncoder
+
+class TestHashedSongFeatureEncoder(unittest.TestCase):
+    def setUp(self):
+        self.encoder = HashedSongFeatureEncoder(genre_buckets=4, artist_buckets=8)
+        self.songs = pd.DataFrame({
+            'genre': ['Rock', 'Pop', 'Rock'],
+            'artist': ['Queen', 'Adele', ' queen '],
+            'tempo': [120, 150, 90],
+            'duration': [240, 300, 180]
+        })
+
+    def test_width_is_fixed(self):
+        features = self.encoder.encode(self.songs)
+        self.assertEqual(features.shape, (3, 2 + 4 + 8))
+        self.assertEqual(self.encoder.encode(self.songs.iloc[:1]).shape, (1, 14))
+
+    def test_encoding_is_stable_and_normalized(self):
+        dense = self.encoder.encode(self.songs).to_dense()
+        # Same artist after normalization hashes to the same bucket
+        np.testing.assert_array_equal(dense[0, 2:], dense[2, 2:])
+        self.assertAlmostEqual(dense[1, 0].item(), 1.0)
+        self.assertAlmostEqual(dense[2, 1].item(), -1.0)
+        self.assertTrue(torch.equal(dense, HashedSongFeatureEncoder(4, 8).encode(self.songs).to_dense()))
+
+    def test_append_and_select_rows(self):
+        features = self.encoder.encode(self.songs.iloc[:2]).append(self.encoder.encode(self.songs.iloc[2:]))
+        self.assertEqual(len(features), 3)
+        np.testing.assert_array_equal(features[[2]].to_dense(), self.encoder.encode(self.songs).to_dense()[[2]])
+        self.assertTrue(features.to_sparse_tensor().is_sparse)
+
+
+    def test_bucket_counts_are_read_when_created(self):
+        with patch.dict(os.environ, {"FEATURE_GENRE_BUCKETS": "4", "FEATURE_ARTIST_BUCKETS": "8"}):
+            encoder = HashedSongFeatureEncoder()
+
+        self.assertEqual(encoder.dim, 2 + 4 + 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
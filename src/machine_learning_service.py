@@ -1,32 +1,74 @@
 # machine_learning_service.py
+import copy
 import logging
+import os
+import time
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics.pairwise import cosine_similarity
 from dotenv import load_dotenv
+import metrics
+from profiling import profiled
+from feature_encoder import HashedSongFeatureEncoder, SparseFeatures, sparse_batch
+from song_index import create_song_index
+from title_matcher import TitleMatcher
+from training_worker import TrainingJob
 
 load_dotenv()
 
 class MLService:
-    def __init__(self, rdf_knowledge_graph, user_ratings_csv=None, num_epochs=100, hidden_dim=64, lr=0.001):
+    def __init__(self, rdf_knowledge_graph, user_ratings_csv=None, num_epochs=100, hidden_dim=64, lr=0.001,
+                 catalog_snapshot=None, feature_encoder=None, batch_size=None, num_workers=None,
+                 validation_split=None, patience=None):
         # Load song data from knowledge base
         self.rdf_knowledge_graph = rdf_knowledge_graph
 
         # If user ratings are provided (optional), load the data
         self.user_ratings_data = pd.read_csv(user_ratings_csv) if user_ratings_csv else None
 
-        # Preprocess the song data
-        self.features_encoded, self.song_ids = self.preprocess_data()
+        # Fixed-width encoder, so the model has the same shape on every node whatever the catalog
+        self.feature_encoder = feature_encoder or HashedSongFeatureEncoder()
+
+        # Preprocess the song data (or reuse the encoding stored in an on-disk catalog snapshot)
+        if catalog_snapshot is not None:
+            self.features_encoded, self.song_ids = self.load_catalog_snapshot(catalog_snapshot)
+        else:
+            self.features_encoded, self.song_ids = self.preprocess_data()
+
+        # Incremented whenever the catalog features change (invalidates the embedding cache)
+        self.catalog_version = 0
+        # Similarity index holding the cached, L2-normalized song embeddings
+        self.song_index = create_song_index()
+        self._embedding_cache_key = None
+        self._title_positions = None
+        self._title_positions_version = None
+        self._id_positions = None
+        self._id_positions_version = None
+        self._title_matcher = None
+        self._title_matcher_version = None
 
         # Initialize model parameters
-        self.input_dim = self.features_encoded.shape[1]
+        self.input_dim = self.feature_encoder.dim
         self.hidden_dim = hidden_dim
         self.output_dim = 1  # Predicted score for each song (e.g., rating)
-        self.num_epochs = num_epochs
+        self.num_epochs = num_epochs  # Upper bound, training stops early once validation loss stalls
         self.lr = lr
+        # Settings are read when the service is created, after the .env file was loaded
+        if batch_size is None:
+            batch_size = int(os.getenv("TRAINING_BATCH_SIZE", 32))
+        if num_workers is None:
+            num_workers = int(os.getenv("TRAINING_NUM_WORKERS", 0))
+        if validation_split is None:
+            validation_split = float(os.getenv("TRAINING_VALIDATION_SPLIT", 0.2))
+        if patience is None:
+            patience = int(os.getenv("TRAINING_PATIENCE", 5))
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.validation_split = validation_split
+        self.patience = patience
 
         # Initialize the neural network model
         self.model = self.ContentBasedNeuralNetwork(self.input_dim, self.hidden_dim, self.output_dim)
@@ -41,9 +83,15 @@ class MLService:
             self.fc1 = nn.Linear(input_dim, hidden_dim)
             self.fc2 = nn.Linear(hidden_dim, output_dim)
             self.relu = nn.ReLU()
+            # Incremented whenever the weights change so that cached embeddings can be invalidated
+            self.version = 0
 
         def forward(self, x):
-            x = self.fc1(x)
+            if x.is_sparse:
+                # Hashed song features are sparse: only multiply the weights of the non-zero columns
+                x = torch.sparse.mm(x, self.fc1.weight.t()) + self.fc1.bias
+            else:
+                x = self.fc1(x)
             x = self.relu(x)
             x = self.fc2(x)
             return x
@@ -55,120 +103,318 @@ class MLService:
         def set_state(self, state_dict):
             """Sets the model's state using a provided state dictionary."""
             self.load_state_dict(state_dict)
+            self.version += 1
 
     def preprocess_data(self):
-        """Preprocess the song data (encoding categorical features and scaling numerical ones)."""
+        """Preprocess the song data (hashing categorical features and scaling numerical ones)."""
         # Extract features (Assuming 'genre', 'artist', 'tempo', 'duration' are available in the dataset)
-        features = self.rdf_knowledge_graph.songs_data[['genre', 'artist', 'tempo', 'duration']]
-
-        # One-hot encode categorical features (genre, artist)
-        features_encoded = pd.get_dummies(features, columns=['genre', 'artist'], drop_first=True)
-
-        # Standardize numerical features (tempo, duration)
-        scaler = StandardScaler()
-        features_encoded[['tempo', 'duration']] = scaler.fit_transform(features_encoded[['tempo', 'duration']])
-
-        # Convert any remaining object columns to numeric and handle missing values
-        features_encoded = features_encoded.apply(pd.to_numeric, errors='coerce').fillna(0)
-
-        # Convert the data into a numpy array with the correct type
-        features_encoded = features_encoded.astype('float32')
+        features_encoded = self.feature_encoder.encode(self.rdf_knowledge_graph.songs_data)
 
         # Get song ids for later use
         song_ids = self.rdf_knowledge_graph.songs_data['song_id'].values
 
         return features_encoded, song_ids
 
-    def train_model(self):
-        """Train the model over multiple epochs."""
-        # Convert features to PyTorch tensor
-        X = torch.tensor(self.features_encoded.values, dtype=torch.float32)
-
-        # Dummy target ratings (you can replace with actual user ratings if available)
-        target = torch.randn(X.shape[0])  # Random target ratings as placeholders
-
-        # Train the model for the specified number of epochs
-        for epoch in range(self.num_epochs):
-            self.model.train()
-
-            # Forward pass: Compute predicted ratings for all songs
-            outputs = self.model(X).squeeze()
+    def catalog_snapshot_arrays(self):
+        """Returns the encoded catalog as arrays to store in a catalog snapshot."""
+        return {"feature_columns": self.features_encoded.columns, "feature_values": self.features_encoded.values}
 
-            # Compute the loss
-            loss = self.criterion(outputs, target)
-
-            # Backward pass and optimization
-            self.optimizer.zero_grad()
-            loss.backward()
-            self.optimizer.step()
-
-            # Print the loss every 10 epochs
-            if (epoch + 1) % 10 == 0:
-                print(f'Epoch [{epoch + 1}/{self.num_epochs}], Loss: {loss.item():.4f}')
+    def load_catalog_snapshot(self, catalog_snapshot):
+        """Restores the encoded features from a (memory-mapped) catalog snapshot."""
+        features_encoded = SparseFeatures(catalog_snapshot.arrays["feature_columns"],
+                                          catalog_snapshot.arrays["feature_values"], self.feature_encoder.dim)
+        return features_encoded, self.rdf_knowledge_graph.songs_data['song_id'].values
 
+    @profiled("train_model")
+    def train_model(self):
+        """Train the model on the user ratings with mini-batches and early stopping."""
+        features, target = self.build_training_examples()
+        if len(target) == 0:
+            logging.warning("[TRAINING] No user ratings for songs in the catalog, skipping training")
+            return
+
+        fit_model(self.model, features, target, self.criterion, self.optimizer, num_epochs=self.num_epochs,
+                  batch_size=self.batch_size, num_workers=self.num_workers,
+                  validation_split=self.validation_split, patience=self.patience)
+
+        # The weights changed, so cached embeddings are stale
+        self.model.version += 1
+
+    def training_job(self, peer_states=None, aggregation_options=None):
+        """
+        Snapshots the current weights, optimizer state and training examples into a TrainingJob,
+        so the model can be trained (and aggregated with peer_states) in a background worker.
+        """
+        features, target = self.build_training_examples()
+        return TrainingJob(
+            model_dims=(self.input_dim, self.hidden_dim, self.output_dim),
+            model_state={k: v.detach().clone() for k, v in self.model.get_state().items()},
+            optimizer_state=copy.deepcopy(self.optimizer.state_dict()),
+            lr=self.lr,
+            features=features,
+            target=target,
+            fit_options={"num_epochs": self.num_epochs, "batch_size": self.batch_size,
+                         "num_workers": self.num_workers, "validation_split": self.validation_split,
+                         "patience": self.patience},
+            peer_states=peer_states,
+            aggregation_options=aggregation_options)
+
+    def swap_model(self, model_state, optimizer_state=None):
+        """
+        Deploys new weights by building a complete new model and similarity index first and then replacing
+        the references to them. Requests read self.model once, so they see either the old or the new model,
+        never a half-loaded one, and the first request after the swap does not pay for re-embedding the catalog.
+        """
+        model = self.ContentBasedNeuralNetwork(self.input_dim, self.hidden_dim, self.output_dim)
+        model.load_state_dict(model_state)
+        model.eval()
+        model.version = self.model.version + 1
+        # Keep the Adam moments, but bound to the new model's parameters
+        optimizer = optim.Adam(model.parameters(), lr=self.lr)
+        optimizer.load_state_dict(optimizer_state if optimizer_state is not None else self.optimizer.state_dict())
+        song_index = create_song_index()
+        song_index.build(self.embed_features(self.features_tensor(), model))
+
+        self.song_index, self._embedding_cache_key = song_index, (model, model.version, self.catalog_version)
+        self.model, self.optimizer = model, optimizer
+
+    def build_training_examples(self):
+        """Returns the sparse song features and ratings of all ratings of songs in the catalog."""
+        if self.user_ratings_data is None:
+            return self.features_encoded[:0], torch.zeros(0)
+        positions = self.user_ratings_data['song_id'].astype(str).map(self.get_song_positions_by_id())
+        known = positions.notna().values
+        positions = positions.values[known].astype(np.int64)
+        target = torch.tensor(self.user_ratings_data['rating'].values[known], dtype=torch.float32)
+        return self.features_encoded[positions], target
+
+    def features_tensor(self):
+        """Returns the encoded catalog features as a sparse float32 tensor."""
+        return self.features_encoded.to_sparse_tensor()
+
+    def embed_features(self, features, model=None):
+        """Runs features through the model and returns contiguous, L2-normalized float32 embeddings."""
+        model = model or self.model
+        model.eval()
+        with torch.no_grad():
+            embeddings = model(features).numpy()
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def get_song_embeddings(self):
+        """Returns the embedding matrix of all songs, recomputed only after the model or catalog changed."""
+        # Read the model once: a concurrent swap_model must not mix two models in one index
+        model = self.model
+        if not self._embeddings_are_current(model):
+            self.song_index.build(self.embed_features(self.features_tensor(), model))
+            self._embedding_cache_key = (model, model.version, self.catalog_version)
+        return self.song_index.embeddings
+
+    def _embeddings_are_current(self, model=None):
+        model = model or self.model
+        return self._embedding_cache_key == (model, model.version, self.catalog_version)
+
+    def encode_songs(self, songs):
+        """Encodes songs with the fixed-width encoder (unseen artists and genres need no refitting)."""
+        return self.feature_encoder.encode(songs)
+
+    def add_songs(self, new_songs):
+        """
+        Appends songs that were added to the knowledge graph's songs_data.
+        Only the new songs are encoded and embedded; the similarity index is extended incrementally.
+        """
+        if new_songs is None or len(new_songs) == 0:
+            return
+
+        model = self.model
+        embeddings_were_current = self._embeddings_are_current(model)
+        new_features = self.encode_songs(new_songs)
+        self.features_encoded = self.features_encoded.append(new_features)
+        self.song_ids = np.concatenate([self.song_ids, new_songs['song_id'].values])
+        self.catalog_version += 1
+
+        if embeddings_were_current:
+            self.song_index.add(self.embed_features(new_features.to_sparse_tensor(), model))
+            self._embedding_cache_key = (model, model.version, self.catalog_version)
+        logging.info(f"[CATALOG] Added {len(new_songs)} songs (catalog size: {len(self.song_ids)})")
+
+    def find_song_position(self, title):
+        """Returns the row position of the song with the given title."""
+        if self._title_positions is None or self._title_positions_version != self.catalog_version:
+            titles = self.rdf_knowledge_graph.songs_data['title'].values
+            # Keep the first occurrence of duplicate titles, as the previous lookup did
+            self._title_positions = {t: i for i, t in reversed(list(enumerate(titles)))}
+            self._title_positions_version = self.catalog_version
+        if title not in self._title_positions:
+            raise ValueError(f"Unknown song title: {title}")
+        return self._title_positions[title]
+
+    @profiled("get_song_recommendations")
     def get_song_recommendations(self, title, top_n=5):
         """Recommend the top N songs using the model's output for similarity calculation."""
-        self.model.eval()  # Set the model to evaluation mode
-
-        # Get the index of the song based on the title
-        song_index = self.rdf_knowledge_graph.songs_data[self.rdf_knowledge_graph.songs_data['title'] == title].index[0]
+        with metrics.timer("fungus_recommendation_seconds"):
+            # Cached, L2-normalized embeddings of all songs
+            embeddings = self.get_song_embeddings()
+            song_position = self.find_song_position(title)
 
-        # Convert song features into tensor for the model
-        song_features = torch.tensor(self.features_encoded.iloc[song_index].values, dtype=torch.float32).unsqueeze(0)
+            # Query the similarity index (excluding the song itself)
+            similar_songs_idx, _ = self.song_index.search(embeddings[song_position], top_n, exclude=(song_position,))
 
-        # Generate the model's latent representation for the given song
-        with torch.no_grad():
-            song_embedding = self.model(song_features).squeeze(0)  # Use the model's output
-
-        # Generate the model's latent representation for all songs
-        all_song_features = torch.tensor(self.features_encoded.values, dtype=torch.float32)
-        with torch.no_grad():
-            all_song_embeddings = self.model(all_song_features)  # Model-generated embeddings
-
-        # Compute cosine similarity between the selected song and all other songs using embeddings
-        song_embedding = song_embedding.numpy().reshape(1, -1)
-        all_song_embeddings = all_song_embeddings.numpy()
-        similarity_matrix = cosine_similarity(song_embedding, all_song_embeddings).flatten()
-
-        # Sort songs based on similarity (excluding the song itself)
-        similar_songs_idx = similarity_matrix.argsort()[::-1][1:top_n + 1]
-
-        # Retrieve recommended song titles
-        recommended_song_ids = self.rdf_knowledge_graph.songs_data.iloc[similar_songs_idx]['title'].values
+            # Retrieve recommended song titles
+            recommended_song_ids = self.rdf_knowledge_graph.songs_data.iloc[similar_songs_idx]['title'].values
 
         return recommended_song_ids
 
     def recommend_songs_for_user(self, user_id, top_n=5):
         """Recommend the top N songs for a user based on their previous interactions."""
+        return self.recommend_for_users([user_id], top_n=top_n)[user_id]
+
+    def recommend_for_users(self, user_ids, top_n=5, chunk_size=1024):
+        """
+        Recommend the top N songs for many users in one pass (e.g. for nightly precomputation).
+        Each user's rated songs are combined into a rating-weighted profile, so scoring all seeds is a
+        single matrix multiply; songs the user already rated are excluded.
+        """
         if self.user_ratings_data is None:
             raise ValueError("User ratings data is required for this function.")
 
-        # Get the songs the user has rated
-        user_songs = self.user_ratings_data[self.user_ratings_data['user_id'] == user_id]['song_id'].values
-
-        # Initialize a list to store recommended songs
-        recommended_songs = []
-
-        # For each song rated by the user, find similar songs
-        for song_id in user_songs:
-            similar_songs = self.get_song_recommendations(song_id, top_n=top_n)
-            recommended_songs.extend(similar_songs)
-
-        # Remove duplicates and return top N unique songs
-        recommended_songs = list(set(recommended_songs))
-
-        return recommended_songs[:top_n]
+        embeddings = self.get_song_embeddings()
+        user_ids = list(user_ids)
+        user_rows = {user_id: row for row, user_id in enumerate(user_ids)}
+
+        # Map the user's ratings to catalog positions (ratings of unknown songs are ignored)
+        song_positions = self.get_song_positions_by_id()
+        ratings = self.user_ratings_data[self.user_ratings_data['user_id'].isin(list(user_rows))]
+        positions = ratings['song_id'].astype(str).map(song_positions)
+        known = positions.notna().values
+        rating_rows = ratings['user_id'].map(user_rows).values[known].astype(np.int64)
+        rating_positions = positions.values[known].astype(np.int64)
+        rating_weights = ratings['rating'].values[known].astype(np.float32)
+
+        # Rating-weighted sum of the seed embeddings per user
+        weight_sums = np.bincount(rating_rows, weights=rating_weights, minlength=len(user_ids)).astype(np.float32)
+        profiles = np.zeros((len(user_ids), embeddings.shape[1]), dtype=np.float32)
+        np.add.at(profiles, rating_rows, rating_weights[:, None] * embeddings[rating_positions])
+        profiles /= np.maximum(weight_sums, 1e-12)[:, None]
+
+        titles = self.rdf_knowledge_graph.songs_data['title'].values
+        recommendations = {}
+        for start in range(0, len(user_ids), chunk_size):
+            # Score a chunk of users against the whole catalog at once
+            scores = profiles[start:start + chunk_size] @ embeddings.T
+            in_chunk = (rating_rows >= start) & (rating_rows < start + chunk_size)
+            scores[rating_rows[in_chunk] - start, rating_positions[in_chunk]] = -np.inf
+
+            k = min(top_n, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k > 0 else np.zeros((len(scores), 0), dtype=np.int64)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            top = np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
+
+            for row, user_id in enumerate(user_ids[start:start + chunk_size]):
+                if weight_sums[start + row] <= 0:
+                    # No rated songs in the catalog, nothing to base recommendations on
+                    recommendations[user_id] = []
+                    continue
+                user_top = top[row][np.isfinite(scores[row, top[row]])]
+                recommendations[user_id] = list(titles[user_top])
+        return recommendations
+
+    def get_song_positions_by_id(self):
+        """Returns a mapping from song id (as string) to catalog position."""
+        if self._id_positions is None or self._id_positions_version != self.catalog_version:
+            self._id_positions = {str(song_id): i for i, song_id in reversed(list(enumerate(self.song_ids)))}
+            self._id_positions_version = self.catalog_version
+        return self._id_positions
 
     def extract_song_from_string(self, text):
         logging.info(text)
-        # Check each title against the provided string
-        for title in self.rdf_knowledge_graph.songs_data['title']:
-            if title.lower() in text.lower():
-                logging.info("[USER REQUEST] Song: {}".format(title))
-                return title
+        # The title automaton is built once per catalog version
+        if self._title_matcher is None or self._title_matcher_version != self.catalog_version:
+            self._title_matcher = TitleMatcher(self.rdf_knowledge_graph.songs_data['title'])
+            self._title_matcher_version = self.catalog_version
+        title = self._title_matcher.best_match(text)
+        if title is not None:
+            logging.info("[USER REQUEST] Song: {}".format(title))
+            return title
         return "Blinding Lights"
 
 
+def fit_model(model, X, target, criterion, optimizer, num_epochs=100, batch_size=32, num_workers=0,
+              validation_split=0.2, patience=5, seed=None):
+    """
+    Trains the model on shuffled mini-batches of (features, target) examples.
+    X is either a dense tensor or SparseFeatures, whose batches are assembled into sparse tensors.
+    Part of the examples is held out; training stops once the validation loss did not improve for
+    `patience` epochs and the best weights are restored. Returns the number of epochs trained.
+    """
+    generator = torch.Generator()
+    if seed is not None:
+        generator.manual_seed(seed)
+
+    # Hold out a validation split (only if there are enough examples to train on the rest)
+    permutation = torch.randperm(len(target), generator=generator)
+    num_validation = min(int(len(target) * validation_split), len(target) - 1)
+    validation_idx, train_idx = permutation[:num_validation], permutation[num_validation:]
+
+    if isinstance(X, SparseFeatures):
+        inputs = (torch.from_numpy(X.columns), torch.from_numpy(X.values))
+        to_model_input = lambda columns, values: sparse_batch(columns, values, X.dim)
+    else:
+        inputs = (X,)
+        to_model_input = lambda x: x
+    X_validation = to_model_input(*(tensor[validation_idx] for tensor in inputs))
+    target_validation = target[validation_idx]
+
+    loader = DataLoader(TensorDataset(*(tensor[train_idx] for tensor in inputs), target[train_idx]),
+                        batch_size=batch_size, shuffle=True, num_workers=num_workers, generator=generator)
+
+    best_loss = float('inf')
+    best_state = None
+    epochs_without_improvement = 0
+    samples = 0
+    start_time = time.perf_counter()
+    epoch = 0
+    for epoch in range(1, num_epochs + 1):
+        model.train()
+        for *X_batch, target_batch in loader:
+            # Forward pass: Compute predicted ratings for the batch
+            outputs = model(to_model_input(*X_batch)).squeeze(-1)
+            loss = criterion(outputs, target_batch)
+
+            # Backward pass and optimization
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            samples += len(target_batch)
+
+        if num_validation:
+            model.eval()
+            with torch.no_grad():
+                validation_loss = criterion(model(X_validation).squeeze(-1), target_validation).item()
+            if validation_loss < best_loss:
+                best_loss = validation_loss
+                best_state = copy.deepcopy(model.state_dict())
+                epochs_without_improvement = 0
+            else:
+                epochs_without_improvement += 1
+
+        # Print the loss every 10 epochs
+        if epoch % 10 == 0:
+            print(f'Epoch [{epoch}/{num_epochs}], Loss: {loss.item():.4f}'
+                  + (f', Validation loss: {validation_loss:.4f}' if num_validation else ''))
+
+        if num_validation and epochs_without_improvement >= patience:
+            logging.info(f"[TRAINING] Early stopping after {epoch} epochs (best validation loss: {best_loss:.4f})")
+            break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"[TRAINING] Trained on {samples} samples in {elapsed:.2f}s ({samples / max(elapsed, 1e-9):.0f} samples/s)")
+    return epoch
+
+
 # Example usage:
 
 # 1. Initialize the recommendation service
@@ -193,3 +439,6 @@ class MLService:
 # 4. Recommend songs for a user
 # user_recommendations = recommendation_service.recommend_songs_for_user(user_id=104, top_n=5)
 # print(f"Top 5 recommended songs for user 104: {user_recommendations}")
+
+# 5. Precompute recommendations for many users at once
+# all_recommendations = recommendation_service.recommend_for_users([101, 102, 103], top_n=5)
@@ -1,7 +1,10 @@
+import io
 import unittest
+import numpy as np
 import torch
 import pandas as pd
-from machine_learning_service import MLService
+from machine_learning_service import MLService, fit_model
+from catalog_snapshot import CatalogSnapshot
 
 class MockRDFKnowledgeGraph:
     def __init__(self):
@@ -24,20 +27,137 @@ class TestMLService(unittest.TestCase):
         self.assertEqual(features_encoded.shape[0], 3)
         self.assertEqual(len(song_ids), 3)
 
+    def test_restore_from_catalog_snapshot(self):
+        snapshot = CatalogSnapshot(self.rdf_knowledge_graph.songs_data, self.service.catalog_snapshot_arrays(),
+                                   self.service.feature_encoder.config())
+
+        restored = MLService(rdf_knowledge_graph=self.rdf_knowledge_graph, catalog_snapshot=snapshot)
+
+        np.testing.assert_array_equal(restored.features_encoded.to_dense(), self.service.features_encoded.to_dense())
+
+    def test_input_dim_does_not_depend_on_catalog(self):
+        self.rdf_knowledge_graph.songs_data = self.rdf_knowledge_graph.songs_data.iloc[:1]
+        other_service = MLService(rdf_knowledge_graph=self.rdf_knowledge_graph)
+
+        self.assertEqual(other_service.input_dim, self.service.input_dim)
+        other_service.model.set_state(self.service.model.get_state())
+
     def test_train_model(self):
         self.service.train_model()
         self.assertIsInstance(self.service.model, MLService.ContentBasedNeuralNetwork)
 
+    def test_train_model_on_user_ratings(self):
+        ratings = io.StringIO("user_id,song_id,rating\n101,1,4.5\n101,2,2.0\n102,3,5.0\n103,1,4.0\n104,99,1.0\n")
+        service = MLService(rdf_knowledge_graph=self.rdf_knowledge_graph, user_ratings_csv=ratings,
+                            num_epochs=200, batch_size=2, validation_split=0.25, patience=3)
+
+        X, target = service.build_training_examples()
+        self.assertEqual(tuple(X.shape), (4, service.input_dim))
+        self.assertEqual(target.tolist(), [4.5, 2.0, 5.0, 4.0])
+
+        before = {k: v.clone() for k, v in service.model.get_state().items()}
+        service.train_model()
+        self.assertFalse(torch.equal(before['fc1.weight'], service.model.get_state()['fc1.weight']))
+
+    def test_fit_model_stops_early(self):
+        model = MLService.ContentBasedNeuralNetwork(4, 8, 1)
+        X = torch.randn(40, 4)
+        target = torch.randn(40)
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+
+        epochs = fit_model(model, X, target, torch.nn.MSELoss(), optimizer, num_epochs=500, batch_size=8,
+                           validation_split=0.25, patience=2, seed=0)
+
+        self.assertLess(epochs, 500)
+
+    def test_train_model_without_ratings_is_skipped(self):
+        before = self.service.model.version
+        self.service.train_model()
+        self.assertEqual(self.service.model.version, before)
+
     def test_get_song_recommendations(self):
         self.service.train_model()
         recommendations = self.service.get_song_recommendations('Song A', top_n=2)
         self.assertEqual(len(recommendations), 2)
         self.assertTrue(all(isinstance(song, str) for song in recommendations))
 
+    def test_song_embeddings_cached_until_model_changes(self):
+        self.service.user_ratings_data = pd.DataFrame({'user_id': [1, 1], 'song_id': [1, 2], 'rating': [4.0, 2.0]})
+        embeddings = self.service.get_song_embeddings()
+        self.assertIs(self.service.get_song_embeddings(), embeddings)
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertTrue(embeddings.flags['C_CONTIGUOUS'])
+
+        self.service.model.set_state(self.service.model.get_state())
+        self.assertIsNot(self.service.get_song_embeddings(), embeddings)
+
+        embeddings = self.service.get_song_embeddings()
+        self.service.train_model()
+        self.assertIsNot(self.service.get_song_embeddings(), embeddings)
+
+    def test_swap_model_replaces_model_and_index(self):
+        old_model = self.service.model
+        embeddings = self.service.get_song_embeddings()
+        new_state = {k: torch.randn_like(v) for k, v in old_model.get_state().items()}
+
+        self.service.swap_model(new_state)
+
+        self.assertIsNot(self.service.model, old_model)
+        self.assertGreater(self.service.model.version, old_model.version)
+        self.assertTrue(torch.equal(self.service.model.get_state()['fc1.weight'], new_state['fc1.weight']))
+        # The old model is left untouched and the new index is ready before the first request
+        self.assertFalse(torch.equal(old_model.get_state()['fc1.weight'], new_state['fc1.weight']))
+        self.assertTrue(self.service._embeddings_are_current())
+        self.assertIsNot(self.service.get_song_embeddings(), embeddings)
+
+    def test_training_job_snapshots_examples(self):
+        self.service.user_ratings_data = pd.DataFrame({'user_id': [1, 1], 'song_id': [1, 3], 'rating': [4.0, 2.0]})
+        job = self.service.training_job(peer_states=[], aggregation_options={"strategy": "median"})
+
+        self.assertEqual(job.model_dims, (self.service.input_dim, 64, 1))
+        self.assertEqual(len(job.features), 2)
+        self.assertEqual(job.target.tolist(), [4.0, 2.0])
+        self.assertEqual(job.aggregation_options, {"strategy": "median"})
+        job.model_state['fc1.bias'].add_(1)
+        self.assertFalse(torch.equal(self.service.model.get_state()['fc1.bias'], job.model_state['fc1.bias']))
+
+    def test_add_songs_extends_embeddings_incrementally(self):
+        self.service.get_song_embeddings()
+        new_songs = pd.DataFrame({
+            'song_id': [4], 'title': ['Song D'], 'genre': ['Rock'],
+            'artist': ['Unknown Artist'], 'tempo': [125], 'duration': [210]
+        })
+        self.rdf_knowledge_graph.songs_data = pd.concat([self.rdf_knowledge_graph.songs_data, new_songs], ignore_index=True)
+
+        self.service.add_songs(new_songs)
+
+        self.assertEqual(self.service.get_song_embeddings().shape[0], 4)
+        self.assertEqual(self.service.features_encoded.shape, (4, self.service.input_dim))
+        self.assertIn('Song D', self.service.get_song_recommendations('Song A', top_n=3))
+
     def test_recommend_songs_for_user_no_data(self):
         with self.assertRaises(ValueError):
             self.service.recommend_songs_for_user(user_id=1)
 
+    def test_recommend_songs_for_user_excludes_rated_songs(self):
+        ratings = io.StringIO("user_id,song_id,rating\n101,1,4.5\n101,2,2.0\n102,3,5.0\n")
+        service = MLService(rdf_knowledge_graph=self.rdf_knowledge_graph, user_ratings_csv=ratings)
+
+        recommendations = service.recommend_songs_for_user(101, top_n=5)
+
+        self.assertEqual(recommendations, ['Song C'])
+
+    def test_recommend_for_users_batch(self):
+        ratings = io.StringIO("user_id,song_id,rating\n101,1,4.5\n102,3,5.0\n")
+        service = MLService(rdf_knowledge_graph=self.rdf_knowledge_graph, user_ratings_csv=ratings)
+
+        recommendations = service.recommend_for_users([101, 102, 999], top_n=2)
+
+        self.assertEqual(len(recommendations[101]), 2)
+        self.assertNotIn('Song A', recommendations[101])
+        self.assertNotIn('Song C', recommendations[102])
+        self.assertEqual(recommendations[999], [])
+
     def test_extract_song_from_string(self):
         result = self.service.extract_song_from_string("I love Song A!")
         self.assertEqual(result, "Song A")
@@ -7,6 +7,12 @@ from mastodon_client import MastodonClient
 import datetime
 import random
 from machine_learning_service import MLService
+from feature_encoder import HashedSongFeatureEncoder
+from catalog_snapshot import catalog_fingerprint, load_catalog_snapshot, save_catalog_snapshot
+from training_worker import BackgroundTrainer
+from epoch_scheduler import EpochScheduler
+import metrics
+from profiling import profiler
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,67 +26,205 @@ logging.basicConfig(
 class MusicRecommendationFungus:
     def __init__(self):
         logging.info("[INIT] Initializing Music Recommendation instance")
+        # Prometheus endpoint and/or JSON file, if METRICS_ENABLED
+        self.metrics_exporters = metrics.start_exporters()
+        # Opt-in profiling of the next epochs (PROFILING=true, or `kill -USR1 <pid>` at runtime)
+        self.profiler = profiler
+        self.profiler.install_signal_handler()
         self.mastodon_client = MastodonClient()
-        self.knowledge_graph = RDFKnowledgeGraph(mastodon_client=self.mastodon_client)
-        self.knowledge_graph.insert_songs_from_csv('songs.csv')
-        self.machine_learning_service = MLService(self.knowledge_graph, user_ratings_csv='user_ratings.csv')
-        self.knowledge_graph.insert_model_state("my-model", self.machine_learning_service.model.get_state())
+
+        # Warm start: reuse the local catalog snapshot if songs.csv and the knowledge base are unchanged
+        snapshot_dir = os.getenv("CATALOG_SNAPSHOT_DIR", ".catalog_snapshot")
+        fingerprint = catalog_fingerprint('songs.csv', os.getenv("RDF_STORE_BACKEND", "fuseki"),
+                                          os.getenv("FUSEKI_SERVER_URL"), HashedSongFeatureEncoder().config())
+        snapshot = load_catalog_snapshot(snapshot_dir, fingerprint)
+        self.knowledge_graph = RDFKnowledgeGraph(mastodon_client=self.mastodon_client, load_songs=False)
+        if snapshot is not None and not self.store_holds_catalog(snapshot.songs_data):
+            logging.info("[INIT] Knowledge base lacks the snapshot's songs (e.g. it was reset), ingesting them again")
+            snapshot = None
+        if snapshot is not None:
+            logging.info("[INIT] Catalog unchanged, skipping song ingestion")
+            self.knowledge_graph.songs_data = snapshot.songs_data
+        else:
+            self.knowledge_graph.insert_songs_from_csv('songs.csv')
+            self.knowledge_graph.fetch_all_songs()
+        self.machine_learning_service = MLService(self.knowledge_graph, user_ratings_csv='user_ratings.csv',
+                                                  catalog_snapshot=snapshot)
+        if snapshot is None:
+            try:
+                save_catalog_snapshot(snapshot_dir, fingerprint, self.knowledge_graph.songs_data,
+                                      self.machine_learning_service.catalog_snapshot_arrays(),
+                                      self.machine_learning_service.feature_encoder.config())
+            except Exception as e:
+                logging.warning(f"[SNAPSHOT] Could not save catalog snapshot: {e}")
+        # Adaptive epoch interval and per-subsystem backoff (Fuseki vs Mastodon)
+        self.scheduler = EpochScheduler()
+        self.scheduler.call("fuseki", self.knowledge_graph.insert_model_state, "my-model",
+                            self.machine_learning_service.model.get_state())
         self.feedback_threshold = float(os.getenv("FEEDBACK_THRESHOLD", 0.5))
         logging.info(f"[CONFIG] Feedback threshold set to {self.feedback_threshold}")
+        self.compaction_interval = int(os.getenv("MODEL_COMPACTION_INTERVAL", 10))
+        # Train and aggregate in a worker process so replies do not stall while PyTorch trains
+        self.trainer = BackgroundTrainer() if os.getenv("BACKGROUND_TRAINING", "true").lower() == "true" else None
+        self.statuses_received = 0
+        # Catalog version and peer state hashes the model was last trained with, and those of the running job
+        self.last_training_inputs = None
+        self.pending_training_inputs = None
+        # Answer statuses as they are pushed instead of once per epoch (polling stays as the fallback)
+        if os.getenv("MASTODON_STREAMING", "true").lower() == "true":
+            self.mastodon_client.start_streaming()
+
+    def store_holds_catalog(self, songs_data):
+        """Checks with one query that the knowledge base still holds the songs of a snapshot."""
+        if len(songs_data.index) == 0:
+            return True
+        try:
+            return self.knowledge_graph.max_song_id() >= int(songs_data['song_id'].max())
+        except Exception as e:
+            # The songs could not be ingested anyway
+            logging.warning(f"[SNAPSHOT] Could not check the knowledge base, using the snapshot: {e}")
+            return True
 
     def start(self):
         switch_team = True
         found_initial_team = False
         i = 0
+        last_observed = time.monotonic()
+        statuses_observed = self.statuses_received
         while True:
             logging.info(f"[START] Starting epoche {i} (at {datetime.datetime.now()})")
+            epoch_start = time.perf_counter()
+            self.profiler.start_epoch(i)
             try:
+                link_to_model = None
                 if switch_team or not found_initial_team:
                     logging.info("[CHECK] Searching for a new fungus group")
-                    messages, random_mycelial_tag = self.mastodon_client.get_statuses_from_random_mycelial_tag()
-                    link_to_model = self.knowledge_graph.look_for_new_fungus_group_in_statuses(messages, random_mycelial_tag)
-                    self.knowledge_graph.look_for_song_data_in_statuses_to_insert(messages)
-                    self.knowledge_graph.on_found_group_to_join(link_to_model)
+                    with metrics.timer("fungus_stage_seconds", stage="group_discovery"):
+                        found = self.scheduler.call("mastodon", self.mastodon_client.get_statuses_from_random_mycelial_tag)
+                        if found is not None:
+                            link_to_model = self.scheduler.call("fuseki", self.join_fungus_group, *found)
+                        # Joining a group changes the nutrial tag; the stream follows it
+                        self.mastodon_client.switch_streaming()
                 else:
                     logging.info("[WAIT] No new groups found.")
-                    link_to_model = None
+
+                # Pick up songs other nodes added to the knowledge base since the last epoch
+                with metrics.timer("fungus_stage_seconds", stage="song_ingestion"):
+                    self.machine_learning_service.add_songs(self.scheduler.call("fuseki", self.knowledge_graph.fetch_all_songs))
+
+                # Deploy the model the background worker finished since the last epoch
+                with metrics.timer("fungus_stage_seconds", stage="deployment"):
+                    self.deploy_trained_model()
 
                 if link_to_model is not None:
                     logging.info("[TRAINING] New fungus group detected, initiating training")
-                    self.train_model()
-                    all_models = self.knowledge_graph.fetch_all_model_from_knowledge_base(link_to_model)
-                    logging.info(f"Received models from other nodes (size: {len(all_models)})")
-                    aggregated_model_state = self.knowledge_graph.aggregate_model_states(self.machine_learning_service.model.get_state(), all_models)
-                    # deploy new model
-                    self.machine_learning_service.model.set_state(aggregated_model_state)
-                    logging.info("[SAVING] Deployed aggregated model as new model")
+                    with metrics.timer("fungus_stage_seconds", stage="peer_fetch"):
+                        all_models = self.scheduler.call("fuseki", self.knowledge_graph.fetch_all_model_from_knowledge_base,
+                                                         link_to_model)
+                    # Training only needs the CPU, so its errors must not back off Fuseki
+                    if all_models is not None:
+                        self.retrain(all_models)
 
-                feedback = self.answer_user_feedback()
-                logging.info(f"[FEEDBACK] Received feedback: {feedback}")
+                if i % self.compaction_interval == 0:
+                    logging.info("[COMPACT] Garbage-collecting stale model states")
+                    with metrics.timer("fungus_stage_seconds", stage="compaction"):
+                        self.scheduler.call("fuseki", self.knowledge_graph.compact_model_states)
 
-                switch_team = self.decide_whether_to_switch_team(feedback)
+                feedback = self.scheduler.call("mastodon", self.answer_user_feedback)
+                self.mastodon_client.save_reply_state()
+                logging.info(f"[RATE LIMIT] Mastodon request stats: {self.mastodon_client.scheduler.stats()}")
+                query_cache_stats = getattr(self.knowledge_graph.store, "stats", None)
+                if query_cache_stats is not None:
+                    logging.info(f"[SPARQL CACHE] Query cache stats: {query_cache_stats()}")
+                if feedback is not None:
+                    logging.info(f"[FEEDBACK] Received feedback: {feedback}")
 
-                self.evolve_behavior(feedback)
+                    switch_team = self.decide_whether_to_switch_team(feedback)
 
-                logging.info("[SLEEP] Sleeping for 20 seconds")
-                time.sleep(20)
-                i = i + 1
+                    self.evolve_behavior(feedback)
             except Exception as e:
                 logging.error(f"[ERROR] An error occurred: {e}", exc_info=True)
-                time.sleep(60)
+                metrics.increment("fungus_epoch_errors_total")
+            metrics.observe("fungus_epoch_seconds", time.perf_counter() - epoch_start)
+            self.profiler.end_epoch()
+
+            # Poll busy hashtags more often than idle ones
+            now = time.monotonic()
+            interval = self.scheduler.next_interval(self.statuses_received - statuses_observed, now - last_observed)
+            last_observed, statuses_observed = now, self.statuses_received
+            logging.info(f"[SLEEP] Waiting {interval:.0f} seconds for new statuses")
+            self.wait_for_statuses(interval)
+            i = i + 1
+
+    def join_fungus_group(self, messages, random_mycelial_tag):
+        """Looks for a fungus group and song data in the statuses; returns the group's model link (or None)."""
+        link_to_model = self.knowledge_graph.look_for_new_fungus_group_in_statuses(messages, random_mycelial_tag)
+        new_songs = self.knowledge_graph.look_for_song_data_in_statuses_to_insert(messages)
+        self.machine_learning_service.add_songs(new_songs)
+        self.knowledge_graph.on_found_group_to_join(link_to_model)
+        return link_to_model
+
+    def retrain(self, all_models):
+        """Trains on the local ratings and aggregates the peer models, unless none of the inputs changed."""
+        logging.info(f"Received models from other nodes (size: {len(all_models)})")
+        training_inputs = (self.machine_learning_service.catalog_version,
+                           tuple(sorted(str(model.get("stateHash")) for model in all_models)))
+        if training_inputs == self.last_training_inputs:
+            logging.info("[TRAINING] Catalog and peer models unchanged, skipping retraining")
+            return
+
+        if self.trainer is not None:
+            # Only recorded once the job was deployed, so that a failed job is retried
+            if self.start_background_training(all_models):
+                self.pending_training_inputs = training_inputs
+            return
+
+        self.train_model()
+        with metrics.timer("fungus_stage_seconds", stage="aggregation"):
+            aggregated_model_state = self.knowledge_graph.aggregate_model_states(self.machine_learning_service.model.get_state(), all_models)
+        # deploy new model
+        self.machine_learning_service.swap_model(aggregated_model_state)
+        logging.info("[SAVING] Deployed aggregated model as new model")
+        self.last_training_inputs = training_inputs
 
     def train_model(self):
         try:
             logging.info("[TRAINING] Starting model training")
-            self.machine_learning_service.train_model()
-            model = self.machine_learning_service.model
+            with metrics.timer("fungus_stage_seconds", stage="training"):
+                self.machine_learning_service.train_model()
             logging.info(f"[RESULT] Model trained successfully.")
-            self.knowledge_graph.save_model("my-model", model)
-            logging.info("[STORE] Model saved to RDF Knowledge Graph")
-            self.mastodon_client.post_status(f"[FUNGUS] Model updated.")
-            logging.info("[NOTIFY] Status posted to Mastodon")
         except Exception as e:
-            logging.error(f"[ERROR] Failed during training and deployment: {e}", exc_info=True)
+            logging.error(f"[ERROR] Failed during training: {e}", exc_info=True)
+            return
+        self.scheduler.call("fuseki", self.publish_model_state, self.machine_learning_service.model.get_state())
+
+    def publish_model_state(self, model_state):
+        """Saves the locally trained state for the peers and announces it; store errors are raised."""
+        self.knowledge_graph.insert_model_state("my-model", model_state)
+        logging.info("[STORE] Model saved to RDF Knowledge Graph")
+        self.mastodon_client.post_status(f"[FUNGUS] Model updated.")
+        logging.info("[NOTIFY] Status posted to Mastodon")
+
+    def start_background_training(self, all_models):
+        """Hands training and aggregation with the peer models to the background worker."""
+        job = self.machine_learning_service.training_job(all_models, self.knowledge_graph.aggregation_options())
+        job.profile_directory = self.profiler.epoch_directory
+        if self.trainer.submit(job):
+            logging.info("[TRAINING] Training started in the background")
+            return True
+        return False
+
+    def deploy_trained_model(self):
+        """Swaps in the weights of a finished background job and publishes the locally trained state."""
+        result = self.trainer.poll() if self.trainer is not None else None
+        if result is None:
+            return
+        # Training and aggregation ran in the worker, which has its own registry
+        metrics.observe("fungus_stage_seconds", result.elapsed, stage="background_training")
+        self.machine_learning_service.swap_model(result.model_state, result.optimizer_state)
+        self.last_training_inputs = self.pending_training_inputs
+        logging.info("[SAVING] Deployed aggregated model as new model")
+        self.scheduler.call("fuseki", self.publish_model_state, result.trained_state)
 
     def decide_whether_to_switch_team(self, feedback):
         switch_decision = feedback < self.feedback_threshold
@@ -88,22 +232,60 @@ class MusicRecommendationFungus:
         return switch_decision
 
     def answer_user_feedback(self):
-        statuses = self.mastodon_client.fetch_latest_statuses(None, None)
+        # Only statuses posted since the last poll are transferred (catches anything the stream missed)
+        hashtag = self.mastodon_client.nutrial_tag
+        statuses = self.mastodon_client.fetch_new_statuses(hashtag)
         feedback = 1
-        fresh_statuses = filter(lambda s: s["id"] not in self.mastodon_client.ids_of_replied_statuses, statuses)
-        for status in fresh_statuses:
-            if "[FUNGUS]" not in status['content']:
-                song_titles = self.machine_learning_service.get_song_recommendations(self.machine_learning_service.extract_song_from_string(status['content']), 3)
-                self.mastodon_client.reply_to_status(status['id'], status['account']['username'], "[FUNGUS] " + str(song_titles))
+        with metrics.timer("fungus_stage_seconds", stage="reply_handling"):
+            unanswered_ids = self.answer_statuses(statuses)
+        # Statuses whose reply failed are fetched again by the next poll
+        self.mastodon_client.advance_cursor(hashtag, statuses, unanswered_ids)
         # count feedback
-        num_of_statuses_send = len(self.mastodon_client.ids_of_replied_statuses)
-        overall_favourites = self.mastodon_client.count_likes_of_all_statuses()
+        num_of_statuses_send = len(self.mastodon_client.reply_state)
+        with metrics.timer("fungus_stage_seconds", stage="likes_counting"):
+            overall_favourites = self.mastodon_client.count_likes_of_all_statuses()
         if overall_favourites > 0:
             feedback = num_of_statuses_send / overall_favourites
         else:
             feedback = 0
         return feedback
 
+    def answer_statuses(self, statuses):
+        """Replies with recommendations to the statuses that were not answered yet; returns the ids of failed replies."""
+        fresh_statuses = [s for s in statuses if s["id"] not in self.mastodon_client.reply_state]
+        self.statuses_received += len(fresh_statuses)
+        metrics.increment("fungus_statuses_received_total", len(fresh_statuses))
+        replies = []
+        unanswered_ids = []
+        for status in fresh_statuses:
+            if "[FUNGUS]" not in status['content']:
+                # A status the model cannot handle must neither drop the other replies nor back off Mastodon
+                try:
+                    song_titles = self.machine_learning_service.get_song_recommendations(self.machine_learning_service.extract_song_from_string(status['content']), 3)
+                except Exception as e:
+                    logging.error(f"[ERROR] Failed to recommend songs for status {status['id']}: {e}", exc_info=True)
+                    metrics.increment("fungus_recommendation_errors_total")
+                    unanswered_ids.append(status['id'])
+                    continue
+                replies.append((status['id'], status['account']['username'], "[FUNGUS] " + str(song_titles)))
+        # Send the replies concurrently
+        sent = self.mastodon_client.reply_to_statuses(replies)
+        return unanswered_ids + [status_id for (status_id, _, _), ok in zip(replies, sent) if not ok]
+
+    def wait_for_statuses(self, seconds):
+        """Waits until the next epoch, answering statuses pushed by the stream as soon as they arrive."""
+        deadline = time.monotonic() + seconds
+        remaining = seconds
+        while remaining > 0:
+            statuses = self.mastodon_client.wait_for_streamed_statuses(remaining)
+            if statuses:
+                logging.info(f"[STREAMING] Answering {len(statuses)} streamed statuses")
+                try:
+                    self.answer_statuses(statuses)
+                except Exception as e:
+                    logging.error(f"[ERROR] Failed to answer streamed statuses: {e}", exc_info=True)
+            remaining = deadline - time.monotonic()
+
     def evolve_behavior(self, feedback):
         mutation_chance = 0.1
         if random.random() < mutation_chance:
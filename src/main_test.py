@@ -1,16 +1,24 @@
+import time
 import unittest
 from unittest.mock import patch, MagicMock
+import pandas as pd
+import requests
 from main import MusicRecommendationFungus
 
 class TestMusicRecommendationFungus(unittest.TestCase):
 
+    @patch('main.BackgroundTrainer')
+    @patch('main.save_catalog_snapshot')
+    @patch('main.load_catalog_snapshot', return_value=None)
     @patch('main.MastodonClient')
     @patch('main.RDFKnowledgeGraph')
     @patch('main.MLService')
-    def setUp(self, MockMLService, MockRDFKnowledgeGraph, MockMastodonClient):
+    def setUp(self, MockMLService, MockRDFKnowledgeGraph, MockMastodonClient, mock_load_snapshot, mock_save_snapshot,
+              MockBackgroundTrainer):
         self.mock_mastodon = MockMastodonClient.return_value
         self.mock_knowledge_graph = MockRDFKnowledgeGraph.return_value
         self.mock_ml_service = MockMLService.return_value
+        self.mock_trainer = MockBackgroundTrainer.return_value
         self.music_fungus = MusicRecommendationFungus()
 
     def test_initialization(self):
@@ -18,10 +26,163 @@ class TestMusicRecommendationFungus(unittest.TestCase):
         self.assertIsNotNone(self.music_fungus.knowledge_graph)
         self.assertIsNotNone(self.music_fungus.machine_learning_service)
 
+    @patch('main.BackgroundTrainer')
+    @patch('main.save_catalog_snapshot')
+    @patch('main.load_catalog_snapshot')
+    @patch('main.MastodonClient')
+    @patch('main.RDFKnowledgeGraph')
+    @patch('main.MLService')
+    def test_warm_start_skips_song_ingestion(self, MockMLService, MockRDFKnowledgeGraph, MockMastodonClient,
+                                             mock_load_snapshot, mock_save_snapshot, MockBackgroundTrainer):
+        mock_load_snapshot.return_value.songs_data = pd.DataFrame({"song_id": [1, 2, 3]})
+        MockRDFKnowledgeGraph.return_value.max_song_id.return_value = 3
+        fungus = MusicRecommendationFungus()
+
+        MockRDFKnowledgeGraph.return_value.insert_songs_from_csv.assert_not_called()
+        MockRDFKnowledgeGraph.return_value.fetch_all_songs.assert_not_called()
+        mock_save_snapshot.assert_not_called()
+        self.assertIs(fungus.knowledge_graph.songs_data, mock_load_snapshot.return_value.songs_data)
+
+    @patch('main.BackgroundTrainer')
+    @patch('main.save_catalog_snapshot')
+    @patch('main.load_catalog_snapshot')
+    @patch('main.MastodonClient')
+    @patch('main.RDFKnowledgeGraph')
+    @patch('main.MLService')
+    def test_warm_start_reseeds_empty_store(self, MockMLService, MockRDFKnowledgeGraph, MockMastodonClient,
+                                            mock_load_snapshot, mock_save_snapshot, MockBackgroundTrainer):
+        mock_load_snapshot.return_value.songs_data = pd.DataFrame({"song_id": [1, 2, 3]})
+        MockRDFKnowledgeGraph.return_value.max_song_id.return_value = 0
+        MusicRecommendationFungus()
+
+        MockRDFKnowledgeGraph.return_value.insert_songs_from_csv.assert_called_once_with('songs.csv')
+        MockRDFKnowledgeGraph.return_value.fetch_all_songs.assert_called_once()
+        self.assertIsNone(MockMLService.call_args.kwargs["catalog_snapshot"])
+        mock_save_snapshot.assert_called_once()
+
     def test_train_model(self):
         self.music_fungus.train_model()
         self.mock_ml_service.train_model.assert_called_once()
-        self.mock_knowledge_graph.save_model.assert_called_once()
+        self.mock_knowledge_graph.insert_model_state.assert_called_with(
+            "my-model", self.mock_ml_service.model.get_state.return_value)
+
+    def test_failed_model_publish_backs_off_fuseki(self):
+        self.mock_knowledge_graph.insert_model_state.side_effect = Exception("unreachable")
+
+        self.music_fungus.deploy_trained_model()
+
+        self.mock_ml_service.swap_model.assert_called_once()
+        self.assertEqual(self.music_fungus.scheduler.backoffs["fuseki"].failures, 1)
+        self.mock_mastodon.post_status.assert_not_called()
+
+    def test_retrain_in_background(self):
+        self.music_fungus.retrain([{"model": "peer"}])
+
+        self.mock_ml_service.training_job.assert_called_once_with(
+            [{"model": "peer"}], self.mock_knowledge_graph.aggregation_options.return_value)
+        self.mock_trainer.submit.assert_called_once_with(self.mock_ml_service.training_job.return_value)
+        self.mock_ml_service.train_model.assert_not_called()
+
+    def test_retrain_skipped_when_nothing_changed(self):
+        self.mock_ml_service.catalog_version = 3
+        self.music_fungus.retrain([{"stateHash": "a"}])
+        self.music_fungus.deploy_trained_model()
+        self.music_fungus.retrain([{"stateHash": "a"}])
+        self.assertEqual(self.mock_trainer.submit.call_count, 1)
+
+        # A changed peer model or a grown catalog trigger training again
+        self.music_fungus.retrain([{"stateHash": "b"}])
+        self.music_fungus.deploy_trained_model()
+        self.mock_ml_service.catalog_version = 4
+        self.music_fungus.retrain([{"stateHash": "b"}])
+        self.assertEqual(self.mock_trainer.submit.call_count, 3)
+
+    def test_retrain_retried_when_job_failed(self):
+        self.music_fungus.retrain([{"stateHash": "a"}])
+        # A failed job is dropped by the trainer
+        self.mock_trainer.poll.return_value = None
+        self.music_fungus.deploy_trained_model()
+
+        self.music_fungus.retrain([{"stateHash": "a"}])
+
+        self.assertEqual(self.mock_trainer.submit.call_count, 2)
+
+    def test_retrain_retried_when_worker_busy(self):
+        self.mock_trainer.submit.return_value = False
+        self.music_fungus.retrain([])
+        self.mock_trainer.submit.return_value = True
+        self.music_fungus.retrain([])
+        self.assertEqual(self.mock_trainer.submit.call_count, 2)
+
+    def test_deploy_trained_model(self):
+        result = self.mock_trainer.poll.return_value
+        self.music_fungus.deploy_trained_model()
+
+        self.mock_ml_service.swap_model.assert_called_once_with(result.model_state, result.optimizer_state)
+        self.mock_knowledge_graph.insert_model_state.assert_called_with("my-model", result.trained_state)
+        self.mock_mastodon.post_status.assert_called_once()
+
+    def test_deploy_without_finished_training(self):
+        self.mock_trainer.poll.return_value = None
+        self.music_fungus.deploy_trained_model()
+        self.mock_ml_service.swap_model.assert_not_called()
+
+    def test_streaming_started_on_init(self):
+        self.mock_mastodon.start_streaming.assert_called_once()
+
+    def test_wait_for_statuses_answers_streamed_statuses(self):
+        status = {"id": "1", "content": "Play Song A", "account": {"username": "user"}}
+        self.mock_mastodon.reply_state = set()
+        pushed = [[status]]
+        # Blocks like the real queue once nothing is pushed anymore
+        self.mock_mastodon.wait_for_streamed_statuses.side_effect = \
+            lambda timeout: pushed.pop() if pushed else time.sleep(timeout) or []
+        self.mock_ml_service.get_song_recommendations.return_value = ["Song B"]
+
+        self.music_fungus.wait_for_statuses(0.05)
+
+        self.mock_mastodon.reply_to_statuses.assert_called_once_with([("1", "user", "[FUNGUS] ['Song B']")])
+
+    def test_answer_user_feedback_holds_cursor_at_failed_replies(self):
+        statuses = [{"id": "2", "content": "Play Song A", "account": {"username": "a"}},
+                    {"id": "1", "content": "[FUNGUS] Model updated.", "account": {"username": "b"}}]
+        self.mock_mastodon.fetch_new_statuses.return_value = statuses
+        self.mock_mastodon.reply_state = set()
+        self.mock_mastodon.reply_to_statuses.return_value = [False]
+        self.mock_mastodon.count_likes_of_all_statuses.return_value = 0
+
+        self.music_fungus.answer_user_feedback()
+
+        self.mock_mastodon.advance_cursor.assert_called_once_with(self.mock_mastodon.nutrial_tag, statuses, ["2"])
+
+    def test_recommendation_error_only_skips_its_status(self):
+        statuses = [{"id": "2", "content": "Play Song A", "account": {"username": "a"}},
+                    {"id": "1", "content": "Play Unknown", "account": {"username": "b"}}]
+        self.mock_mastodon.fetch_new_statuses.return_value = statuses
+        self.mock_mastodon.reply_state = set()
+        self.mock_mastodon.reply_to_statuses.return_value = [True]
+        self.mock_mastodon.count_likes_of_all_statuses.return_value = 0
+        self.mock_ml_service.extract_song_from_string.side_effect = lambda content: content
+
+        def recommend(song, count):
+            if song != "Play Song A":
+                raise ValueError("Song not found in catalog")
+            return ["Song B"]
+        self.mock_ml_service.get_song_recommendations.side_effect = recommend
+
+        self.assertIsNotNone(self.music_fungus.scheduler.call("mastodon", self.music_fungus.answer_user_feedback))
+
+        self.mock_mastodon.reply_to_statuses.assert_called_once_with([("2", "a", "[FUNGUS] ['Song B']")])
+        self.mock_mastodon.advance_cursor.assert_called_once_with(self.mock_mastodon.nutrial_tag, statuses, ["1"])
+        self.assertEqual(self.music_fungus.scheduler.backoffs["mastodon"].failures, 0)
+
+    def test_failed_status_fetch_backs_off_mastodon(self):
+        self.mock_mastodon.fetch_new_statuses.side_effect = requests.exceptions.ConnectionError("down")
+
+        self.assertIsNone(self.music_fungus.scheduler.call("mastodon", self.music_fungus.answer_user_feedback))
+
+        self.assertEqual(self.music_fungus.scheduler.backoffs["mastodon"].failures, 1)
+        self.assertEqual(self.music_fungus.scheduler.backoffs["fuseki"].failures, 0)
 
     def test_decide_whether_to_switch_team(self):
         feedback_below_threshold = 0.4
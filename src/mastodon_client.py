@@ -2,30 +2,92 @@
 import requests
 import os
 import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 import random
+from urllib.parse import quote
+import metrics
+from reply_state_store import ReplyStateStore
+from mastodon_streaming import HashtagStream
+from request_scheduler import (RateLimitScheduler, PRIORITY_REPLY, PRIORITY_FETCH, PRIORITY_POST,
+                               PRIORITY_LIKES)
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 class MastodonClient:
-    def __init__(self):
+    def __init__(self, max_workers=None, timeout=None, retries=None, rate_limit_retries=None, scheduler=None,
+                 reply_state=None):
+        # Settings are read when the client is created, after the .env file was loaded
+        if max_workers is None:
+            max_workers = int(os.getenv("MASTODON_MAX_WORKERS", 8))
+        if timeout is None:
+            timeout = float(os.getenv("MASTODON_TIMEOUT_SECONDS", 10))
+        if retries is None:
+            retries = int(os.getenv("MASTODON_RETRIES", 3))
+        if rate_limit_retries is None:
+            rate_limit_retries = int(os.getenv("MASTODON_RATE_LIMIT_RETRIES", 1))
         self.api_token = os.getenv("MASTODON_API_KEY")
         self.instance_url = os.getenv("MASTODON_INSTANCE_URL")
         self.nutrial_tag = os.getenv("NUTRIAL_TAG")
-        self.ids_of_replied_statuses = []
-        self.ids_of_replies = []
+        # Answered statuses, reply ids, cached favourites and polling cursors, persisted across restarts
+        self.reply_state = reply_state if reply_state is not None else ReplyStateStore()
+        self.page_size = int(os.getenv("MASTODON_PAGE_SIZE", 40))
+        # Push-based ingestion: hashtag streams feed new statuses into status_queue
+        self.streaming_url = os.getenv("MASTODON_STREAMING_URL") or self.instance_url
+        self.status_queue = queue.Queue()
+        self.streams = {}
+        self.max_pages = int(os.getenv("MASTODON_MAX_PAGES", 10))
+        # Failed replies hold back the cursor, so they are fetched and retried until they succeed or run out of attempts
+        self.max_reply_attempts = int(os.getenv("MASTODON_REPLY_ATTEMPTS", 3))
+        self.reply_attempts = {}
+        self.timeout = timeout
+        self.session = self.create_session(max_workers, retries)
+        # Bounded parallelism for fetching favourites counts and sending replies
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mastodon")
+        # Spaces requests within the instance's rate limit, replies first
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.rate_limit_retries = rate_limit_retries
+
+    def create_session(self, pool_size, retries):
+        """
+        Creates a keep-alive session with one connection per worker and the auth headers set once.
+        Connection errors and 5xx responses of GET requests are retried with exponential backoff;
+        POST requests are only retried if the connection could not be established (they are not idempotent).
+        """
+        session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset({"GET"}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            'Authorization': f'Bearer {self.api_token}',
+            'Accept': 'application/json'
+        })
+        return session
+
+    def _request(self, method, url, priority, **kwargs):
+        """Sends a request through the rate limit scheduler; requests rejected with 429 are retried after the reset."""
+        for _ in range(self.rate_limit_retries + 1):
+            self.scheduler.acquire(priority)
+            with metrics.timer("fungus_http_request_seconds", service="mastodon", method=method):
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            metrics.increment("fungus_http_requests_total", service="mastodon", status=response.status_code)
+            self.scheduler.update(response)
+            if response.status_code != 429:
+                break
+        return response
 
     def post_status(self, status_text):
         url = f"{self.instance_url}/api/v1/statuses"
         payload = {'status': status_text}
-        headers = {
-            'Authorization': f'Bearer {self.api_token}',
-            'Content-Type': 'application/json'
-        }
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self._request('POST', url, PRIORITY_POST, json=payload)
             response.raise_for_status()
             logging.info(f"Posted to Mastodon: {status_text}")
             return response.json()
@@ -33,35 +95,131 @@ class MastodonClient:
             print(f"Error posting status: {e}")
             return None
 
-    def fetch_latest_statuses(self, model, hashtag):
-        base_url = f"{self.instance_url}/api/v1"
+    def tag_timeline_url(self, hashtag):
+        return f"{self.instance_url}/api/v1/timelines/tag/{quote(hashtag, safe='')}"
 
+    def fetch_latest_statuses(self, model, hashtag):
         if hashtag is None:
             hashtag = self.nutrial_tag
 
-        headers = {
-            'Authorization': f'Bearer {self.api_token}',
-            'Accept': 'application/json'
-        }
-
         params = {
             'type': 'statuses',
             'tag': hashtag,
             'limit': 30
         }
 
-        response = requests.get(f"{base_url}/timelines/tag/{self.nutrial_tag}",
-                                headers=headers,
-                                params=params)
+        response = self._request('GET', self.tag_timeline_url(hashtag), PRIORITY_FETCH, params=params)
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(f"Error: {response.status_code}", response=response)
+        data = response.json()
+        logging.info(f"Found {len(data)} latest statuses")
+        return data
 
-        if response.status_code == 200:
+    def fetch_new_statuses(self, hashtag=None):
+        """
+        Returns the statuses posted under the hashtag since the previous call (newest first).
+        The first call per hashtag fetches the latest page. Later calls ask for statuses after the
+        cursor (min_id) and follow the Link rel="prev" pages, so bursts larger than one page are not dropped.
+        The cursor is only moved by advance_cursor, once the statuses were answered.
+        Raises if the first page could not be fetched, so that the caller backs off.
+        """
+        hashtag = hashtag or self.nutrial_tag
+        cursor = self.reply_state.get_cursor(hashtag)
+        params = {'limit': self.page_size}
+        if cursor is not None:
+            params['min_id'] = cursor
+
+        statuses = []
+        url = self.tag_timeline_url(hashtag)
+        for page in range(self.max_pages):
+            try:
+                response = self._request('GET', url, PRIORITY_FETCH, params=params)
+                if response.status_code != 200:
+                    raise requests.exceptions.HTTPError(f"Error: {response.status_code}", response=response)
+            except requests.exceptions.RequestException as e:
+                if page == 0:
+                    raise
+                logging.error(f"Error fetching statuses: {e}")
+                # Keep what was fetched; the cursor makes the next call resume after it
+                break
             data = response.json()
-            logging.info(f"Found {len(data)} latest statuses")
-            statuses = data
-            return statuses
+            statuses.extend(data)
+            # Without a cursor only the latest page is wanted, older statuses are not followed
+            prev_page = response.links.get('prev')
+            if cursor is None or not data or prev_page is None:
+                break
+            # The prev link carries the min_id of the next newer page
+            url, params = prev_page['url'], None
         else:
-            logging.error(f"Error: {response.status_code}")
-            return None
+            logging.warning(f"Stopped after {self.max_pages} pages of new statuses under #{hashtag}")
+
+        statuses.sort(key=lambda status: status_id_key(status['id']), reverse=True)
+        logging.info(f"Found {len(statuses)} new statuses under #{hashtag}")
+        return statuses
+
+    def advance_cursor(self, hashtag, statuses, unanswered_ids=()):
+        """
+        Moves the hashtag's cursor past the fetched statuses, but not past the oldest one whose reply failed:
+        the next fetch_new_statuses returns it again (statuses that were answered meanwhile are in reply_state).
+        """
+        unanswered_ids = set(unanswered_ids)
+        cursor = None
+        for status in sorted(statuses, key=lambda status: status_id_key(status['id'])):
+            status_id = status['id']
+            if status_id in unanswered_ids:
+                attempts = self.reply_attempts.get(status_id, 0) + 1
+                if attempts < self.max_reply_attempts:
+                    self.reply_attempts[status_id] = attempts
+                    break
+                logging.warning(f"Giving up on replying to status {status_id} after {attempts} attempts")
+            self.reply_attempts.pop(status_id, None)
+            cursor = status_id
+        if cursor is not None:
+            self.reply_state.set_cursor(hashtag, cursor)
+
+    def start_streaming(self, hashtag=None):
+        """Subscribes to the hashtag's stream (once); its statuses are returned by wait_for_streamed_statuses."""
+        hashtag = hashtag or self.nutrial_tag
+        if hashtag not in self.streams:
+            self.streams[hashtag] = HashtagStream(self.streaming_url, hashtag, self.api_token,
+                                                  self.status_queue).start()
+        return self.streams[hashtag]
+
+    def switch_streaming(self, hashtag=None):
+        """
+        Moves the subscription to the hashtag (by default the current nutrial tag) after the node joined
+        another fungus group: the old stream is stopped and one for the new hashtag is started.
+        Does nothing unless streaming was started.
+        """
+        hashtag = hashtag or self.nutrial_tag
+        if not self.streams or hashtag in self.streams:
+            return
+        logging.info(f"[STREAMING] Switching the stream from #{', #'.join(self.streams)} to #{hashtag}")
+        self.stop_streaming()
+        self.start_streaming(hashtag)
+
+    def stop_streaming(self):
+        for stream in self.streams.values():
+            stream.stop()
+        self.streams = {}
+
+    def is_streaming(self):
+        return any(stream.is_connected() for stream in self.streams.values())
+
+    def wait_for_streamed_statuses(self, timeout):
+        """
+        Blocks until statuses arrive from a stream (or the timeout passes) and returns all queued ones.
+        Without a connected stream this just waits out the timeout, so callers fall back to polling.
+        """
+        try:
+            statuses = [self.status_queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                statuses.append(self.status_queue.get_nowait())
+            except queue.Empty:
+                return statuses
 
     def get_statuses_from_random_mycelial_tag(self):
         messages = []
@@ -76,41 +234,41 @@ class MastodonClient:
             return messages, random_mycelial_tag
 
     def count_likes_of_all_statuses(self):
-        overall_likes = 0
-        for status_id in self.ids_of_replies:
-            favourites_count = self.count_likes_of_status(status_id)
-            overall_likes += favourites_count
-        return overall_likes
+        """
+        Sums the favourites of all tracked replies. Only recent replies are re-checked (concurrently);
+        older ones count with their cached favourites. Raises if Mastodon fails, so that the caller backs off.
+        """
+        reply_ids = self.reply_state.recent_reply_ids()
+        favourites = dict(zip(reply_ids, self.executor.map(self.count_likes_of_status, reply_ids)))
+        # Deleted replies keep their cached count
+        self.reply_state.update_favourites({k: v for k, v in favourites.items() if v is not None})
+        return self.reply_state.total_favourites()
+
+    def save_reply_state(self):
+        """Forgets replies past the retention period and writes the epoch's changes in one transaction."""
+        self.reply_state.prune()
+        self.reply_state.flush()
 
     def count_likes_of_status(self, status_id):
+        """Returns the favourites of a status, or None if it was deleted. Other errors are raised."""
         base_url = f"{self.instance_url}/api/v1"
 
-        headers = {
-            'Authorization': f'Bearer {self.api_token}',
-            'Accept': 'application/json'
-        }
-
-        response = requests.get(f"{base_url}/statuses/{status_id}", headers=headers)
-
+        response = self._request('GET', f"{base_url}/statuses/{status_id}", PRIORITY_LIKES)
         if response.status_code == 200:
             data = response.json()
             favourites_count = data['favourites_count']
             logging.info(f"Status {status_id} was liked {data['favourites_count']}")
             return favourites_count
-        else:
-            logging.error(f"Error: {response.status_code}")
+        elif response.status_code == 404:
+            logging.warning(f"Status {status_id} no longer exists")
             return None
+        else:
+            raise requests.exceptions.HTTPError(f"Error: {response.status_code}", response=response)
 
     def reply_to_status(self, status_id, username, message):
         # Construct the reply message mentioning the user
         reply_message = f"@{username} {message}"
 
-        # Prepare the request headers
-        headers = {
-            'Authorization': f'Bearer {self.api_token}',
-            'Content-Type': 'application/json'
-        }
-
         # Prepare the request payload
         payload = {
             'status': reply_message,
@@ -119,11 +277,30 @@ class MastodonClient:
         logging.info("Reply to status with id " + str(status_id) + ": " + reply_message)
 
         # Send the POST request
-        response = requests.post(f'{self.instance_url}/api/v1/statuses', json=payload, headers=headers)
+        try:
+            response = self._request('POST', f'{self.instance_url}/api/v1/statuses', PRIORITY_REPLY, json=payload)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to send reply: {e}")
+            return False
 
         if response.status_code == 200:
-            self.ids_of_replied_statuses.append(status_id)
-            self.ids_of_replies.append(response.json()["id"])
+            self.reply_state.record_reply(status_id, response.json()["id"])
             print("Reply sent successfully!")
+            return True
         else:
             print(f"Failed to send reply: {response.status_code}")
+            return False
+
+    def reply_to_statuses(self, replies):
+        """
+        Sends (status_id, username, message) replies concurrently with bounded parallelism.
+        Returns whether each reply was sent, in order.
+        """
+        futures = [self.executor.submit(self.reply_to_status, *reply) for reply in replies]
+        return [future.result() for future in futures]
+
+
+def status_id_key(status_id):
+    """Sort key for Mastodon ids: numeric strings compare by length first, then lexicographically."""
+    status_id = str(status_id)
+    return len(status_id), status_id
@@ -1,50 +1,228 @@
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
+import requests
 from mastodon_client import MastodonClient
+from request_scheduler import PRIORITY_REPLY, PRIORITY_LIKES
+from reply_state_store import ReplyStateStore
+
+
+def make_response(status_code=200, data=None, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.json.return_value = data
+    return response
 
 class TestMastodonClient(unittest.TestCase):
     def setUp(self):
-        self.client = MastodonClient()
+        self.client = MastodonClient(reply_state=ReplyStateStore(":memory:"))
+
+    def tearDown(self):
+        self.client.executor.shutdown()
+
+    def test_session_is_pooled_with_retries(self):
+        adapter = self.client.session.get_adapter("https://mastodon.example")
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertNotIn("POST", adapter.max_retries.allowed_methods)
+        self.assertIn("Authorization", self.client.session.headers)
+
+    def test_post_status_successful(self):
+        with patch.object(self.client.session, 'request') as mock_post:
+            mock_post.return_value = make_response(200, {"id": "12345"})
+
+            response = self.client.post_status("Hello, Mastodon!")
+
+            self.assertIsNotNone(response)
+            self.assertEqual(response["id"], "12345")
+            self.assertEqual(mock_post.call_args.kwargs["timeout"], self.client.timeout)
+
+    def test_fetch_latest_statuses_successful(self):
+        with patch.object(self.client.session, 'request') as mock_get:
+            mock_get.return_value = make_response(200, [{"content": "Test post"}])
+
+            statuses = self.client.fetch_latest_statuses(None, "test")
+
+            self.assertIsNotNone(statuses)
+            self.assertEqual(len(statuses), 1)
+            self.assertEqual(statuses[0]["content"], "Test post")
+
+    def test_fetch_latest_statuses_uses_hashtag(self):
+        with patch.object(self.client.session, 'request') as mock_get:
+            mock_get.return_value = make_response(200, [])
+            self.client.fetch_latest_statuses(None, "mycelial tag")
+            self.assertTrue(mock_get.call_args.args[1].endswith("/api/v1/timelines/tag/mycelial%20tag"))
+
+    def test_fetch_new_statuses_follows_cursor_and_pages(self):
+        first = make_response(200, [{"id": "100"}, {"id": "99"}])
+        first.links = {"next": {"url": "older"}, "prev": {"url": "newer"}}
+        burst_page_1 = make_response(200, [{"id": "102"}, {"id": "101"}])
+        burst_page_1.links = {"prev": {"url": "https://mastodon.example/page2"}}
+        burst_page_2 = make_response(200, [{"id": "1000"}])
+        burst_page_2.links = {"prev": {"url": "https://mastodon.example/page3"}}
+        empty = make_response(200, [])
+        empty.links = {}
+
+        with patch.object(self.client.session, 'request',
+                          side_effect=[first, burst_page_1, burst_page_2, empty]) as mock_get:
+            statuses = self.client.fetch_new_statuses("tag")
+            self.assertEqual([s["id"] for s in statuses], ["100", "99"])
+            # The first poll only reads the latest page
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertNotIn("min_id", mock_get.call_args.kwargs["params"])
+            self.assertIsNone(self.client.reply_state.get_cursor("tag"))
+            self.client.advance_cursor("tag", statuses)
+
+            statuses = self.client.fetch_new_statuses("tag")
+            self.assertEqual([s["id"] for s in statuses], ["1000", "102", "101"])
+            self.assertEqual(mock_get.call_args_list[1].kwargs["params"]["min_id"], "100")
+            self.assertEqual(mock_get.call_args_list[2].args[1], "https://mastodon.example/page2")
+            self.client.advance_cursor("tag", statuses)
+            self.assertEqual(self.client.reply_state.get_cursor("tag"), "1000")
+
+    def test_failed_reply_is_retried_on_next_poll(self):
+        timeline = [{"id": "3"}, {"id": "2"}, {"id": "1"}]
+        failing = {"2"}
+
+        def request(method, url, params=None, json=None, **kwargs):
+            if method == "GET":
+                min_id = (params or {}).get("min_id")
+                response = make_response(200, [s for s in timeline if min_id is None or int(s["id"]) > int(min_id)])
+                response.links = {}
+                return response
+            return make_response(500 if json["in_reply_to_id"] in failing else 200,
+                                 {"id": "reply-" + json["in_reply_to_id"]})
+
+        with patch.object(self.client.session, 'request', side_effect=request):
+            statuses = self.client.fetch_new_statuses("tag")
+            sent = self.client.reply_to_statuses([(s["id"], "user", "hi") for s in statuses])
+            self.client.advance_cursor("tag", statuses, [s["id"] for s, ok in zip(statuses, sent) if not ok])
+            # The cursor stops before the failed reply
+            self.assertEqual(self.client.reply_state.get_cursor("tag"), "1")
+
+            failing.clear()
+            statuses = [s for s in self.client.fetch_new_statuses("tag") if s["id"] not in self.client.reply_state]
+            self.assertEqual([s["id"] for s in statuses], ["2"])
+            self.assertEqual(self.client.reply_to_statuses([("2", "user", "hi")]), [True])
+            self.client.advance_cursor("tag", statuses)
+            self.assertEqual(self.client.reply_state.get_cursor("tag"), "2")
+
+    def test_cursor_gives_up_on_failed_reply_after_max_attempts(self):
+        statuses = [{"id": "2"}, {"id": "1"}]
+        self.client.max_reply_attempts = 2
+
+        self.client.advance_cursor("tag", statuses, ["1"])
+        self.assertIsNone(self.client.reply_state.get_cursor("tag"))
+        self.client.advance_cursor("tag", statuses, ["1"])
+
+        self.assertEqual(self.client.reply_state.get_cursor("tag"), "2")
+        self.assertEqual(self.client.reply_attempts, {})
+
+    def test_fetch_new_statuses_keeps_cursor_on_error(self):
+        self.client.reply_state.set_cursor("tag", "5")
+        with patch.object(self.client.session, 'request', return_value=make_response(500)):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.client.fetch_new_statuses("tag")
+        self.assertEqual(self.client.reply_state.get_cursor("tag"), "5")
+
+    def test_fetch_latest_statuses_connection_error(self):
+        with patch.object(self.client.session, 'request', side_effect=requests.exceptions.ConnectionError("down")):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.client.fetch_latest_statuses(None, "test")
+
+    def test_fetch_latest_statuses_raises_on_error_status(self):
+        with patch.object(self.client.session, 'request', return_value=make_response(502)):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.client.fetch_latest_statuses(None, "test")
+
+    def test_count_likes_of_status_successful(self):
+        with patch.object(self.client.session, 'request') as mock_get:
+            mock_get.return_value = make_response(200, {"favourites_count": 42})
+
+            likes = self.client.count_likes_of_status("12345")
+
+            self.assertEqual(likes, 42)
+
+    def test_count_likes_of_all_statuses_concurrently(self):
+        for reply_id in ["1", "2", "3", "4"]:
+            self.client.reply_state.record_reply("status-" + reply_id, reply_id)
+        in_flight = []
+        lock = threading.Lock()
+
+        def get(method, url, **kwargs):
+            with lock:
+                in_flight.append(url)
+            # All requests must be in flight at the same time to get past this
+            deadline = time.monotonic() + 5
+            while len(in_flight) < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return make_response(200, {"favourites_count": 0 if url.endswith("/3") else 2})
 
-    @patch('mastodon_client.requests.post')
-    def test_post_status_successful(self, mock_post):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {"id": "12345"}
+        with patch.object(self.client.session, 'request', side_effect=get):
+            start = time.monotonic()
+            self.assertEqual(self.client.count_likes_of_all_statuses(), 6)
+            self.assertLess(time.monotonic() - start, 5)
 
-        response = self.client.post_status("Hello, Mastodon!")
+    def test_count_likes_ignores_failed_statuses(self):
+        for reply_id in ["1", "2"]:
+            self.client.reply_state.record_reply("status-" + reply_id, reply_id)
+        with patch.object(self.client.session, 'request') as mock_get:
+            mock_get.return_value = make_response(404)
+            self.assertEqual(self.client.count_likes_of_all_statuses(), 0)
 
-        self.assertIsNotNone(response)
-        self.assertEqual(response["id"], "12345")
+    def test_count_likes_raises_on_server_errors(self):
+        self.client.reply_state.record_reply("status-1", "1")
+        self.client.reply_state.update_favourites({"1": 4})
+        with patch.object(self.client.session, 'request', return_value=make_response(503)):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.client.count_likes_of_all_statuses()
+        self.assertEqual(self.client.reply_state.total_favourites(), 4)
 
-    @patch('mastodon_client.requests.get')
-    def test_fetch_latest_statuses_successful(self, mock_get):
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = [{"content": "Test post"}]
+    def test_count_likes_keeps_cached_counts_of_old_replies(self):
+        self.client.reply_state.record_reply("old-status", "old")
+        self.client.reply_state.update_favourites({"old": 5})
+        self.client.reply_state.replies["old-status"][1] -= 2 * self.client.reply_state.recheck_seconds
+        self.client.reply_state.record_reply("new-status", "new")
+        with patch.object(self.client.session, 'request',
+                          return_value=make_response(200, {"favourites_count": 1})) as mock_get:
+            self.assertEqual(self.client.count_likes_of_all_statuses(), 6)
+            # Only the recent reply is fetched
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertTrue(mock_get.call_args.args[1].endswith("/statuses/new"))
 
-        statuses = self.client.fetch_latest_statuses(None, "test")
+    def test_reply_to_status_successful(self):
+        with patch.object(self.client.session, 'request') as mock_post:
+            mock_post.return_value = make_response(200, {"id": "67890"})
 
-        self.assertIsNotNone(statuses)
-        self.assertEqual(len(statuses), 1)
-        self.assertEqual(statuses[0]["content"], "Test post")
+            self.client.reply_to_status("12345", "testuser", "This is a reply!")
 
-    @patch('mastodon_client.requests.get')
-    def test_count_likes_of_status_successful(self, mock_get):
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = {"favourites_count": 42}
+            self.assertIn("12345", self.client.reply_state)
+            self.assertEqual(self.client.reply_state.recent_reply_ids(), ["67890"])
 
-        likes = self.client.count_likes_of_status("12345")
+    def test_reply_to_statuses(self):
+        with patch.object(self.client.session, 'request') as mock_post:
+            mock_post.side_effect = lambda method, url, json, **kwargs: make_response(
+                200 if json['in_reply_to_id'] != "2" else 500, {"id": "reply-" + json['in_reply_to_id']})
 
-        self.assertEqual(likes, 42)
+            sent = self.client.reply_to_statuses([("1", "a", "x"), ("2", "b", "y"), ("3", "c", "z")])
 
-    @patch('mastodon_client.requests.post')
-    def test_reply_to_status_successful(self, mock_post):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {"id": "67890"}
+            self.assertEqual(sent, [True, False, True])
+            self.assertEqual([s in self.client.reply_state for s in ["1", "2", "3"]], [True, False, True])
+            self.assertEqual(sorted(self.client.reply_state.recent_reply_ids()), ["reply-1", "reply-3"])
 
-        self.client.reply_to_status("12345", "testuser", "This is a reply!")
+    def test_rate_limited_request_is_retried_after_reset(self):
+        with patch.object(self.client.session, 'request') as mock_request:
+            mock_request.side_effect = [make_response(429, headers={"Retry-After": "0.05"}),
+                                        make_response(200, {"favourites_count": 3})]
+            self.assertEqual(self.client.count_likes_of_status("1"), 3)
+            self.assertEqual(mock_request.call_count, 2)
+            self.assertEqual(self.client.scheduler.stats()["throttled"], 1)
 
-        self.assertIn("12345", self.client.ids_of_replied_statuses)
-        self.assertIn("67890", self.client.ids_of_replies)
+    def test_requests_are_prioritized(self):
+        with patch.object(self.client.scheduler, 'acquire') as mock_acquire, \
+                patch.object(self.client.session, 'request', return_value=make_response(200, {"id": "1", "favourites_count": 0})):
+            self.client.reply_to_status("1", "user", "hi")
+            self.client.count_likes_of_status("1")
+            self.assertEqual([c.args[0] for c in mock_acquire.call_args_list], [PRIORITY_REPLY, PRIORITY_LIKES])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+# mastodon_streaming.py
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import requests
+
+
+def parse_sse_events(lines):
+    """Yields (event, data) pairs from the lines of a server-sent events stream (comment lines are heartbeats)."""
+    event, data = None, []
+    for line in lines:
+        if line is None:
+            continue
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line == "":
+            if data:
+                yield event or "message", "\n".join(data)
+            event, data = None, []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+    if data:
+        yield event or "message", "\n".join(data)
+
+
+class HashtagStream:
+    """
+    Subscribes to the hashtag stream of the Mastodon streaming API on a background thread and puts
+    every new status into status_queue. Dropped connections are re-established with exponential
+    backoff (with jitter); is_connected() tells callers whether they need to fall back to polling.
+    """
+
+    def __init__(self, streaming_url, hashtag, api_token, status_queue=None, initial_backoff=None, max_backoff=None,
+                 read_timeout=None):
+        # Settings are read when the stream is created, after the .env file was loaded
+        if initial_backoff is None:
+            initial_backoff = float(os.getenv("MASTODON_STREAMING_INITIAL_BACKOFF_SECONDS", 1))
+        if max_backoff is None:
+            max_backoff = float(os.getenv("MASTODON_STREAMING_MAX_BACKOFF_SECONDS", 60))
+        if read_timeout is None:
+            read_timeout = float(os.getenv("MASTODON_STREAMING_READ_TIMEOUT_SECONDS", 90))
+        self.url = f"{streaming_url}/api/v1/streaming/hashtag"
+        self.hashtag = hashtag
+        self.status_queue = status_queue if status_queue is not None else queue.Queue()
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.read_timeout = read_timeout
+        # A separate session: the stream holds its connection open indefinitely
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f'Bearer {api_token}', 'Accept': 'text/event-stream'})
+        self.stop_event = threading.Event()
+        self.connected = threading.Event()
+        self.response = None
+        self.thread = None
+        self.reconnects = 0
+        self.statuses_received = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"stream-{self.hashtag}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        response = self.response
+        if response is not None:
+            # Unblocks the read of the streaming thread
+            response.close()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.session.close()
+
+    def is_connected(self):
+        return self.connected.is_set()
+
+    def run(self):
+        backoff = self.initial_backoff
+        while not self.stop_event.is_set():
+            received_before = self.statuses_received
+            try:
+                self.consume()
+            except Exception as e:
+                # Includes whatever the read raises when stop() closes the response
+                if self.stop_event.is_set():
+                    break
+                logging.warning(f"[STREAMING] Stream of #{self.hashtag} failed: {e}")
+            finally:
+                self.connected.clear()
+                self.response = None
+            if self.stop_event.is_set():
+                break
+            # Only a connection that delivered statuses resets the backoff, so a server that
+            # accepts and immediately drops connections is not hammered
+            if self.statuses_received > received_before:
+                backoff = self.initial_backoff
+            delay = random.uniform(backoff / 2, backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            self.reconnects += 1
+            logging.info(f"[STREAMING] Reconnecting to #{self.hashtag} in {delay:.1f}s")
+            self.stop_event.wait(delay)
+
+    def consume(self):
+        """Reads the stream until the server closes it."""
+        with self.session.get(self.url, params={'tag': self.hashtag}, stream=True,
+                              timeout=(10, self.read_timeout)) as response:
+            self.response = response
+            response.raise_for_status()
+            self.connected.set()
+            logging.info(f"[STREAMING] Connected to the stream of #{self.hashtag}")
+            for event, data in parse_sse_events(response.iter_lines(decode_unicode=True)):
+                if event != "update":
+                    continue
+                try:
+                    status = json.loads(data)
+                except ValueError:
+                    logging.warning(f"[STREAMING] Skipping malformed status event: {data[:100]}")
+                    continue
+                self.status_queue.put(status)
+                self.statuses_received += 1
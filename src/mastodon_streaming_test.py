@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mastodon_streaming import HashtagStream, parse_sse_events
+from mastodon_client import MastodonClient
+from reply_state_store import ReplyStateStore
+
+
+class FakeStreamingServer:
+    """Serves one scripted SSE response per connection (status code, events), then closes the connection."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get('Authorization')))
+                status, chunks = server.responses.pop(0) if server.responses else (200, [])
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(chunk.encode('utf-8'))
+                    self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def update_event(status):
+    return f"event: update\ndata: {json.dumps(status)}\n\n"
+
+
+class TestMastodonStreaming(unittest.TestCase):
+    def test_parse_sse_events(self):
+        lines = [":thump", "", "event: update", 'data: {"id": "1"}', "", "event: delete", "data: 1", "",
+                 "data: a", "data: b"]
+        self.assertEqual(list(parse_sse_events(lines)),
+                         [("update", '{"id": "1"}'), ("delete", "1"), ("message", "a\nb")])
+
+    def test_stream_reconnects_and_queues_statuses(self):
+        server = FakeStreamingServer([
+            (200, [":thump\n\n", update_event({"id": "1", "content": "a"}), "event: delete\ndata: 7\n\n"]),
+            (500, []),
+            (200, [update_event({"id": "2", "content": "b"}), "event: update\ndata: {broken\n\n"]),
+        ])
+        stream = HashtagStream(server.url, "music", "token", initial_backoff=0.01, max_backoff=0.05).start()
+        try:
+            statuses = [stream.status_queue.get(timeout=5), stream.status_queue.get(timeout=5)]
+            self.assertEqual([status["id"] for status in statuses], ["1", "2"])
+            self.assertGreaterEqual(stream.reconnects, 2)
+            path, authorization = server.requests[0]
+            self.assertEqual(path, "/api/v1/streaming/hashtag?tag=music")
+            self.assertEqual(authorization, "Bearer token")
+        finally:
+            stream.stop()
+            server.close()
+        self.assertFalse(stream.thread.is_alive())
+
+    def test_backoff_grows_without_statuses(self):
+        server = FakeStreamingServer([(503, [])] * 20)
+        stream = HashtagStream(server.url, "music", "token", initial_backoff=0.02, max_backoff=0.2).start()
+        try:
+            time.sleep(0.5)
+            # Exponential backoff keeps the number of attempts well below the 25 a fixed 20ms delay would allow
+            self.assertLess(len(server.requests), 10)
+            self.assertFalse(stream.is_connected())
+        finally:
+            stream.stop()
+            server.close()
+
+    def test_client_drains_streamed_statuses(self):
+        server = FakeStreamingServer([(200, [update_event({"id": "1"}), update_event({"id": "2"})])])
+        client = MastodonClient(reply_state=ReplyStateStore(":memory:"))
+        client.streaming_url = server.url
+        try:
+            client.start_streaming("music")
+            statuses = client.wait_for_streamed_statuses(5)
+            deadline = time.monotonic() + 5
+            while len(statuses) < 2 and time.monotonic() < deadline:
+                statuses += client.wait_for_streamed_statuses(0.1)
+            self.assertEqual([status["id"] for status in statuses], ["1", "2"])
+            self.assertEqual(client.wait_for_streamed_statuses(0.01), [])
+        finally:
+            client.stop_streaming()
+            client.executor.shutdown()
+            server.close()
+
+    def test_client_switches_stream_to_new_nutrial_tag(self):
+        server = FakeStreamingServer([(200, [update_event({"id": "1"})]), (200, [update_event({"id": "2"})])])
+        client = MastodonClient(reply_state=ReplyStateStore(":memory:"))
+        client.streaming_url = server.url
+        try:
+            client.nutrial_tag = "music"
+            client.switch_streaming()
+            self.assertEqual(client.streams, {})
+
+            old_stream = client.start_streaming()
+            self.assertEqual(client.wait_for_streamed_statuses(5)[0]["id"], "1")
+            client.nutrial_tag = "jazz"
+            client.switch_streaming()
+
+            self.assertFalse(old_stream.thread.is_alive())
+            self.assertEqual(list(client.streams), ["jazz"])
+            self.assertEqual(client.wait_for_streamed_statuses(5)[0]["id"], "2")
+            self.assertEqual(server.requests[-1][0], "/api/v1/streaming/hashtag?tag=jazz")
+        finally:
+            client.stop_streaming()
+            client.executor.shutdown()
+            server.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
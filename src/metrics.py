@@ -0,0 +1,244 @@
+# metrics.py
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+# The registry and exporter defaults below read the environment when this module is imported
+load_dotenv()
+
+# Upper bounds (seconds) of the latency histogram buckets, from sub-millisecond lookups to full epochs
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class Timer:
+    """Context manager that records the seconds spent in its block into a histogram."""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class MetricsRegistry:
+    """
+    Counters and latency histograms keyed by name and labels.
+    A disabled registry records nothing: every call returns after a single flag check.
+    """
+
+    def __init__(self, enabled=os.getenv("METRICS_ENABLED", "false").lower() == "true", buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # (name, sorted label items) -> value / Histogram
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Times a block: `with registry.timer("fungus_stage_seconds", stage="training"): ...`"""
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+    def snapshot(self):
+        """Returns all metrics as a JSON-serializable dict."""
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "count": histogram.count, "sum": histogram.sum,
+                           "buckets": dict(zip([str(b) for b in histogram.buckets], histogram.cumulative_counts()))}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms}
+
+    def prometheus_text(self):
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+# Process-wide registry used by the instrumented modules
+registry = MetricsRegistry()
+
+
+def increment(name, value=1, **labels):
+    registry.increment(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def timer(name, **labels):
+    return registry.timer(name, **labels)
+
+
+class MetricsServer:
+    """Serves the registry at /metrics for Prometheus to scrape (on a background thread)."""
+
+    def __init__(self, registry, port, host=""):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+        logging.info(f"[METRICS] Serving Prometheus metrics on port {self.port}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JSONFileExporter:
+    """Periodically writes a snapshot of the registry to a JSON file (replaced atomically)."""
+
+    def __init__(self, registry, path, interval_seconds=60):
+        self.registry = registry
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="metrics-exporter", daemon=True)
+        self.thread.start()
+        logging.info(f"[METRICS] Writing metrics to {self.path} every {self.interval_seconds:.0f}s")
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            self.export()
+
+    def export(self):
+        try:
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as file:
+                json.dump(self.registry.snapshot(), file)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logging.warning(f"[METRICS] Could not write metrics to {self.path}: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.export()
+
+
+def start_exporters(registry=registry, port=int(os.getenv("METRICS_PORT", 0)),
+                    json_file=os.getenv("METRICS_JSON_FILE"),
+                    json_interval=float(os.getenv("METRICS_JSON_INTERVAL_SECONDS", 60))):
+    """Starts the configured exporters (none while metrics are disabled); returns them."""
+    exporters = []
+    if not registry.enabled:
+        return exporters
+    if port:
+        exporters.append(MetricsServer(registry, port).start())
+    if json_file:
+        exporters.append(JSONFileExporter(registry, json_file, json_interval).start())
+    if not exporters:
+        logging.warning("[METRICS] Metrics are enabled but neither METRICS_PORT nor METRICS_JSON_FILE is set")
+    return exporters
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+from metrics import JSONFileExporter, MetricsRegistry, MetricsServer, NULL_TIMER, start_exporters
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry(enabled=True, buckets=(0.1, 1.0))
+
+    def test_counters_and_histograms(self):
+        self.registry.increment("requests_total", service="mastodon")
+        self.registry.increment("requests_total", 2, service="mastodon")
+        self.registry.observe("stage_seconds", 0.05, stage="training")
+        self.registry.observe("stage_seconds", 0.5, stage="training")
+        self.registry.observe("stage_seconds", 5.0, stage="training")
+
+        snapshot = self.registry.snapshot()
+
+        self.assertEqual(snapshot["counters"], [{"name": "requests_total", "labels": {"service": "mastodon"},
+                                                 "value": 3}])
+        histogram = snapshot["histograms"][0]
+        self.assertEqual(histogram["count"], 3)
+        self.assertAlmostEqual(histogram["sum"], 5.55)
+        self.assertEqual(histogram["buckets"], {"0.1": 1, "1.0": 2})
+
+    def test_timer_records_elapsed_time(self):
+        with self.registry.timer("stage_seconds", stage="replies"):
+            pass
+
+        self.assertEqual(self.registry.snapshot()["histograms"][0]["count"], 1)
+
+    def test_prometheus_text(self):
+        self.registry.increment("requests_total", status='4"29')
+        self.registry.observe("latency_seconds", 0.5)
+
+        text = self.registry.prometheus_text()
+
+        self.assertIn("# TYPE requests_total counter\n", text)
+        self.assertIn('requests_total{status="4\\"29"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 0\n', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn("latency_seconds_count 1\n", text)
+
+    def test_disabled_registry_records_nothing(self):
+        registry = MetricsRegistry(enabled=False)
+        registry.increment("requests_total")
+        registry.observe("latency_seconds", 1.0)
+
+        self.assertIs(registry.timer("latency_seconds"), NULL_TIMER)
+        self.assertEqual(registry.snapshot()["counters"], [])
+        self.assertEqual(registry.snapshot()["histograms"], [])
+        self.assertEqual(start_exporters(registry, port=9999, json_file="metrics.json"), [])
+
+
+class TestExporters(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry(enabled=True)
+        self.registry.increment("epochs_total")
+
+    def test_server_serves_prometheus_text(self):
+        server = MetricsServer(self.registry, 0, host="127.0.0.1").start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                body = response.read().decode("utf-8")
+        finally:
+            server.stop()
+
+        self.assertIn("epochs_total 1", body)
+
+    def test_json_file_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "metrics.json")
+            exporter = JSONFileExporter(self.registry, path, interval_seconds=60).start()
+            exporter.stop()
+
+            with open(path) as file:
+                self.assertEqual(json.load(file)["counters"][0]["name"], "epochs_total")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# model_aggregation.py
+import logging
+import math
+from datetime import datetime, timezone
+import torch
+
+STRATEGIES = ("mean", "staleness", "median", "trimmed_mean")
+
+
+class StateShapeError(ValueError):
+    pass
+
+
+def check_compatible(reference_state, state):
+    """Raises StateShapeError if a peer state does not have the reference's keys and shapes."""
+    if state.keys() != reference_state.keys():
+        raise StateShapeError(f"parameter names differ: {sorted(set(state) ^ set(reference_state))}")
+    for name, tensor in reference_state.items():
+        if state[name].shape != tensor.shape:
+            raise StateShapeError(f"{name} has shape {tuple(state[name].shape)}, expected {tuple(tensor.shape)}")
+
+
+class StreamingWeightedMean:
+    """
+    Accumulates weighted peer states in place into preallocated buffers,
+    so memory stays at one model no matter how many peers are streamed in.
+    """
+
+    def __init__(self, reference_state):
+        self.reference_state = reference_state
+        self.sums = {k: torch.zeros(v.shape, dtype=torch.float32) for k, v in reference_state.items()}
+        self.total_weight = 0.0
+        self.count = 0
+
+    def add(self, state, weight=1.0):
+        check_compatible(self.reference_state, state)
+        if weight <= 0:
+            return
+        for name, buffer in self.sums.items():
+            buffer.add_(state[name].to(torch.float32), alpha=weight)
+        self.total_weight += weight
+        self.count += 1
+
+    def blend_into(self, current_state, current_model_weight):
+        """Returns current_model_weight * current + (1 - current_model_weight) * weighted mean, reusing the buffers."""
+        for name, buffer in self.sums.items():
+            buffer.mul_((1 - current_model_weight) / self.total_weight)
+            buffer.add_(current_state[name].to(torch.float32), alpha=current_model_weight)
+        return {name: buffer.to(current_state[name].dtype) for name, buffer in self.sums.items()}
+
+
+def staleness_weight(updated_at, half_life_seconds, now=None):
+    """Halves a peer's weight for every half-life its state is older than now."""
+    if updated_at is None:
+        return 1.0
+    now = now or datetime.now(timezone.utc)
+    age = max((now - updated_at).total_seconds(), 0.0)
+    return math.pow(0.5, age / half_life_seconds)
+
+
+def aggregate_model_states(current_model_state, peer_states, strategy="mean", current_model_weight=0.5,
+                           trim_ratio=0.1, half_life_seconds=3600.0, chunk_size=1 << 16):
+    """
+    Aggregates peer model states (dicts with "modelState" and optionally "updatedAt") into the current state.
+    mean and staleness consume peer_states as a stream in a single pass. median and trimmed_mean need every
+    peer per coordinate; they process parameters in chunks of chunk_size coordinates and re-iterate
+    peer_states once per chunk (pass a list or a callable returning a fresh iterator).
+    Peers whose parameter names or shapes do not match the current model are skipped.
+    Returns the aggregated state and the number of peers merged.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown aggregation strategy: {strategy}")
+    peers = peer_states if callable(peer_states) else (lambda: iter(peer_states))
+
+    if strategy in ("mean", "staleness"):
+        accumulator = StreamingWeightedMean(current_model_state)
+        now = datetime.now(timezone.utc)
+        for peer in peers():
+            weight = 1.0
+            if strategy == "staleness":
+                weight = staleness_weight(peer.get("updatedAt"), half_life_seconds, now)
+            try:
+                accumulator.add(peer["modelState"], weight)
+            except StateShapeError as e:
+                logging.warning(f"Skipping incompatible model {peer.get('model')}: {e}")
+        if accumulator.count == 0:
+            return current_model_state, 0
+        return accumulator.blend_into(current_model_state, current_model_weight), accumulator.count
+
+    # Robust statistics: validate once, then gather one coordinate chunk of every valid peer at a time
+    valid = []
+    for index, peer in enumerate(peers()):
+        try:
+            check_compatible(current_model_state, peer["modelState"])
+            valid.append(index)
+        except StateShapeError as e:
+            logging.warning(f"Skipping incompatible model {peer.get('model')}: {e}")
+    if not valid:
+        return current_model_state, 0
+    valid = set(valid)
+
+    aggregated_state = {}
+    for name, current in current_model_state.items():
+        current_flat = current.reshape(-1).to(torch.float32)
+        result = torch.empty_like(current_flat)
+        for start in range(0, current_flat.numel(), chunk_size):
+            end = min(start + chunk_size, current_flat.numel())
+            chunk = torch.stack([peer["modelState"][name].reshape(-1)[start:end].to(torch.float32)
+                                 for index, peer in enumerate(peers()) if index in valid])
+            if strategy == "median":
+                result[start:end] = torch.quantile(chunk, 0.5, dim=0)
+            else:
+                trim = int(trim_ratio * chunk.shape[0])
+                if trim * 2 >= chunk.shape[0]:
+                    trim = (chunk.shape[0] - 1) // 2
+                result[start:end] = chunk.sort(dim=0).values[trim:chunk.shape[0] - trim].mean(dim=0)
+        result.mul_(1 - current_model_weight).add_(current_flat, alpha=current_model_weight)
+        aggregated_state[name] = result.reshape(current.shape).to(current.dtype)
+    return aggregated_state, len(valid)
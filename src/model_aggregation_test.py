@@ -0,0 +1,55 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import torch
+from model_aggregation import aggregate_model_states, staleness_weight
+
+def state(value, shape=(2, 3)):
+    return {"fc1.weight": torch.full(shape, float(value)), "fc1.bias": torch.full((2,), float(value))}
+
+class TestModelAggregation(unittest.TestCase):
+    def test_weighted_mean_matches_previous_behaviour(self):
+        peers = [{"modelState": state(2)}, {"modelState": state(4)}]
+
+        aggregated, merged = aggregate_model_states(state(0), iter(peers), strategy="mean", current_model_weight=0.5)
+
+        self.assertEqual(merged, 2)
+        self.assertTrue(torch.allclose(aggregated["fc1.weight"], torch.full((2, 3), 1.5)))
+
+    def test_incompatible_peers_are_skipped(self):
+        peers = [{"modelState": state(2)}, {"modelState": state(100, shape=(3, 3))},
+                 {"modelState": {"other": torch.zeros(1)}}]
+
+        for strategy in ("mean", "median", "trimmed_mean"):
+            aggregated, merged = aggregate_model_states(state(0), peers, strategy=strategy, current_model_weight=0.5)
+            self.assertEqual(merged, 1)
+            self.assertTrue(torch.allclose(aggregated["fc1.bias"], torch.full((2,), 1.0)))
+
+    def test_median_and_trimmed_mean_ignore_outliers(self):
+        peers = [{"modelState": state(v)} for v in (1, 2, 3, 1000)]
+
+        median, _ = aggregate_model_states(state(0), peers, strategy="median", current_model_weight=0, chunk_size=4)
+        trimmed, _ = aggregate_model_states(state(0), peers, strategy="trimmed_mean", current_model_weight=0,
+                                            trim_ratio=0.25, chunk_size=4)
+
+        self.assertTrue(torch.allclose(median["fc1.weight"], torch.full((2, 3), 2.5)))
+        self.assertTrue(torch.allclose(trimmed["fc1.weight"], torch.full((2, 3), 2.5)))
+
+    def test_staleness_weighted_mean(self):
+        now = datetime.now(timezone.utc)
+        peers = [{"modelState": state(4), "updatedAt": now},
+                 {"modelState": state(1), "updatedAt": now - timedelta(hours=1)}]
+
+        aggregated, _ = aggregate_model_states(state(0), peers, strategy="staleness", current_model_weight=0,
+                                               half_life_seconds=3600)
+
+        self.assertTrue(torch.allclose(aggregated["fc1.bias"], torch.full((2,), 3.0), atol=1e-3))
+        self.assertAlmostEqual(staleness_weight(now - timedelta(hours=2), 3600, now), 0.25)
+
+    def test_no_peers_returns_current_state(self):
+        current = state(1)
+        aggregated, merged = aggregate_model_states(current, [], strategy="mean")
+        self.assertIs(aggregated, current)
+        self.assertEqual(merged, 0)
+
+if __name__ == '__main__':
+    unittest.main()
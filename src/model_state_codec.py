@@ -0,0 +1,147 @@
+# model_state_codec.py
+import base64
+import json
+import os
+import struct
+import zlib
+import numpy as np
+import torch
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for MODEL_STATE_COMPRESSION=zstd
+    zstandard = None
+
+BINARY_PREFIX = "mrfs1:"
+MAGIC = b"MRFS"
+FORMAT_VERSION = 1
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+PRECISIONS = ("float32", "float16", "int8")
+# magic, format version, compression id, header length
+PREAMBLE = struct.Struct("<4sBBI")
+
+
+def encode_model_state(model_state, encoding=None, precision=None, compression=None):
+    """
+    Encodes a model state dict into a string literal that can be stored in the knowledge graph.
+    The binary format stores raw little-endian tensors (float32, float16 or int8-quantized) behind a
+    small header with shapes, dtypes and a CRC32 checksum; the legacy format is base64-encoded JSON.
+    """
+    encoding = encoding or os.getenv("MODEL_STATE_ENCODING", "binary")
+    if encoding == "json":
+        return encode_legacy_model_state(model_state)
+    if encoding != "binary":
+        raise ValueError(f"Unknown model state encoding: {encoding}")
+
+    precision = precision or os.getenv("MODEL_STATE_PRECISION", "float32")
+    compression = compression or os.getenv("MODEL_STATE_COMPRESSION", "zlib")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model state precision: {precision}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown model state compression: {compression}")
+
+    tensors = []
+    chunks = []
+    offset = 0
+    for name, tensor in model_state.items():
+        array = tensor.detach().cpu().numpy()
+        entry = {"name": name, "shape": list(array.shape), "dtype": str(array.dtype)}
+        if np.issubdtype(array.dtype, np.floating):
+            array, entry["storage"], scale = _quantize(array, precision)
+            if scale is not None:
+                entry["scale"] = scale
+        else:
+            entry["storage"] = array.dtype.newbyteorder('<').str
+            array = array.astype(entry["storage"])
+        data = np.ascontiguousarray(array).tobytes()
+        entry["offset"] = offset
+        entry["nbytes"] = len(data)
+        offset += len(data)
+        tensors.append(entry)
+        chunks.append(data)
+
+    body = b"".join(chunks)
+    header = json.dumps({"tensors": tensors, "crc32": zlib.crc32(body)}, separators=(',', ':')).encode('utf-8')
+    payload = PREAMBLE.pack(MAGIC, FORMAT_VERSION, COMPRESSIONS[compression], len(header)) + header
+    payload += _compress(body, compression)
+    return BINARY_PREFIX + base64.b64encode(payload).decode('ascii')
+
+
+def decode_model_state(state_encoded):
+    """Decodes a stored model state literal in either the binary or the legacy JSON format."""
+    if not state_encoded.startswith(BINARY_PREFIX):
+        return decode_legacy_model_state(state_encoded)
+    try:
+        return _decode_binary_model_state(base64.b64decode(state_encoded[len(BINARY_PREFIX):]))
+    except (struct.error, zlib.error, KeyError, TypeError) as e:
+        raise ValueError(f"Corrupt model state: {e}") from e
+
+
+def _decode_binary_model_state(payload):
+    magic, version, compression_id, header_length = PREAMBLE.unpack_from(payload)
+    if magic != MAGIC or version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported model state format (magic: {magic!r}, version: {version})")
+    header_start = PREAMBLE.size
+    header = json.loads(payload[header_start:header_start + header_length].decode('utf-8'))
+    compression = {v: k for k, v in COMPRESSIONS.items()}[compression_id]
+    body = _decompress(payload[header_start + header_length:], compression)
+    if zlib.crc32(body) != header["crc32"]:
+        raise ValueError("Model state checksum mismatch")
+
+    model_state = {}
+    for entry in header["tensors"]:
+        array = np.frombuffer(body, dtype=entry["storage"], count=_count(entry), offset=entry["offset"])
+        if "scale" in entry:
+            array = array.astype(np.float32) * entry["scale"]
+        array = array.astype(entry["dtype"]).reshape(entry["shape"])
+        model_state[entry["name"]] = torch.from_numpy(array)
+    return model_state
+
+
+def encode_legacy_model_state(model_state):
+    """Encodes a model state as base64 JSON lists (readable by older nodes)."""
+    state_dict = {k: v.tolist() for k, v in model_state.items()}
+    state_json = json.dumps(state_dict)
+    return base64.b64encode(state_json.encode('utf-8')).decode('utf-8')
+
+
+def decode_legacy_model_state(state_encoded):
+    state_json = base64.b64decode(state_encoded).decode('utf-8')
+    state_dict = json.loads(state_json)
+    # Convert lists back to tensors
+    return {k: torch.tensor(v) for k, v in state_dict.items()}
+
+
+def _quantize(array, precision):
+    if precision == "float16":
+        return array.astype('<f2'), '<f2', None
+    if precision == "int8":
+        # Symmetric per-tensor quantization
+        max_abs = float(np.max(np.abs(array))) if array.size else 0.0
+        scale = max_abs / 127 if max_abs > 0 else 1.0
+        return np.clip(np.round(array / scale), -127, 127).astype('i1'), 'i1', scale
+    return array.astype('<f4'), '<f4', None
+
+
+def _count(entry):
+    return int(np.prod(entry["shape"], dtype=np.int64))
+
+
+def _compress(body, compression):
+    if compression == "zlib":
+        return zlib.compress(body)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().compress(body)
+    return body
+
+
+def _decompress(body, compression):
+    if compression == "zlib":
+        return zlib.decompress(body)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress(body)
+    return body
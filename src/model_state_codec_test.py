@@ -0,0 +1,49 @@
+import unittest
+import torch
+from model_state_codec import encode_model_state, decode_model_state, encode_legacy_model_state, BINARY_PREFIX
+
+class TestModelStateCodec(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model_state = {
+            'fc1.weight': torch.randn(64, 30),
+            'fc1.bias': torch.randn(64),
+            'steps': torch.tensor(7),
+        }
+
+    def assert_states_close(self, decoded, atol):
+        self.assertEqual(decoded.keys(), self.model_state.keys())
+        for name, tensor in self.model_state.items():
+            self.assertEqual(decoded[name].shape, tensor.shape)
+            self.assertEqual(decoded[name].dtype, tensor.dtype)
+            self.assertTrue(torch.allclose(decoded[name].float(), tensor.float(), atol=atol))
+
+    def test_float32_round_trip_is_exact(self):
+        for compression in ("none", "zlib"):
+            encoded = encode_model_state(self.model_state, encoding="binary", precision="float32", compression=compression)
+            self.assertTrue(encoded.startswith(BINARY_PREFIX))
+            self.assert_states_close(decode_model_state(encoded), atol=0)
+
+    def test_reduced_precision_round_trip(self):
+        encoded = encode_model_state(self.model_state, encoding="binary", precision="float16", compression="none")
+        self.assert_states_close(decode_model_state(encoded), atol=1e-2)
+        encoded = encode_model_state(self.model_state, encoding="binary", precision="int8", compression="none")
+        self.assert_states_close(decode_model_state(encoded), atol=0.05)
+
+    def test_binary_is_smaller_than_legacy(self):
+        binary = encode_model_state(self.model_state, encoding="binary", precision="float32", compression="none")
+        legacy = encode_legacy_model_state(self.model_state)
+        self.assertLess(len(binary) * 3, len(legacy))
+
+    def test_legacy_format_is_still_readable(self):
+        encoded = encode_model_state(self.model_state, encoding="json")
+        self.assert_states_close(decode_model_state(encoded), atol=1e-6)
+
+    def test_corrupted_state_is_rejected(self):
+        encoded = encode_model_state(self.model_state, encoding="binary", precision="float32", compression="none")
+        corrupted = encoded[:-12] + ("A" if encoded[-12] != "A" else "B") + encoded[-11:]
+        with self.assertRaises(ValueError):
+            decode_model_state(corrupted)
+
+if __name__ == '__main__':
+    unittest.main()
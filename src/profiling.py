@@ -0,0 +1,150 @@
+# profiling.py
+import contextlib
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import shutil
+import signal
+import threading
+import time
+from dotenv import load_dotenv
+
+# The profiler defaults below read the environment when this module is imported
+load_dotenv()
+
+# Set while the current thread is being profiled (cProfile and torch.profiler do not nest)
+profiling_state = threading.local()
+
+
+@contextlib.contextmanager
+def capture(directory, name, use_torch=True):
+    """
+    Profiles the block with cProfile and (optionally) torch.profiler on the CPU and writes
+    <name>.prof (pstats), <name>.txt (top functions by cumulative time) and <name>.trace.json
+    (Chrome trace, open in chrome://tracing or Perfetto) into directory.
+    """
+    if getattr(profiling_state, "active", False):
+        yield
+        return
+    profiling_state.active = True
+    torch_profile = None
+    if use_torch:
+        import torch.profiler
+        torch_profile = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+        torch_profile.__enter__()
+    python_profile = cProfile.Profile()
+    python_profile.enable()
+    try:
+        yield
+    finally:
+        python_profile.disable()
+        if torch_profile is not None:
+            torch_profile.__exit__(None, None, None)
+        profiling_state.active = False
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, name)
+            python_profile.dump_stats(path + ".prof")
+            summary = io.StringIO()
+            pstats.Stats(python_profile, stream=summary).sort_stats("cumulative").print_stats(40)
+            with open(path + ".txt", "w") as file:
+                file.write(summary.getvalue())
+            if torch_profile is not None:
+                torch_profile.export_chrome_trace(path + ".trace.json")
+        except Exception as e:
+            logging.warning(f"[PROFILING] Could not write the profile of {name}: {e}")
+
+
+class Profiler:
+    """
+    Opt-in profiling of the hot paths. Once armed (PROFILING=true at startup, SIGUSR1 or arm()),
+    the next `epochs` epochs are captured: every profiled call within them writes its traces into
+    a directory per epoch. Only the newest `keep` epoch directories are kept.
+    """
+
+    def __init__(self, directory=os.getenv("PROFILING_DIR", "profiles"),
+                 epochs=int(os.getenv("PROFILING_EPOCHS", 3)),
+                 keep=int(os.getenv("PROFILING_KEEP", 10)),
+                 max_calls=int(os.getenv("PROFILING_MAX_CALLS", 5)),
+                 use_torch=os.getenv("PROFILING_TORCH", "true").lower() == "true",
+                 armed=os.getenv("PROFILING", "false").lower() == "true"):
+        self.directory = directory
+        self.epochs = epochs
+        self.keep = keep
+        self.max_calls = max_calls
+        self.use_torch = use_torch
+        self.remaining = epochs if armed else 0
+        # Directory of the epoch that is being captured, None otherwise
+        self.epoch_directory = None
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def arm(self, epochs=None):
+        self.remaining = epochs or self.epochs
+        logging.info(f"[PROFILING] Capturing the next {self.remaining} epochs into {self.directory}")
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGUSR1", None)):
+        """Arms the profiler whenever the process receives signum (SIGUSR1). Returns whether it was installed."""
+        if signum is None:
+            return False
+        try:
+            signal.signal(signum, lambda received, frame: self.arm())
+        except ValueError:
+            # Not called from the main thread
+            return False
+        return True
+
+    def start_epoch(self, number):
+        if self.remaining <= 0:
+            return
+        self.remaining -= 1
+        self.epoch_directory = os.path.join(self.directory, f"epoch-{time.strftime('%Y%m%d-%H%M%S')}-{number}")
+        self.calls = {}
+
+    def end_epoch(self):
+        if self.epoch_directory is None:
+            return
+        logging.info(f"[PROFILING] Wrote the profiles of this epoch to {self.epoch_directory}")
+        self.epoch_directory = None
+        self.rotate()
+
+    def section(self, name):
+        """Profiles a block if the current epoch is captured (at most max_calls times per name)."""
+        directory = self.epoch_directory
+        if directory is None:
+            return contextlib.nullcontext()
+        with self.lock:
+            calls = self.calls[name] = self.calls.get(name, 0) + 1
+        if calls > self.max_calls:
+            return contextlib.nullcontext()
+        return capture(directory, f"{name}-{calls}", self.use_torch)
+
+    def rotate(self):
+        """Deletes all but the newest `keep` epoch directories."""
+        try:
+            epochs = sorted((entry for entry in os.listdir(self.directory) if entry.startswith("epoch-")),
+                            key=lambda entry: os.path.getmtime(os.path.join(self.directory, entry)))
+        except OSError:
+            return
+        for entry in epochs[:max(len(epochs) - self.keep, 0)]:
+            shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+
+# Process-wide profiler used by the profiled hot paths
+profiler = Profiler()
+
+
+def profiled(name):
+    """Decorator that profiles the function whenever the module profiler captures an epoch."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if profiler.epoch_directory is None:
+                return function(*args, **kwargs)
+            with profiler.section(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,95 @@
+import os
+import signal
+import tempfile
+import unittest
+from unittest.mock import patch
+import torch
+import profiling
+from profiling import Profiler, capture, profiled
+
+
+def matrix_product():
+    return torch.ones(16, 16) @ torch.ones(16, 16)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(directory=self.directory.name, epochs=2, keep=10, max_calls=2, armed=False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def epoch_directories(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_nothing_is_captured_unless_armed(self):
+        self.profiler.start_epoch(0)
+        with self.profiler.section("train_model"):
+            matrix_product()
+        self.profiler.end_epoch()
+
+        self.assertEqual(self.epoch_directories(), [])
+
+    def test_armed_profiler_captures_the_next_epochs(self):
+        self.profiler.arm()
+        for epoch in range(3):
+            self.profiler.start_epoch(epoch)
+            for _ in range(3):
+                with self.profiler.section("get_song_recommendations"):
+                    matrix_product()
+            self.profiler.end_epoch()
+
+        epochs = self.epoch_directories()
+        self.assertEqual(len(epochs), 2)
+        files = sorted(os.listdir(os.path.join(self.directory.name, epochs[0])))
+        # At most max_calls profiles per name and epoch
+        self.assertEqual(files, ["get_song_recommendations-1.prof", "get_song_recommendations-1.trace.json",
+                                 "get_song_recommendations-1.txt", "get_song_recommendations-2.prof",
+                                 "get_song_recommendations-2.trace.json", "get_song_recommendations-2.txt"])
+
+    def test_rotation_keeps_newest_epochs(self):
+        self.profiler.keep = 1
+        self.profiler.arm(epochs=2)
+        for epoch in range(2):
+            self.profiler.start_epoch(epoch)
+            with self.profiler.section("train_model"):
+                matrix_product()
+            os.utime(self.profiler.epoch_directory, (epoch, epoch))
+            self.profiler.end_epoch()
+
+        self.assertEqual(len(self.epoch_directories()), 1)
+        self.assertTrue(self.epoch_directories()[0].endswith("-1"))
+
+    def test_signal_arms_profiler(self):
+        if not hasattr(signal, "SIGUSR1"):
+            self.skipTest("SIGUSR1 is not available on this platform")
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            self.assertTrue(self.profiler.install_signal_handler())
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertEqual(self.profiler.remaining, 2)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+    def test_profiled_decorator(self):
+        function = profiled("matrix_product")(matrix_product)
+        with patch.object(profiling, "profiler", self.profiler):
+            self.assertEqual(function().shape, (16, 16))
+            self.profiler.arm(epochs=1)
+            self.profiler.start_epoch(0)
+            function()
+            self.profiler.end_epoch()
+
+        self.assertEqual(len(self.epoch_directories()), 1)
+
+    def test_capture_does_not_nest(self):
+        with capture(self.directory.name, "outer", use_torch=False):
+            with capture(self.directory.name, "inner", use_torch=False):
+                matrix_product()
+
+        self.assertEqual(self.epoch_directories(), ["outer.prof", "outer.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,28 +1,87 @@
 # rdf_knowledge_graph.py
 import logging
-from SPARQLWrapper import SPARQLWrapper, JSON
 import json
-import base64
-import torch
+import hashlib
 import os
+import socket
+from urllib.parse import quote
 from dotenv import load_dotenv
 import csv
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
+from model_state_codec import encode_model_state, decode_model_state
+from caching import LRUCache
+from model_aggregation import aggregate_model_states
+from rdf_store_backend import create_store_backend
+from profiling import profiled
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
+EX = "http://example.org/"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+SONG_COLUMNS = ["song_id", "title", "genre", "artist", "tempo", "duration"]
+
+
+def escape_literal(value):
+    """Escapes a string for use inside a double-quoted SPARQL / N-Triples literal."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'))
+
+
+def song_to_ntriples(song_id, title, genre, artist, tempo, duration):
+    """Returns the N-Triples lines describing one song."""
+    subject = f"<{EX}song_{int(song_id)}>"
+    return (
+        f'{subject} <{RDF_TYPE}> <{EX}Song> .\n'
+        f'{subject} <{EX}songId> "{int(song_id)}"^^<{XSD_INTEGER}> .\n'
+        f'{subject} <{EX}title> "{escape_literal(title)}" .\n'
+        f'{subject} <{EX}genre> "{escape_literal(genre)}" .\n'
+        f'{subject} <{EX}artist> "{escape_literal(artist)}" .\n'
+        f'{subject} <{EX}tempo> "{int(tempo)}"^^<{XSD_INTEGER}> .\n'
+        f'{subject} <{EX}duration> "{int(duration)}"^^<{XSD_INTEGER}> .\n'
+    )
+
+
+def format_datetime(value):
+    """Formats a timezone-aware datetime as an xsd:dateTime lexical value in UTC."""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def parse_datetime(value):
+    """Parses an xsd:dateTime lexical value (naive values are taken as UTC)."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
 class RDFKnowledgeGraph:
-    def __init__(self, mastodon_client, fuseki_url=os.getenv("FUSEKI_SERVER_URL"), dataset="my-knowledge-base"):
-        self.update_url = f"{fuseki_url}/{dataset}/update"
-        self.query_url = f"{fuseki_url}/{dataset}/query"
-        self.fuseki_url = fuseki_url + "/" + dataset
+    def __init__(self, mastodon_client, fuseki_url=os.getenv("FUSEKI_SERVER_URL"), dataset="my-knowledge-base", node_id=None,
+                 load_songs=True, store=None):
+        self.fuseki_url = f"{fuseki_url}/{dataset}"
         self.mastodon_client = mastodon_client
-        self.sparql = SPARQLWrapper(self.fuseki_url)
-        self.songs_data = self.get_all_songs()
+        # Fuseki, or an embedded rdflib dataset (see rdf_store_backend)
+        self.store = store or create_store_backend(fuseki_url, dataset)
+        # Incremental peer model sync: decoded states keyed by content hash, and what was synced when
+        self.model_state_cache = LRUCache(int(os.getenv("MODEL_STATE_CACHE_SIZE", 256)))
+        self.synced_model_states = {}
+        self.last_model_sync = None
+        # Tolerated clock skew between nodes when filtering by timestamp
+        self.model_sync_overlap = float(os.getenv("MODEL_SYNC_OVERLAP_SECONDS", 60))
+        # Every node stores its latest model state in its own named graph
+        self.node_id = node_id or os.getenv("FUNGUS_NODE_ID") or socket.gethostname()
+        self.model_state_retention = float(os.getenv("MODEL_STATE_RETENTION_SECONDS", 24 * 60 * 60))
+        # Without load_songs the catalog is loaded by the first fetch_all_songs (or from a snapshot)
+        self.songs_data = self.get_all_songs() if load_songs else pd.DataFrame(columns=SONG_COLUMNS)
 
     def fetch_all_songs(self):
-        self.songs_data = self.get_all_songs()
+        """Loads the catalog, or once it is loaded, only the songs added since. Returns the newly loaded songs."""
+        if len(self.songs_data.index) == 0:
+            self.songs_data = self.get_all_songs()
+            return self.songs_data
+        return self.refresh_songs()
 
     def look_for_new_fungus_group_in_statuses(self, messages, random_mycelial_tag):
         logging.info("Stage 1: Looking for a new fungus group to join...")
@@ -41,9 +100,14 @@ class RDFKnowledgeGraph:
         return None
 
     def look_for_song_data_in_statuses_to_insert(self, messages):
+        """
+        Inserts songs shared via song-data statuses and appends them to songs_data.
+        Returns the newly added songs as a DataFrame so the recommender can index them incrementally.
+        """
         logging.info("Look for song data in mastodon statuses to insert")
+        new_songs = []
         if messages is None:
-            return
+            return pd.DataFrame(new_songs)
 
         song_id_counter = len(self.songs_data.index) + 1
         for message in messages:
@@ -59,8 +123,21 @@ class RDFKnowledgeGraph:
                      + str(duration)
                     )
                     self.insert_song_data(song_id_counter, title, genre, artist, int(tempo), int(duration))
+                    new_songs.append({
+                        "song_id": song_id_counter,
+                        "title": title,
+                        "genre": genre,
+                        "artist": artist,
+                        "tempo": int(tempo),
+                        "duration": int(duration)
+                    })
                     song_id_counter = song_id_counter + 1
 
+        new_songs = pd.DataFrame(new_songs)
+        if not new_songs.empty:
+            self.songs_data = pd.concat([pd.DataFrame(self.songs_data), new_songs], ignore_index=True)
+        return new_songs
+
     def extra_song_data_from_status_content(self, text):
         # Find the index of "song-data:"
         model_link_index = text.find("song-data:")
@@ -89,39 +166,92 @@ class RDFKnowledgeGraph:
     def fetch_all_model_from_knowledge_base(self, link_to_model):
         return self.retrieve_all_model_states(link_to_model)
 
+    def model_graph(self, model_name, node_id=None):
+        """Returns the IRI of the named graph holding a node's latest state of the given model."""
+        node_id = node_id or self.node_id
+        return f"{EX}model-graph/{quote(node_id, safe='')}/{quote(model_name, safe='')}"
+
     def insert_model_state(self, model_name, model_state):
         """
-        Inserts the model parameters into the Fuseki knowledge base using base64 encoding.
+        Stores the model parameters in this node's named graph (see model_state_codec for the format).
+        The previous state is replaced atomically, so the graph only ever holds the node's latest version,
+        together with a content hash and timestamp that peers use to fetch incrementally.
         """
-        # Convert tensors to lists for serialization
-        state_dict = {k: v.tolist() for k, v in model_state.items()}
-        state_json = json.dumps(state_dict)
-        state_encoded = base64.b64encode(state_json.encode('utf-8')).decode('utf-8')
-        sparql = SPARQLWrapper(self.update_url)
+        state_encoded = encode_model_state(model_state)
+        state_hash = hashlib.sha256(state_encoded.encode('utf-8')).hexdigest()
+        updated_at = format_datetime(datetime.now(timezone.utc))
+        graph = self.model_graph(model_name)
         sparql_insert_query = f'''
         PREFIX ex: <http://example.org/>
         PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
 
-        INSERT DATA {{
-            ex:{model_name} a ex:ContentBasedModel ;
-                            ex:modelState "{state_encoded}" .
+        DELETE {{ GRAPH <{graph}> {{ ?s ?p ?o }} }}
+        INSERT {{
+            GRAPH <{graph}> {{
+                ex:{model_name}_{state_hash} a ex:ContentBasedModel ;
+                                ex:modelName "{escape_literal(model_name)}" ;
+                                ex:nodeId "{escape_literal(self.node_id)}" ;
+                                ex:modelVersion ?version ;
+                                ex:modelState "{state_encoded}" ;
+                                ex:stateHash "{state_hash}" ;
+                                ex:updatedAt "{updated_at}"^^xsd:dateTime .
+            }}
+        }}
+        WHERE {{
+            {{ SELECT (COALESCE(MAX(?previousVersion) + 1, 1) AS ?version)
+               WHERE {{ OPTIONAL {{ GRAPH <{graph}> {{ ?previous ex:modelVersion ?previousVersion }} }} }} }}
+            OPTIONAL {{ GRAPH <{graph}> {{ ?s ?p ?o }} }}
         }}
         '''
-        sparql.setQuery(sparql_insert_query)
-        sparql.setMethod('POST')
-        sparql.setReturnFormat(JSON)
-        try:
-            sparql.query()
-            print(f"Model '{model_name}' inserted successfully.")
-        except Exception as e:
-            print(f"Error inserting model: {e}")
+        self.store.update(sparql_insert_query)
+        print(f"Model '{model_name}' inserted successfully.")
+
+    def compact_model_states(self, retention_seconds=None):
+        """
+        Garbage-collects model states: removes the node graphs of peers that have not saved a state within
+        the retention period, as well as timestamped legacy states in the default graph that are as old.
+        The node's own graphs are kept even if it has not retrained for a while, and so are legacy states
+        without a timestamp: they are the live states of nodes from before the per-node graphs.
+        """
+        if retention_seconds is None:
+            retention_seconds = self.model_state_retention
+        cutoff = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=retention_seconds))
+        own_graphs = self.model_graph("")
+        sparql_compact_query = f'''
+        PREFIX ex: <http://example.org/>
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+
+        DELETE {{ GRAPH ?graph {{ ?s ?p ?o }} }}
+        WHERE {{
+            GRAPH ?graph {{
+                ?model a ex:ContentBasedModel ;
+                       ex:updatedAt ?updatedAt .
+                ?s ?p ?o .
+            }}
+            FILTER(?updatedAt < "{cutoff}"^^xsd:dateTime && !STRSTARTS(STR(?graph), "{own_graphs}"))
+        }} ;
+        DELETE {{ ?model ?p ?o }}
+        WHERE {{
+            ?model a ex:ContentBasedModel ;
+                   ex:updatedAt ?updatedAt ;
+                   ?p ?o .
+            FILTER(?updatedAt < "{cutoff}"^^xsd:dateTime)
+        }}
+        '''
+        self.store.update(sparql_compact_query)
+        logging.info(f"Compacted model states older than {cutoff}")
+        # Forget peers whose states were garbage-collected
+        expired = parse_datetime(cutoff)
+        for graph, state_hash in list(self.synced_model_states.items()):
+            cached = self.model_state_cache.get(state_hash)
+            if cached is not None and cached["updatedAt"] is not None and cached["updatedAt"] < expired:
+                del self.synced_model_states[graph]
 
     def insert_song_data(self, song_id, title, genre, artist, tempo, duration):
         """
-        Inserts the individual song data into the Fuseki knowledge base.
+        Inserts the individual song data into the knowledge base.
         """
         # Prepare the SPARQL query to insert the song data
-        sparql = SPARQLWrapper(self.update_url)
         sparql_insert_query = f'''
         PREFIX ex: <http://example.org/>
         PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
@@ -129,148 +259,252 @@ class RDFKnowledgeGraph:
         INSERT DATA {{
             ex:song_{song_id} a ex:Song ;
                                ex:songId {song_id} ;
-                               ex:title "{title}" ;
-                               ex:genre "{genre}" ;
-                               ex:artist "{artist}" ;
+                               ex:title "{escape_literal(title)}" ;
+                               ex:genre "{escape_literal(genre)}" ;
+                               ex:artist "{escape_literal(artist)}" ;
                                ex:tempo {tempo} ;
                                ex:duration {duration} .
         }}
         '''
 
-        sparql.setQuery(sparql_insert_query)
-        sparql.setMethod('POST')
-        sparql.setReturnFormat(JSON)
-
-        try:
-            sparql.query()
-            print(f"Song '{title}' inserted successfully.")
-        except Exception as e:
-            print(f"Error inserting song: {e}")
+        self.store.update(sparql_insert_query)
+        print(f"Song '{title}' inserted successfully.")
 
-    def get_all_songs(self):
+    def get_all_songs(self, page_size=None):
         """
-        Retrieves all songs and their data from the Fuseki knowledge base.
+        Retrieves all songs and their data from the knowledge base.
         """
-        # Prepare the SPARQL query to retrieve all song data
-        sparql = SPARQLWrapper(self.fuseki_url)
+        songs_df = self.fetch_songs_since(0, page_size)
+        if songs_df.empty:
+            print("No songs found in the database.")
+        return songs_df
+
+    def max_song_id(self):
+        """Returns the highest song id in the knowledge base (0 if it holds no songs) with a single aggregate query."""
         sparql_select_query = '''
         PREFIX ex: <http://example.org/>
-        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
 
-        SELECT ?song_id ?title ?genre ?artist ?tempo ?duration WHERE {
+        SELECT (MAX(?song_id) AS ?max_id) WHERE {
             ?song a ex:Song ;
-                  ex:songId ?song_id ;
-                  ex:title ?title ;
-                  ex:genre ?genre ;
-                  ex:artist ?artist ;
-                  ex:tempo ?tempo ;
-                  ex:duration ?duration .
+                  ex:songId ?song_id .
         }
         '''
+        bindings = self.store.query(sparql_select_query)["results"]["bindings"]
+        if not bindings or "max_id" not in bindings[0]:
+            return 0
+        return int(bindings[0]["max_id"]["value"])
 
-        sparql.setQuery(sparql_select_query)
-        sparql.setReturnFormat(JSON)
-
-        try:
-            results = sparql.query().convert()
-
-            # Process the result
-            songs = []
-            for song_data in results["results"]["bindings"]:
-                song_info = {
-                    "song_id": song_data["song_id"]["value"],
-                    "title": song_data["title"]["value"],
-                    "genre": song_data["genre"]["value"],
-                    "artist": song_data["artist"]["value"],
-                    "tempo": int(song_data["tempo"]["value"]),
-                    "duration": int(song_data["duration"]["value"])
-                }
-                songs.append(song_info)
-
-            # Convert the list of dictionaries into a pandas DataFrame
-            if songs:
-                songs_df = pd.DataFrame(songs)
-                return songs_df
-            else:
-                print("No songs found in the database.")
-                return pd.DataFrame()  # Return an empty DataFrame if no data is found
-        except Exception as e:
-            print(f"Error retrieving song data: {e}")
-            return []
+    def refresh_songs(self, since_id=None, page_size=None):
+        """
+        Fetches only the songs added since the last load (by default: with a song id above the highest known one),
+        appends them to songs_data and returns them.
+        """
+        if since_id is None:
+            since_id = int(self.songs_data['song_id'].max()) if len(self.songs_data.index) else 0
+        new_songs = self.fetch_songs_since(since_id, page_size)
+        if new_songs.empty:
+            return new_songs
+        self.songs_data = pd.concat([self.songs_data, new_songs], ignore_index=True)
+        logging.info(f"Loaded {len(new_songs)} new songs (catalog size: {len(self.songs_data.index)})")
+        return new_songs
+
+    def fetch_songs_since(self, since_id, page_size=None):
+        """
+        Streams songs with a song id above since_id page by page (keyset pagination on ex:songId)
+        into columnar arrays. Errors of the store are raised, so that callers can back off.
+        """
+        page_size = page_size or int(os.getenv("SONG_PAGE_SIZE", 10000))
+        columns = {column: [] for column in SONG_COLUMNS}
+        last_id = int(since_id)
+        while True:
+            sparql_select_query = f'''
+            PREFIX ex: <http://example.org/>
+            PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+
+            SELECT ?song_id ?title ?genre ?artist ?tempo ?duration WHERE {{
+                ?song a ex:Song ;
+                      ex:songId ?song_id ;
+                      ex:title ?title ;
+                      ex:genre ?genre ;
+                      ex:artist ?artist ;
+                      ex:tempo ?tempo ;
+                      ex:duration ?duration .
+                FILTER(?song_id > {last_id})
+            }}
+            ORDER BY ?song_id
+            LIMIT {page_size}
+            '''
+            bindings = self.store.query(sparql_select_query)["results"]["bindings"]
+
+            for song_data in bindings:
+                for column in SONG_COLUMNS:
+                    columns[column].append(song_data[column]["value"])
+            if len(bindings) < page_size:
+                break
+            last_id = int(bindings[-1]["song_id"]["value"])
+
+        return pd.DataFrame({
+            "song_id": np.asarray(columns["song_id"], dtype=np.int64),
+            "title": np.asarray(columns["title"], dtype=object),
+            "genre": np.asarray(columns["genre"], dtype=object),
+            "artist": np.asarray(columns["artist"], dtype=object),
+            "tempo": np.asarray(columns["tempo"], dtype=np.int64),
+            "duration": np.asarray(columns["duration"], dtype=np.int64),
+        })
 
     def retrieve_all_model_states(self, link_to_model):
         """
-        Retrieves all model parameters stored in the Fuseki server and decodes them.
+        Retrieves the latest model state of every peer node and decodes them, plus the legacy states that
+        nodes from before the per-node graphs keep writing to the default graph.
+        Only states updated since the last sync are transferred (legacy states without a timestamp always are);
+        known states are served from a local LRU of decoded tensors keyed by content hash.
         """
-        sparql = SPARQLWrapper(self.query_url)
-        sparql_select_query = '''
+        # Re-request known states that were evicted from the cache
+        evicted_hashes = [h for h in self.synced_model_states.values() if h not in self.model_state_cache]
+        since_filter = ""
+        if self.last_model_sync is not None:
+            since = self.last_model_sync - timedelta(seconds=self.model_sync_overlap)
+            evicted = "".join(f' || ?stateHash = "{h}"' for h in evicted_hashes)
+            since_filter = (f'FILTER(!BOUND(?updatedAt) || ?updatedAt > "{format_datetime(since)}"^^xsd:dateTime'
+                            f'{evicted})')
+        own_graphs = self.model_graph("")
+
+        sparql_select_query = f'''
         PREFIX ex: <http://example.org/>
         PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
 
-        SELECT ?model ?modelState
-        WHERE {
-            ?model a ex:ContentBasedModel ;
-                   ex:modelState ?modelState .
-        }
+        SELECT ?graph ?model ?modelState ?stateHash ?updatedAt
+        WHERE {{
+            {{
+                GRAPH ?graph {{
+                    ?model a ex:ContentBasedModel ;
+                           ex:modelState ?modelState ;
+                           ex:stateHash ?stateHash ;
+                           ex:updatedAt ?updatedAt .
+                }}
+                FILTER(!STRSTARTS(STR(?graph), "{own_graphs}"))
+            }}
+            UNION
+            {{
+                # Legacy states of nodes from before the per-node graphs
+                ?model a ex:ContentBasedModel ;
+                       ex:modelState ?modelState .
+                OPTIONAL {{ ?model ex:stateHash ?stateHash }}
+                OPTIONAL {{ ?model ex:updatedAt ?updatedAt }}
+            }}
+            {since_filter}
+        }}
         '''
-        sparql.setQuery(sparql_select_query)
-        sparql.setReturnFormat(JSON)
-        try:
-            results = sparql.query().convert()
-            models = []
-            for result in results["results"]["bindings"]:
-                model = result["model"]["value"]
-                state_encoded = result["modelState"]["value"]
-                state_json = base64.b64decode(state_encoded).decode('utf-8')
-                state_dict = json.loads(state_json)
-                # Convert lists back to tensors
-                model_state = {k: torch.tensor(v) for k, v in state_dict.items()}
-                models.append({"model": model, "modelState": model_state})
-            return models
-        except Exception as e:
-            print(f"Error retrieving models: {e}")
-            return []
-
-    def aggregate_model_states(self, current_model_state, all_model_states, current_model_weight=0.5):
+        results = self.store.query(sparql_select_query)
+
+        decoded = 0
+        for result in results["results"]["bindings"]:
+            model = result["model"]["value"]
+            # Legacy states are keyed by their resource, as they have no node graph
+            graph = result["graph"]["value"] if "graph" in result else model
+            state_encoded = result["modelState"]["value"]
+            # ... and may carry no hash or timestamp
+            state_hash = result["stateHash"]["value"] if "stateHash" in result \
+                else hashlib.sha256(state_encoded.encode('utf-8')).hexdigest()
+            updated_at = parse_datetime(result["updatedAt"]["value"]) if "updatedAt" in result else None
+            if state_hash not in self.model_state_cache:
+                try:
+                    # Binary and legacy JSON states can be mixed within one fungus group
+                    model_state = decode_model_state(state_encoded)
+                except ValueError as e:
+                    logging.warning(f"Skipping undecodable state of model {model}: {e}")
+                    continue
+                self.model_state_cache.put(state_hash, {"model": model, "modelState": model_state,
+                                                        "updatedAt": updated_at})
+                decoded += 1
+            # Each node graph holds exactly one state, the node's latest
+            self.synced_model_states[graph] = state_hash
+            if updated_at is not None and (self.last_model_sync is None or updated_at > self.last_model_sync):
+                self.last_model_sync = updated_at
+
+        models = []
+        for graph, state_hash in self.synced_model_states.items():
+            cached = self.model_state_cache.get(state_hash)
+            if cached is not None:
+                models.append({"model": cached["model"], "graph": graph, "modelState": cached["modelState"],
+                               "stateHash": state_hash, "updatedAt": cached["updatedAt"]})
+        logging.info(f"Synced model states: {len(results['results']['bindings'])} transferred, "
+                     f"{decoded} decoded, {len(models)} available")
+        return models
+
+    @profiled("aggregate_model_states")
+    def aggregate_model_states(self, current_model_state, all_model_states, current_model_weight=0.5, strategy=None):
         """
-        Aggregates model states from multiple nodes using a weighted averaging strategy.
+        Aggregates model states from multiple nodes (see model_aggregation for the strategies).
         The current model has a higher weight in the averaging process.
         """
-        if not all_model_states:
+        options = self.aggregation_options(current_model_weight, strategy)
+        aggregated_state, merged = aggregate_model_states(current_model_state, all_model_states, **options)
+        if merged == 0:
             print("No models available for aggregation.")
             return current_model_state
 
-        # Extract states and convert tensors to numpy arrays for averaging
-        state_keys = current_model_state.keys()
-        aggregated_state = {k: current_model_weight * current_model_state[k].numpy() for k in state_keys}
-
-        # Add the other models with a lower weight
-        for model in all_model_states:
-            for k in state_keys:
-                aggregated_state[k] += (1 - current_model_weight) * model["modelState"][k].numpy() / len(all_model_states)
-
-        # Convert back to tensors
-        aggregated_state = {k: torch.tensor(v) for k, v in aggregated_state.items()}
-
-        print("Model states aggregated successfully with weighted averaging.")
+        print(f"Model states of {merged} peers aggregated successfully ({options['strategy']}).")
         return aggregated_state
 
+    def aggregation_options(self, current_model_weight=0.5, strategy=None):
+        """Returns the configured keyword arguments for model_aggregation.aggregate_model_states."""
+        return {"strategy": strategy or os.getenv("MODEL_AGGREGATION_STRATEGY", "mean"),
+                "current_model_weight": current_model_weight,
+                "trim_ratio": float(os.getenv("MODEL_AGGREGATION_TRIM_RATIO", 0.1)),
+                "half_life_seconds": float(os.getenv("MODEL_AGGREGATION_HALF_LIFE_SECONDS", 3600))}
+
     def insert_songs_from_csv(self, csv_file):
         """
         Inserts song data from a CSV file into the knowledge base.
         """
         with open(csv_file, mode='r') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                song_id = row['song_id']
-                title = row['title']
-                genre = row['genre']
-                artist = row['artist']
-                tempo = int(row['tempo'])
-                duration = int(row['duration'])
-
-                # Insert each song into the knowledge base
-                self.insert_song_data(song_id, title, genre, artist, tempo, duration)
+            return self.insert_songs_bulk(csv.DictReader(file))
+
+    def insert_songs_bulk(self, songs, mode=None, chunk_size=None):
+        """
+        Inserts many songs at once, either as chunked multi-song INSERT DATA requests ("sparql")
+        or as a single streamed N-Triples upload via the Graph Store Protocol ("gsp").
+        Songs are dicts with song_id, title, genre, artist, tempo and duration.
+        """
+        mode = mode or os.getenv("FUSEKI_BULK_MODE") or self.store.bulk_mode
+        if mode not in ("sparql", "gsp"):
+            raise ValueError(f"Unknown bulk insert mode: {mode}")
+        chunk_size = chunk_size or int(os.getenv("FUSEKI_BULK_CHUNK_SIZE", 1000))
+        start_time = time.perf_counter()
+        inserted = 0
+
+        def triples():
+            nonlocal inserted
+            for song in songs:
+                inserted += 1
+                yield song_to_ntriples(song['song_id'], song['title'], song['genre'], song['artist'],
+                                       song['tempo'], song['duration'])
+
+        try:
+            if mode == "gsp":
+                # Stream the whole catalog as one N-Triples upload into the default graph
+                self.store.load_ntriples(triples())
+            else:
+                chunk = []
+                for song in triples():
+                    chunk.append(song)
+                    if len(chunk) >= chunk_size:
+                        self._insert_ntriples(chunk)
+                        chunk = []
+                if chunk:
+                    self._insert_ntriples(chunk)
+        except Exception as e:
+            print(f"Error bulk inserting songs: {e}")
+            return 0
+
+        elapsed = time.perf_counter() - start_time
+        logging.info(f"Bulk inserted {inserted} songs in {elapsed:.2f}s "
+                     f"({inserted / max(elapsed, 1e-9):.0f} songs/s, mode: {mode})")
+        return inserted
+
+    def _insert_ntriples(self, ntriples):
+        self.store.update("INSERT DATA {\n" + "".join(ntriples) + "}")
 
     def extract_after_model_link(self, text):
         # Find the index of "model-link:"
@@ -1,17 +1,24 @@
 import unittest
 from unittest.mock import MagicMock, patch
-from rdf_knowledge_graph import RDFKnowledgeGraph
+from rdf_knowledge_graph import RDFKnowledgeGraph, escape_literal, parse_datetime
+from rdf_store_backend import FusekiStoreBackend
 import pandas as pd
+import torch
+from model_state_codec import encode_model_state
 
 class TestRDFKnowledgeGraph(unittest.TestCase):
     def setUp(self):
         self.mock_mastodon_client = MagicMock()
-        self.rdf_kg = RDFKnowledgeGraph(self.mock_mastodon_client)
+        self.session = MagicMock()
+        store = FusekiStoreBackend("http://localhost:3030", "my-knowledge-base", session=self.session)
+        self.rdf_kg = RDFKnowledgeGraph(self.mock_mastodon_client, store=store, load_songs=False)
 
-    @patch('rdf_knowledge_graph.SPARQLWrapper')
-    def test_get_all_songs(self, MockSPARQLWrapper):
-        mock_sparql = MockSPARQLWrapper.return_value
-        mock_sparql.query.return_value.convert.return_value = {
+    def sent_queries(self):
+        """The SPARQL queries and updates posted to Fuseki, in order."""
+        return [c[1]['data'].get('query') or c[1]['data'].get('update') for c in self.session.post.call_args_list]
+
+    def test_get_all_songs(self):
+        self.session.post.return_value.json.return_value = {
             "results": {
                 "bindings": [
                     {"song_id": {"value": "1"}, "title": {"value": "Test Song"}, "genre": {"value": "Rock"},
@@ -26,20 +33,154 @@ class TestRDFKnowledgeGraph(unittest.TestCase):
         self.assertEqual(len(songs_df), 1)
         self.assertEqual(songs_df.iloc[0]['title'], 'Test Song')
 
-    @patch('rdf_knowledge_graph.SPARQLWrapper')
-    def test_insert_song_data(self, MockSPARQLWrapper):
-        mock_sparql = MockSPARQLWrapper.return_value
+    def test_get_all_songs_paginates(self):
+        def page(first_id, size):
+            return {"results": {"bindings": [
+                {"song_id": {"value": str(i)}, "title": {"value": f"Song {i}"}, "genre": {"value": "Rock"},
+                 "artist": {"value": "Artist"}, "tempo": {"value": "120"}, "duration": {"value": "300"}}
+                for i in range(first_id, first_id + size)]}}
+        self.session.post.return_value.json.side_effect = [page(1, 2), page(3, 2), page(5, 1)]
+
+        songs_df = self.rdf_kg.get_all_songs(page_size=2)
+
+        self.assertEqual(list(songs_df['song_id']), [1, 2, 3, 4, 5])
+        self.assertIn("FILTER(?song_id > 4)", self.sent_queries()[-1])
+
+    def test_get_all_songs_error_is_raised(self):
+        self.session.post.side_effect = Exception("unreachable")
+
+        with self.assertRaises(Exception):
+            self.rdf_kg.get_all_songs()
+        self.assertEqual(len(self.rdf_kg.songs_data.index), 0)
 
+    def test_refresh_songs_appends_new_songs(self):
+        self.rdf_kg.songs_data = pd.DataFrame([{"song_id": 7, "title": "Old Song", "genre": "Pop",
+                                                "artist": "Old Artist", "tempo": 100, "duration": 200}])
+        self.session.post.return_value.json.return_value = {"results": {"bindings": [
+            {"song_id": {"value": "8"}, "title": {"value": "New Song"}, "genre": {"value": "Rock"},
+             "artist": {"value": "Artist"}, "tempo": {"value": "120"}, "duration": {"value": "300"}}]}}
+
+        new_songs = self.rdf_kg.fetch_all_songs()
+
+        self.assertEqual(list(new_songs['title']), ['New Song'])
+        self.assertEqual(len(self.rdf_kg.songs_data), 2)
+        self.assertIn("FILTER(?song_id > 7)", self.sent_queries()[-1])
+
+    def test_insert_song_data(self):
         self.rdf_kg.insert_song_data(1, "Test Song", "Rock", "Test Artist", 120, 300)
 
-        mock_sparql.setQuery.assert_called_once()
-        mock_sparql.query.assert_called_once()
+        self.session.post.assert_called_once()
+        self.assertTrue(self.session.post.call_args[0][0].endswith("/my-knowledge-base/update"))
+        self.assertIn('ex:title "Test Song"', self.sent_queries()[0])
+
+    def test_insert_songs_bulk_chunks_insert_data(self):
+        songs = [{"song_id": i, "title": f'Song "{i}"', "genre": "Rock", "artist": "Artist",
+                  "tempo": 120, "duration": 300} for i in range(1, 6)]
+
+        inserted = self.rdf_kg.insert_songs_bulk(songs, mode="sparql", chunk_size=2)
+
+        self.assertEqual(inserted, 5)
+        self.assertEqual(self.session.post.call_count, 3)
+        self.assertIn('"Song \\"1\\""', self.sent_queries()[0])
+
+    def test_insert_songs_bulk_graph_store_upload(self):
+        songs = [{"song_id": "1", "title": "Test Song", "genre": "Rock", "artist": "Test Artist",
+                  "tempo": "120", "duration": "300"}]
+
+        def consume_body(url, params, data, headers, timeout):
+            self.assertEqual(headers['Content-Type'], 'application/n-triples')
+            body = b"".join(data).decode('utf-8')
+            self.assertEqual(len(body.splitlines()), 7)
+            return MagicMock()
+        self.session.post.side_effect = consume_body
+
+        inserted = self.rdf_kg.insert_songs_bulk(songs, mode="gsp")
+
+        self.assertEqual(inserted, 1)
+        self.assertTrue(self.session.post.call_args[0][0].endswith("/my-knowledge-base/data"))
+
+    def test_retrieve_all_model_states_mixed_formats(self):
+        model_state = {"fc1.weight": torch.ones(2, 3)}
+
+        def binding(node, state_encoded):
+            return {"graph": {"value": f"http://example.org/model-graph/{node}/my-model"},
+                    "model": {"value": f"http://example.org/{node}"},
+                    "modelState": {"value": state_encoded}, "stateHash": {"value": f"hash-{node}"},
+                    "updatedAt": {"value": "2024-01-01T00:00:00.000000Z"}}
+
+        self.session.post.return_value.json.return_value = {
+            "results": {
+                "bindings": [
+                    binding("a", encode_model_state(model_state, encoding="binary")),
+                    binding("b", encode_model_state(model_state, encoding="json")),
+                    binding("c", "mrfs1:broken"),
+                ]
+            }
+        }
+
+        models = self.rdf_kg.retrieve_all_model_states(None)
+
+        self.assertEqual([m["model"] for m in models], ["http://example.org/a", "http://example.org/b"])
+        for model in models:
+            self.assertTrue(torch.equal(model["modelState"]["fc1.weight"], torch.ones(2, 3)))
+
+    @patch('rdf_knowledge_graph.decode_model_state')
+    def test_retrieve_all_model_states_is_incremental(self, mock_decode):
+        mock_decode.return_value = {"fc1.weight": torch.ones(1)}
+        row = {"graph": {"value": "http://example.org/model-graph/a/my-model"},
+               "model": {"value": "http://example.org/a"}, "modelState": {"value": "state"},
+               "stateHash": {"value": "hash-a"}, "updatedAt": {"value": "2024-01-01T00:00:00.000000Z"}}
+        self.session.post.return_value.json.return_value = {"results": {"bindings": [row]}}
+
+        self.assertEqual(len(self.rdf_kg.retrieve_all_model_states(None)), 1)
+        # Nothing changed since the last sync: known states come from the cache
+        self.session.post.return_value.json.return_value = {"results": {"bindings": []}}
+        models = self.rdf_kg.retrieve_all_model_states(None)
+
+        self.assertEqual(len(models), 1)
+        self.assertEqual(models[0]["stateHash"], "hash-a")
+        self.assertEqual(mock_decode.call_count, 1)
+        self.assertIn('?updatedAt > "2023-12-31T23:59:00.000000Z"', self.sent_queries()[-1])
+
+    def test_insert_model_state_replaces_node_graph(self):
+        self.rdf_kg.node_id = "node 1"
+        self.rdf_kg.insert_model_state("my-model", {"fc1.weight": torch.ones(1)})
+
+        query = self.sent_queries()[0]
+        self.assertIn("DELETE { GRAPH <http://example.org/model-graph/node%201/my-model>", query)
+        self.assertIn("ex:modelVersion ?version", query)
+        self.session.post.assert_called_once()
+
+    def test_compact_model_states(self):
+        self.rdf_kg.model_state_cache.put("old", {"model": "m", "modelState": {},
+                                                  "updatedAt": parse_datetime("2020-01-01T00:00:00Z")})
+        self.rdf_kg.synced_model_states["http://example.org/model-graph/old/my-model"] = "old"
+
+        self.rdf_kg.compact_model_states(retention_seconds=3600)
+
+        self.session.post.assert_called_once()
+        self.assertIn(f'!STRSTARTS(STR(?graph), "{self.rdf_kg.model_graph("")}")', self.sent_queries()[0])
+        self.assertEqual(self.rdf_kg.synced_model_states, {})
+
+    def test_escape_literal(self):
+        self.assertEqual(escape_literal('a "quoted"\\ line\n'), 'a \\"quoted\\"\\\\ line\\n')
 
     def test_extra_song_data_from_status_content(self):
         message = "song-data: [\"Test Song\", \"Rock\", \"Test Artist\", 120, 300]"
         result = self.rdf_kg.extra_song_data_from_status_content(message)
         self.assertEqual(result, ["Test Song", "Rock", "Test Artist", 120, 300])
 
+    def test_look_for_song_data_appends_new_songs(self):
+        self.rdf_kg.songs_data = pd.DataFrame([{"song_id": 1, "title": "Old Song", "genre": "Pop",
+                                                "artist": "Old Artist", "tempo": 100, "duration": 200}])
+        messages = ["song-data: [\"Test Song\", \"Rock\", \"Test Artist\", 120, 300]", "unrelated"]
+
+        new_songs = self.rdf_kg.look_for_song_data_in_statuses_to_insert(messages)
+
+        self.assertEqual(list(new_songs['title']), ['Test Song'])
+        self.assertEqual(len(self.rdf_kg.songs_data), 2)
+        self.assertEqual(self.rdf_kg.songs_data.iloc[1]['song_id'], 2)
+
     def test_is_json_valid(self):
         valid_json = '{"key": "value"}'
         self.assertTrue(self.rdf_kg.is_json(valid_json))
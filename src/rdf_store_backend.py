@@ -0,0 +1,238 @@
+# rdf_store_backend.py
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from rdflib import BNode, ConjunctiveGraph, Literal, URIRef
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+import metrics
+from caching import TTLCache
+
+BACKENDS = ("fuseki", "rdflib")
+
+# Keep-alive sessions shared by all clients of the same dataset
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def shared_session(endpoint, pool_size=None):
+    """Returns the keep-alive session for a Fuseki dataset, creating it on first use."""
+    with sessions_lock:
+        session = sessions.get(endpoint)
+        if session is None:
+            pool_size = pool_size or int(os.getenv("FUSEKI_POOL_SIZE", 4))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            sessions[endpoint] = session
+        return session
+
+
+class FusekiStoreBackend:
+    """
+    Runs SPARQL queries and updates against the endpoints of a remote Fuseki dataset
+    (SPARQL 1.1 protocol over a keep-alive session shared per dataset).
+    """
+
+    # Default mode of RDFKnowledgeGraph.insert_songs_bulk
+    bulk_mode = "sparql"
+
+    def __init__(self, fuseki_url, dataset, session=None, timeout=None):
+        self.update_url = f"{fuseki_url}/{dataset}/update"
+        self.query_url = f"{fuseki_url}/{dataset}/query"
+        self.data_url = f"{fuseki_url}/{dataset}/data"
+        self.session = session or shared_session(f"{fuseki_url}/{dataset}")
+        # Settings are read when the backend is created, after the .env file was loaded
+        self.timeout = timeout if timeout is not None else float(os.getenv("FUSEKI_TIMEOUT_SECONDS", 30))
+
+    def query(self, sparql_query):
+        """Returns the results of a SELECT query in the SPARQL 1.1 JSON results format."""
+        with metrics.timer("fungus_sparql_request_seconds", operation="query"):
+            response = self.session.post(self.query_url, data={'query': sparql_query},
+                                         headers={'Accept': 'application/sparql-results+json'}, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+    def update(self, sparql_update):
+        with metrics.timer("fungus_sparql_request_seconds", operation="update"):
+            response = self.session.post(self.update_url, data={'update': sparql_update}, timeout=self.timeout)
+            response.raise_for_status()
+
+    def load_ntriples(self, chunks):
+        """Streams N-Triples (an iterable of str chunks) into the default graph via the Graph Store Protocol."""
+        with metrics.timer("fungus_sparql_request_seconds", operation="load"):
+            response = self.session.post(self.data_url, params={'default': ''},
+                                         data=(chunk.encode('utf-8') for chunk in chunks),
+                                         headers={'Content-Type': 'application/n-triples'}, timeout=self.timeout)
+            response.raise_for_status()
+
+
+class RdflibStoreBackend:
+    """
+    Evaluates the same SPARQL queries and updates in-process on an rdflib dataset.
+    With the default "Memory" store the data lives in memory; if a path is given it is loaded from and
+    written back to an N-Quads file after every update (a full rewrite, so this suits small nodes and test rigs).
+    Any other rdflib store plugin (e.g. "BerkeleyDB") is opened at the path and persists by itself.
+    """
+
+    # rdflib's SPARQL parser slows down superlinearly with the size of an INSERT DATA request,
+    # while N-Triples are parsed in linear time
+    bulk_mode = "gsp"
+
+    def __init__(self, store="Memory", path=None):
+        # rdflib stores are not thread-safe
+        self.lock = threading.RLock()
+        # A ConjunctiveGraph whose default context is the dataset's default graph: rdflib's Dataset would put
+        # triples inserted without GRAPH into a context that plain queries do not read
+        self.graph = ConjunctiveGraph(store=store, identifier=DATASET_DEFAULT_GRAPH_ID)
+        # Like Fuseki, patterns outside GRAPH only match the default graph, not the union of all graphs
+        self.graph.default_union = False
+        self.path = path
+        self.snapshot_file = path if store == "Memory" else None
+        if store != "Memory":
+            self.graph.open(path, create=True)
+        elif path is not None and os.path.exists(path):
+            self.graph.parse(path, format="nquads")
+            logging.info(f"[RDF STORE] Loaded {len(self.graph)} triples from {path}")
+
+    def query(self, sparql_query):
+        """Returns the results of a SELECT query in the SPARQL 1.1 JSON results format."""
+        with self.lock:
+            result = self.graph.query(sparql_query)
+            variables = [str(variable) for variable in result.vars]
+            bindings = []
+            for row in result:
+                binding = {}
+                for variable, term in zip(variables, row):
+                    if term is not None:
+                        binding[variable] = term_to_json(term)
+                bindings.append(binding)
+        return {"head": {"vars": variables}, "results": {"bindings": bindings}}
+
+    def update(self, sparql_update):
+        with self.lock:
+            self.graph.update(sparql_update)
+            self.save()
+
+    def load_ntriples(self, chunks):
+        """Parses N-Triples (an iterable of str chunks) into the default graph."""
+        with self.lock:
+            self.graph.default_context.parse(data="".join(chunks), format="nt")
+            self.save()
+
+    def save(self):
+        if self.snapshot_file is not None:
+            temporary = self.snapshot_file + ".tmp"
+            self.graph.serialize(destination=temporary, format="nquads")
+            os.replace(temporary, self.snapshot_file)
+        elif self.path is not None:
+            self.graph.commit()
+
+    def close(self):
+        with self.lock:
+            self.save()
+            if self.snapshot_file is None and self.path is not None:
+                self.graph.close()
+
+
+class CachingStoreBackend:
+    """
+    Read-through cache in front of another backend: identical SELECTs within the TTL are answered
+    locally. The node's own updates clear the cache; changes made by peers show up once entries expire.
+    """
+
+    def __init__(self, backend, ttl_seconds=None, maxsize=None, clock=time.monotonic):
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("SPARQL_CACHE_TTL_SECONDS", 30))
+        if maxsize is None:
+            maxsize = int(os.getenv("SPARQL_CACHE_SIZE", 256))
+        self.backend = backend
+        self.bulk_mode = backend.bulk_mode
+        self.cache = TTLCache(maxsize, ttl_seconds, clock)
+        self.lock = threading.Lock()
+        # Bumped by every update, so that results of queries that raced with an update are not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def query(self, sparql_query):
+        with self.lock:
+            result = self.cache.get(sparql_query)
+            if result is not None:
+                self.hits += 1
+                metrics.increment("fungus_sparql_cache_total", result="hit")
+                return result
+            self.misses += 1
+            metrics.increment("fungus_sparql_cache_total", result="miss")
+            generation = self.generation
+        result = self.backend.query(sparql_query)
+        with self.lock:
+            if generation == self.generation:
+                self.cache.put(sparql_query, result)
+        return result
+
+    def update(self, sparql_update):
+        try:
+            self.backend.update(sparql_update)
+        finally:
+            self.invalidate()
+
+    def load_ntriples(self, chunks):
+        try:
+            self.backend.load_ntriples(chunks)
+        finally:
+            self.invalidate()
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.cache.clear()
+
+    def stats(self):
+        """Returns the hit/miss counts; every hit is a round trip to the store that was saved."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "entries": len(self.cache), "invalidations": self.invalidations}
+
+
+def term_to_json(term):
+    """Converts an rdflib term into its SPARQL JSON results representation."""
+    if isinstance(term, URIRef):
+        return {"type": "uri", "value": str(term)}
+    if isinstance(term, BNode):
+        return {"type": "bnode", "value": str(term)}
+    if isinstance(term, Literal):
+        value = {"type": "literal", "value": str(term)}
+        if term.datatype is not None:
+            value["datatype"] = str(term.datatype)
+        if term.language is not None:
+            value["xml:lang"] = term.language
+        return value
+    return {"type": "literal", "value": str(term)}
+
+
+def create_store_backend(fuseki_url=None, dataset="my-knowledge-base", backend=None, store=None, path=None,
+                         cache_ttl=None):
+    """
+    Creates the backend selected by RDF_STORE_BACKEND (fuseki or rdflib), behind a query cache
+    unless SPARQL_CACHE_TTL_SECONDS is 0.
+    """
+    backend = backend or os.getenv("RDF_STORE_BACKEND", "fuseki")
+    if backend == "fuseki":
+        store_backend = FusekiStoreBackend(fuseki_url, dataset)
+    elif backend == "rdflib":
+        store_backend = RdflibStoreBackend(store=store or os.getenv("RDFLIB_STORE", "Memory"),
+                                           path=path or os.getenv("RDFLIB_STORE_PATH") or None)
+    else:
+        raise ValueError(f"Unknown RDF store backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    cache_ttl = float(os.getenv("SPARQL_CACHE_TTL_SECONDS", 30)) if cache_ttl is None else cache_ttl
+    if cache_ttl <= 0:
+        return store_backend
+    return CachingStoreBackend(store_backend, ttl_seconds=cache_ttl)
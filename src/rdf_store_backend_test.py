@@ -0,0 +1,208 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import torch
+from model_state_codec import encode_model_state
+from rdf_knowledge_graph import RDFKnowledgeGraph
+from rdf_store_backend import CachingStoreBackend, FusekiStoreBackend, RdflibStoreBackend, create_store_backend
+
+
+def make_songs(count):
+    return [{"song_id": str(i), "title": f'Song "{i}"', "genre": "Rock" if i % 2 else "Jazz",
+             "artist": f"Artist {i % 3}", "tempo": str(100 + i), "duration": str(200 + i)}
+            for i in range(1, count + 1)]
+
+
+class TestRdflibStoreBackend(unittest.TestCase):
+    """Runs the queries of RDFKnowledgeGraph against an in-process rdflib dataset."""
+
+    def setUp(self):
+        self.store = RdflibStoreBackend()
+        self.rdf_kg = RDFKnowledgeGraph(MagicMock(), store=self.store, node_id="node-a")
+
+    def test_bulk_insert_and_paginated_read(self):
+        self.assertEqual(self.rdf_kg.insert_songs_bulk(make_songs(5), mode="sparql", chunk_size=2), 5)
+        self.assertEqual(self.rdf_kg.insert_songs_bulk(make_songs(8)[5:], mode="gsp"), 3)
+
+        songs = self.rdf_kg.get_all_songs(page_size=3)
+
+        self.assertEqual(list(songs["song_id"]), list(range(1, 9)))
+        self.assertEqual(songs.iloc[0]["title"], 'Song "1"')
+        self.assertEqual(int(songs.iloc[7]["tempo"]), 108)
+
+    def test_max_song_id(self):
+        self.assertEqual(self.rdf_kg.max_song_id(), 0)
+        self.rdf_kg.insert_songs_bulk(make_songs(12))
+
+        self.assertEqual(self.rdf_kg.max_song_id(), 12)
+
+    def test_insert_song_data_and_refresh(self):
+        self.rdf_kg.insert_songs_bulk(make_songs(2))
+        self.rdf_kg.songs_data = self.rdf_kg.get_all_songs()
+        self.rdf_kg.insert_song_data(3, "New Song", "Pop", "Someone", 90, 180)
+
+        self.rdf_kg.refresh_songs()
+
+        self.assertEqual(list(self.rdf_kg.songs_data["song_id"]), [1, 2, 3])
+
+    def test_model_states_are_exchanged_between_nodes(self):
+        peer = RDFKnowledgeGraph(MagicMock(), store=self.store, node_id="node-b")
+        self.rdf_kg.insert_model_state("model", {"fc1.weight": torch.zeros(2, 2)})
+        peer.insert_model_state("model", {"fc1.weight": torch.ones(2, 2)})
+        peer.insert_model_state("model", {"fc1.weight": torch.full((2, 2), 2.0)})
+
+        states = self.rdf_kg.retrieve_all_model_states(None)
+
+        # Only the latest state of the peer, never the node's own
+        self.assertEqual(len(states), 1)
+        self.assertTrue(torch.equal(states[0]["modelState"]["fc1.weight"], torch.full((2, 2), 2.0)))
+        versions = self.store.query("""
+            PREFIX ex: <http://example.org/>
+            SELECT ?version WHERE { GRAPH ?g { ?m ex:nodeId "node-b" ; ex:modelVersion ?version } }""")
+        self.assertEqual([b["version"]["value"] for b in versions["results"]["bindings"]], ["2"])
+
+    def test_compact_model_states(self):
+        peer = RDFKnowledgeGraph(MagicMock(), store=self.store, node_id="node-b")
+        peer.insert_model_state("model", {"fc1.weight": torch.zeros(2, 2)})
+
+        self.rdf_kg.compact_model_states(retention_seconds=3600)
+        self.assertEqual(len(self.rdf_kg.retrieve_all_model_states(None)), 1)
+        self.rdf_kg.compact_model_states(retention_seconds=-60)
+        self.assertEqual(len(RDFKnowledgeGraph(MagicMock(), store=self.store, node_id="node-c")
+                             .retrieve_all_model_states(None)), 0)
+
+    def test_compaction_keeps_own_model_state(self):
+        self.rdf_kg.insert_model_state("model", {"fc1.weight": torch.zeros(2, 2)})
+
+        self.rdf_kg.compact_model_states(retention_seconds=-60)
+
+        self.assertEqual(len(RDFKnowledgeGraph(MagicMock(), store=self.store, node_id="node-b")
+                             .retrieve_all_model_states(None)), 1)
+
+    def test_default_graph_excludes_named_graphs(self):
+        self.store.update("""
+            PREFIX ex: <http://example.org/>
+            INSERT DATA { ex:a ex:p 1 . GRAPH ex:g { ex:b ex:p 2 } }""")
+
+        result = self.store.query("PREFIX ex: <http://example.org/> SELECT ?s WHERE { ?s ex:p ?o }")
+
+        self.assertEqual([b["s"]["value"] for b in result["results"]["bindings"]], ["http://example.org/a"])
+
+    def test_legacy_model_states_are_read_and_kept(self):
+        legacy = encode_model_state({"fc1.weight": torch.ones(2, 2)}, encoding="json")
+        stale = encode_model_state({"fc1.weight": torch.zeros(2, 2)}, encoding="json")
+        # A node from before the per-node graphs, and a stale timestamped state in the default graph
+        self.store.update(f"""
+            PREFIX ex: <http://example.org/>
+            PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+            INSERT DATA {{
+                ex:my-model a ex:ContentBasedModel ; ex:modelState "{legacy}" .
+                ex:my-model_old a ex:ContentBasedModel ; ex:modelState "{stale}" ;
+                                ex:updatedAt "2020-01-01T00:00:00Z"^^xsd:dateTime .
+            }}""")
+        peer = RDFKnowledgeGraph(MagicMock(), store=self.store, node_id="node-b")
+        peer.insert_model_state("model", {"fc1.weight": torch.full((2, 2), 2.0)})
+
+        self.rdf_kg.compact_model_states(retention_seconds=3600)
+        states = self.rdf_kg.retrieve_all_model_states(None)
+
+        self.assertEqual(sorted(float(state["modelState"]["fc1.weight"][0, 0]) for state in states), [1.0, 2.0])
+        # Legacy states have no timestamp, so they are read again by incremental syncs
+        self.assertEqual(len(self.rdf_kg.retrieve_all_model_states(None)), 2)
+
+    def test_persists_to_nquads_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "knowledge-base.nq")
+            rdf_kg = RDFKnowledgeGraph(MagicMock(), store=RdflibStoreBackend(path=path), node_id="node-a")
+            rdf_kg.insert_songs_bulk(make_songs(3))
+            rdf_kg.insert_model_state("model", {"fc1.weight": torch.ones(1)})
+
+            reopened = RDFKnowledgeGraph(MagicMock(), store=RdflibStoreBackend(path=path), node_id="node-b")
+
+            self.assertEqual(len(reopened.songs_data), 3)
+            self.assertEqual(len(reopened.retrieve_all_model_states(None)), 1)
+
+    def test_create_store_backend(self):
+        store = create_store_backend("http://localhost:3030", backend="fuseki", cache_ttl=30)
+        self.assertIsInstance(store, CachingStoreBackend)
+        self.assertIsInstance(store.backend, FusekiStoreBackend)
+        self.assertEqual(store.bulk_mode, "sparql")
+        store = create_store_backend(backend="rdflib", cache_ttl=0)
+        self.assertIsInstance(store, RdflibStoreBackend)
+        self.assertEqual(store.bulk_mode, "gsp")
+        with self.assertRaises(ValueError):
+            create_store_backend(backend="oxigraph")
+
+
+class TestCachingStoreBackend(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.backend = MagicMock()
+        self.backend.query.side_effect = lambda query: {"results": {"bindings": [{"q": {"value": query}}]}}
+        self.store = CachingStoreBackend(self.backend, ttl_seconds=10, maxsize=8, clock=lambda: self.now)
+
+    def test_repeated_queries_are_served_from_the_cache(self):
+        first = self.store.query("SELECT 1")
+        self.assertEqual(self.store.query("SELECT 1"), first)
+        self.store.query("SELECT 2")
+
+        self.assertEqual(self.backend.query.call_count, 2)
+        self.assertEqual(self.store.stats()["hits"], 1)
+        self.assertEqual(self.store.stats()["misses"], 2)
+
+    def test_entries_expire(self):
+        self.store.query("SELECT 1")
+        self.now = 10.0
+        self.store.query("SELECT 1")
+
+        self.assertEqual(self.backend.query.call_count, 2)
+
+    def test_own_updates_invalidate(self):
+        self.store.query("SELECT 1")
+        self.store.update("INSERT DATA {}")
+        self.store.query("SELECT 1")
+        self.store.load_ntriples(iter([]))
+        self.store.query("SELECT 1")
+
+        self.assertEqual(self.backend.query.call_count, 3)
+        self.assertEqual(self.store.stats()["invalidations"], 2)
+
+    def test_failed_queries_are_not_cached(self):
+        self.backend.query.side_effect = [Exception("unreachable"), {"results": {"bindings": []}}]
+        with self.assertRaises(Exception):
+            self.store.query("SELECT 1")
+
+        self.assertEqual(self.store.query("SELECT 1"), {"results": {"bindings": []}})
+
+
+class TestFusekiStoreBackend(unittest.TestCase):
+    def test_session_is_shared_per_dataset(self):
+        first = FusekiStoreBackend("http://localhost:3030", "shared")
+        second = FusekiStoreBackend("http://localhost:3030", "shared")
+        other = FusekiStoreBackend("http://localhost:3030", "other")
+
+        self.assertIs(first.session, second.session)
+        self.assertIsNot(first.session, other.session)
+
+    def test_query_uses_sparql_protocol(self):
+        session = MagicMock()
+        session.post.return_value.json.return_value = {"results": {"bindings": []}}
+        store = FusekiStoreBackend("http://localhost:3030", "my-knowledge-base", session=session)
+
+        self.assertEqual(store.query("SELECT * WHERE { ?s ?p ?o }"), {"results": {"bindings": []}})
+        url = session.post.call_args[0][0]
+        self.assertEqual(url, "http://localhost:3030/my-knowledge-base/query")
+        self.assertEqual(session.post.call_args[1]["data"], {"query": "SELECT * WHERE { ?s ?p ?o }"})
+        self.assertEqual(session.post.call_args[1]["headers"]["Accept"], "application/sparql-results+json")
+
+    def test_settings_are_read_when_created(self):
+        with patch.dict(os.environ, {"FUSEKI_TIMEOUT_SECONDS": "5", "SPARQL_CACHE_SIZE": "2"}):
+            store = create_store_backend("http://localhost:3030", backend="fuseki", cache_ttl=30)
+
+        self.assertEqual(store.backend.timeout, 5.0)
+        self.assertEqual(store.cache.maxsize, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# reply_state_store.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class ReplyStateStore:
+    """
+    Persists which statuses were answered, the ids of the replies and their cached favourite counts
+    in SQLite (WAL mode), so a restarted node does not answer the same statuses again.
+    Lookups are served from memory; changes are written in one transaction per flush() and entries
+    older than the retention period are pruned.
+    """
+
+    def __init__(self, path=None, retention_seconds=None, recheck_seconds=None, clock=time.time):
+        # Settings are read when the store is created, after the .env file was loaded
+        if path is None:
+            path = os.getenv("REPLY_STATE_DB", "reply_state.db")
+        if retention_seconds is None:
+            retention_seconds = float(os.getenv("REPLY_STATE_RETENTION_SECONDS", 7 * 24 * 3600))
+        if recheck_seconds is None:
+            recheck_seconds = float(os.getenv("REPLY_LIKES_RECHECK_SECONDS", 24 * 3600))
+        self.retention_seconds = retention_seconds
+        self.recheck_seconds = recheck_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS replies (
+                    status_id TEXT PRIMARY KEY,
+                    reply_id TEXT NOT NULL,
+                    replied_at REAL NOT NULL,
+                    favourites INTEGER NOT NULL DEFAULT 0,
+                    checked_at REAL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS replies_replied_at ON replies (replied_at)")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS cursors (
+                    hashtag TEXT PRIMARY KEY,
+                    status_id TEXT NOT NULL
+                )""")
+
+        # status id -> [reply id, replied at, favourites, checked at], oldest first
+        self.replies = {}
+        for status_id, reply_id, replied_at, favourites, checked_at in self.connection.execute(
+                "SELECT status_id, reply_id, replied_at, favourites, checked_at FROM replies ORDER BY replied_at"):
+            self.replies[status_id] = [reply_id, replied_at, favourites, checked_at]
+        self.reply_statuses = {entry[0]: status_id for status_id, entry in self.replies.items()}
+        self.favourites = sum(entry[2] for entry in self.replies.values())
+        self.cursors = dict(self.connection.execute("SELECT hashtag, status_id FROM cursors"))
+        self.dirty = set()
+        self.dirty_cursors = set()
+        self.prune_before = None
+
+    def __contains__(self, status_id):
+        return str(status_id) in self.replies
+
+    def __len__(self):
+        return len(self.replies)
+
+    def record_reply(self, status_id, reply_id):
+        with self.lock:
+            status_id, reply_id = str(status_id), str(reply_id)
+            # Re-insert so that the entries stay ordered by reply time
+            previous = self.replies.pop(status_id, None)
+            if previous is not None:
+                self.reply_statuses.pop(previous[0], None)
+                self.favourites -= previous[2]
+            self.replies[status_id] = [reply_id, self.clock(), 0, None]
+            self.reply_statuses[reply_id] = status_id
+            self.dirty.add(status_id)
+
+    def recent_reply_ids(self):
+        """Returns the ids of the replies whose favourites are still re-checked (the newest ones)."""
+        cutoff = self.clock() - self.recheck_seconds
+        with self.lock:
+            recent = []
+            # Entries are ordered by reply time, so stop at the first one that is too old
+            for entry in reversed(self.replies.values()):
+                if entry[1] < cutoff:
+                    break
+                recent.append(entry[0])
+            return recent
+
+    def update_favourites(self, favourites_by_reply):
+        """Caches the favourite counts of replies (reply id -> count)."""
+        now = self.clock()
+        with self.lock:
+            for reply_id, favourites in favourites_by_reply.items():
+                status_id = self.reply_statuses.get(str(reply_id))
+                if status_id is None:
+                    continue
+                entry = self.replies[status_id]
+                self.favourites += favourites - entry[2]
+                entry[2], entry[3] = favourites, now
+                self.dirty.add(status_id)
+
+    def total_favourites(self):
+        """Sum of the cached favourite counts of all tracked replies."""
+        return self.favourites
+
+    def get_cursor(self, hashtag):
+        return self.cursors.get(hashtag)
+
+    def set_cursor(self, hashtag, status_id):
+        with self.lock:
+            self.cursors[hashtag] = str(status_id)
+            self.dirty_cursors.add(hashtag)
+
+    def prune(self):
+        """Forgets replies older than the retention period; returns how many were removed."""
+        cutoff = self.clock() - self.retention_seconds
+        with self.lock:
+            expired = []
+            for status_id, entry in self.replies.items():
+                if entry[1] >= cutoff:
+                    break
+                expired.append(status_id)
+            for status_id in expired:
+                entry = self.replies.pop(status_id)
+                self.reply_statuses.pop(entry[0], None)
+                self.favourites -= entry[2]
+                self.dirty.discard(status_id)
+            self.prune_before = cutoff
+        if expired:
+            logging.info(f"[REPLY STATE] Pruned {len(expired)} replies older than {self.retention_seconds:.0f}s")
+        return len(expired)
+
+    def flush(self):
+        """Writes all changes since the last flush in a single transaction."""
+        with self.lock:
+            rows = [(status_id, *self.replies[status_id]) for status_id in self.dirty]
+            cursors = [(hashtag, self.cursors[hashtag]) for hashtag in self.dirty_cursors]
+            prune_before = self.prune_before
+            self.dirty, self.dirty_cursors, self.prune_before = set(), set(), None
+            with self.connection:
+                if prune_before is not None:
+                    self.connection.execute("DELETE FROM replies WHERE replied_at < ?", (prune_before,))
+                self.connection.executemany("""
+                    INSERT INTO replies (status_id, reply_id, replied_at, favourites, checked_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (status_id) DO UPDATE SET
+                        reply_id = excluded.reply_id, replied_at = excluded.replied_at,
+                        favourites = excluded.favourites, checked_at = excluded.checked_at""", rows)
+                self.connection.executemany("""
+                    INSERT INTO cursors (hashtag, status_id) VALUES (?, ?)
+                    ON CONFLICT (hashtag) DO UPDATE SET status_id = excluded.status_id""", cursors)
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from reply_state_store import ReplyStateStore
+
+
+class FakeClock:
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestReplyStateStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "reply_state.db")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_store(self):
+        return ReplyStateStore(self.path, retention_seconds=100, recheck_seconds=10, clock=self.clock)
+
+    def test_state_survives_restart(self):
+        store = self.open_store()
+        store.record_reply("1", "r1")
+        store.record_reply(2, "r2")
+        store.update_favourites({"r1": 3, "r2": 4})
+        store.set_cursor("tag", "2")
+        store.close()
+
+        store = self.open_store()
+        self.assertIn("1", store)
+        self.assertIn(2, store)
+        self.assertNotIn("3", store)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.total_favourites(), 7)
+        self.assertEqual(store.get_cursor("tag"), "2")
+        store.close()
+
+    def test_uses_wal_and_indexes(self):
+        store = self.open_store()
+        journal_mode = store.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        indexes = [row[1] for row in store.connection.execute("PRAGMA index_list('replies')")]
+        store.close()
+        self.assertEqual(journal_mode, "wal")
+        self.assertIn("replies_replied_at", indexes)
+
+    def test_changes_are_written_on_flush(self):
+        store = self.open_store()
+        store.record_reply("1", "r1")
+        reader = sqlite3.connect(self.path)
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM replies").fetchone()[0], 0)
+        store.flush()
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM replies").fetchone()[0], 1)
+        reader.close()
+        store.close()
+
+    def test_only_recent_replies_are_rechecked(self):
+        store = self.open_store()
+        store.record_reply("1", "r1")
+        self.clock.now += 20
+        store.record_reply("2", "r2")
+        store.record_reply("3", "r3")
+        self.assertEqual(store.recent_reply_ids(), ["r3", "r2"])
+        store.close()
+
+    def test_prune_removes_old_replies(self):
+        store = self.open_store()
+        store.record_reply("1", "r1")
+        store.update_favourites({"r1": 2})
+        store.flush()
+        self.clock.now += 150
+        store.record_reply("2", "r2")
+        store.update_favourites({"r2": 1})
+
+        self.assertEqual(store.prune(), 1)
+        self.assertNotIn("1", store)
+        self.assertEqual(store.total_favourites(), 1)
+        store.close()
+
+        store = self.open_store()
+        self.assertEqual(len(store), 1)
+        self.assertIn("2", store)
+        store.close()
+
+    def test_in_memory_store(self):
+        store = ReplyStateStore(":memory:")
+        store.record_reply("1", "r1")
+        store.flush()
+        self.assertIn("1", store)
+        store.close()
+
+
+    def test_settings_are_read_when_created(self):
+        with patch.dict(os.environ, {"REPLY_STATE_DB": self.path, "REPLY_STATE_RETENTION_SECONDS": "60"}):
+            store = ReplyStateStore()
+        store.close()
+
+        self.assertEqual(store.retention_seconds, 60.0)
+        self.assertTrue(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# request_scheduler.py
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Lower values are served first
+PRIORITY_REPLY = 0
+PRIORITY_FETCH = 1
+PRIORITY_POST = 2
+PRIORITY_LIKES = 3
+
+
+class RateLimitScheduler:
+    """
+    Token bucket that spaces requests to stay within the instance's rate limit.
+    The refill rate starts at limit/window and follows the X-RateLimit-* headers of the responses:
+    the remaining requests are spread evenly until the window resets, and a 429 blocks all requests
+    until then. Waiting requests are served by priority, then in arrival order.
+    """
+
+    def __init__(self, limit=None, window_seconds=None, burst=None, clock=time.monotonic):
+        # Settings are read when the scheduler is created, after the .env file was loaded
+        if limit is None:
+            limit = int(os.getenv("MASTODON_RATE_LIMIT", 300))
+        if window_seconds is None:
+            window_seconds = float(os.getenv("MASTODON_RATE_LIMIT_WINDOW_SECONDS", 300))
+        if burst is None:
+            burst = int(os.getenv("MASTODON_RATE_LIMIT_BURST", 10))
+        self.default_rate = limit / window_seconds
+        self.rate = self.default_rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = None
+        self.reset_at = None
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+        # Stats
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, priority=PRIORITY_FETCH):
+        """Blocks until the request may be sent; returns the seconds spent waiting."""
+        start = self.clock()
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    delay = self._delay()
+                    if self.waiting[0] == ticket and delay <= 0:
+                        break
+                    # Woken up early whenever the queue head or the limits change
+                    self.condition.wait(timeout=delay if delay > 0 else None)
+                heapq.heappop(self.waiting)
+                self.tokens -= 1
+                self.requests += 1
+            finally:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+            waited = self.clock() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        if waited > 1:
+            logging.info(f"[RATE LIMIT] Request waited {waited:.1f}s (queue depth: {len(self.waiting)})")
+        return waited
+
+    def _delay(self):
+        """Refills the bucket and returns the seconds until a token is available (0 if one is)."""
+        now = self.clock()
+        if self.reset_at is not None and now >= self.reset_at:
+            # A new window started: fall back to the configured rate until the next response says otherwise
+            self.rate = self.default_rate
+            self.reset_at = None
+        if self.blocked_until is not None:
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.blocked_until = None
+            self.tokens = max(self.tokens, 1.0)
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            # Nothing left in this window
+            return max((self.reset_at or now + 1) - now, 0.01)
+        return (1 - self.tokens) / self.rate
+
+    def update(self, response):
+        """Adjusts the rate to the X-RateLimit-Remaining/X-RateLimit-Reset headers of a response."""
+        headers = response.headers
+        now = self.clock()
+        reset_in = parse_reset(headers.get("X-RateLimit-Reset"), headers.get("Retry-After"))
+        with self.condition:
+            if response.status_code == 429:
+                self.throttled += 1
+                wait = reset_in if reset_in is not None else 60.0
+                self.blocked_until = now + wait
+                self.tokens = 0.0
+                logging.warning(f"[RATE LIMIT] Rate limited by the instance, pausing requests for {wait:.0f}s")
+            else:
+                remaining = headers.get("X-RateLimit-Remaining")
+                if remaining is None or reset_in is None:
+                    return
+                remaining = int(remaining)
+                self._delay()
+                # Spread the remaining requests evenly over the rest of the window
+                self.rate = remaining / max(reset_in, 1.0)
+                self.tokens = min(self.tokens, float(remaining))
+                self.reset_at = now + reset_in
+            self.condition.notify_all()
+
+    def stats(self):
+        """Returns the queue depth and wait time statistics."""
+        with self.condition:
+            return {"queue_depth": len(self.waiting), "requests": self.requests, "throttled": self.throttled,
+                    "average_wait": self.total_wait / self.requests if self.requests else 0.0,
+                    "max_wait": self.max_wait, "rate": self.rate}
+
+
+def parse_reset(reset, retry_after=None):
+    """Returns the seconds until a rate limit window resets (Mastodon sends an ISO 8601 timestamp)."""
+    value = retry_after if retry_after is not None else reset
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+        # Epoch timestamps (as sent by some servers) versus relative seconds
+        return max(seconds - time.time(), 0.0) if seconds > 1e9 else max(seconds, 0.0)
+    except ValueError:
+        pass
+    try:
+        reset_time = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if reset_time.tzinfo is None:
+        reset_time = reset_time.replace(tzinfo=timezone.utc)
+    return max((reset_time - datetime.now(timezone.utc)).total_seconds(), 0.0)
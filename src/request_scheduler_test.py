@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from request_scheduler import RateLimitScheduler, parse_reset, PRIORITY_REPLY, PRIORITY_LIKES
+
+
+def make_response(status_code=200, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+    def test_burst_then_spaced_by_rate(self):
+        scheduler = RateLimitScheduler(limit=100, window_seconds=1, burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            scheduler.acquire()
+        # Two requests from the burst, two more at 100 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.015)
+        self.assertEqual(scheduler.stats()["requests"], 4)
+
+    def test_rate_follows_remaining_requests(self):
+        scheduler = RateLimitScheduler(limit=300, window_seconds=300, burst=10)
+        reset = (datetime.now(timezone.utc) + timedelta(seconds=100)).isoformat().replace("+00:00", "Z")
+        scheduler.update(make_response(200, {"X-RateLimit-Remaining": "50", "X-RateLimit-Reset": reset}))
+        self.assertAlmostEqual(scheduler.rate, 0.5, places=1)
+
+        scheduler.update(make_response(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}))
+        self.assertEqual(scheduler.rate, 0)
+        self.assertEqual(scheduler.tokens, 0)
+
+    def test_429_blocks_until_reset(self):
+        scheduler = RateLimitScheduler(limit=100, window_seconds=1, burst=5)
+        scheduler.update(make_response(429, {"Retry-After": "0.2"}))
+        start = time.monotonic()
+        scheduler.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(scheduler.stats()["throttled"], 1)
+
+    def test_waiting_requests_served_by_priority(self):
+        scheduler = RateLimitScheduler(limit=20, window_seconds=1, burst=1)
+        scheduler.acquire()
+        order = []
+
+        def request(priority, name):
+            scheduler.acquire(priority)
+            order.append(name)
+
+        likes = threading.Thread(target=request, args=(PRIORITY_LIKES, "likes"))
+        likes.start()
+        time.sleep(0.01)
+        reply = threading.Thread(target=request, args=(PRIORITY_REPLY, "reply"))
+        reply.start()
+        time.sleep(0.01)
+        self.assertEqual(scheduler.stats()["queue_depth"], 2)
+        likes.join()
+        reply.join()
+
+        self.assertEqual(order, ["reply", "likes"])
+        self.assertGreater(scheduler.stats()["max_wait"], 0)
+
+    def test_parse_reset(self):
+        self.assertEqual(parse_reset(None), None)
+        self.assertEqual(parse_reset("garbage"), None)
+        self.assertEqual(parse_reset("2000-01-01T00:00:00.000Z"), 0.0)
+        self.assertEqual(parse_reset("2000-01-01T00:00:00.000Z", "30"), 30.0)
+        self.assertAlmostEqual(parse_reset(str(time.time() + 60)), 60, delta=1)
+
+
+    def test_settings_are_read_when_created(self):
+        with patch.dict(os.environ, {"MASTODON_RATE_LIMIT": "60", "MASTODON_RATE_LIMIT_WINDOW_SECONDS": "30",
+                                     "MASTODON_RATE_LIMIT_BURST": "3"}):
+            scheduler = RateLimitScheduler()
+
+        self.assertEqual(scheduler.default_rate, 2.0)
+        self.assertEqual(scheduler.capacity, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
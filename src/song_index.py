@@ -0,0 +1,114 @@
+# song_index.py
+import os
+import numpy as np
+
+
+class ExactSongIndex:
+    """Brute-force cosine similarity index over L2-normalized embeddings with an argpartition top-k."""
+
+    def __init__(self):
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def build(self, embeddings):
+        """Replaces the indexed embeddings."""
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def add(self, embeddings):
+        """Appends embeddings of newly added songs to the index."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(self) == 0:
+            self.build(embeddings)
+        else:
+            self.embeddings = np.ascontiguousarray(np.vstack([self.embeddings, embeddings]))
+
+    def search(self, query, top_n, exclude=()):
+        """Returns the positions and similarities of the top N songs most similar to the query."""
+        return top_k(self.embeddings, np.arange(len(self)), query, top_n, exclude)
+
+
+class LSHSongIndex(ExactSongIndex):
+    """
+    Approximate index based on random-projection LSH.
+    More tables and probes increase recall, fewer make queries faster.
+    """
+
+    def __init__(self, num_tables=8, num_bits=12, num_probes=2, seed=42):
+        super().__init__()
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.num_probes = num_probes
+        self.rng = np.random.default_rng(seed)
+        self.planes = None
+        self.buckets = []
+        self.bit_weights = 1 << np.arange(num_bits, dtype=np.int64)
+
+    def build(self, embeddings):
+        super().build(embeddings)
+        self.planes = self.rng.standard_normal((self.num_tables, self.num_bits, self.embeddings.shape[1])).astype(np.float32)
+        self.buckets = [{} for _ in range(self.num_tables)]
+        self._insert_into_buckets(self.embeddings, 0)
+
+    def add(self, embeddings):
+        if self.planes is None:
+            self.build(embeddings)
+            return
+        start = len(self)
+        super().add(embeddings)
+        self._insert_into_buckets(self.embeddings[start:], start)
+
+    def _project(self, embeddings):
+        # Shape: (num_tables, num_rows, num_bits)
+        return np.einsum('tbd,nd->tnb', self.planes, embeddings)
+
+    def _insert_into_buckets(self, embeddings, offset):
+        codes = (self._project(embeddings) > 0).astype(np.int64) @ self.bit_weights
+        for table, table_codes in zip(self.buckets, codes):
+            for position, code in enumerate(table_codes.tolist(), start=offset):
+                table.setdefault(code, []).append(position)
+
+    def search(self, query, top_n, exclude=()):
+        if len(self) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        projections = self._project(np.asarray(query, dtype=np.float32).reshape(1, -1))[:, 0, :]
+        candidates = []
+        for table, projection in zip(self.buckets, projections):
+            code = int((projection > 0).astype(np.int64) @ self.bit_weights)
+            candidates.extend(table.get(code, ()))
+            # Multi-probe: also visit the buckets reached by flipping the least certain bits
+            for bit in np.argsort(np.abs(projection))[:self.num_probes]:
+                candidates.extend(table.get(code ^ (1 << int(bit)), ()))
+        candidates = np.unique(np.asarray(candidates, dtype=np.int64))
+
+        # Fall back to an exact scan if the probed buckets are too sparse
+        if len(candidates) < top_n + len(exclude):
+            return super().search(query, top_n, exclude)
+        return top_k(self.embeddings[candidates], candidates, query, top_n, exclude)
+
+
+def top_k(embeddings, positions, query, top_n, exclude=()):
+    """Selects the top N rows by cosine similarity without sorting all of them."""
+    similarities = embeddings @ np.asarray(query, dtype=np.float32)
+    if len(exclude):
+        similarities[np.isin(positions, list(exclude))] = -np.inf
+    top_n = min(top_n, len(similarities) - np.count_nonzero(np.isneginf(similarities)))
+    if top_n <= 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    candidates = np.argpartition(-similarities, top_n - 1)[:top_n]
+    candidates = candidates[np.argsort(-similarities[candidates], kind='stable')]
+    return positions[candidates], similarities[candidates]
+
+
+def create_song_index(backend=None):
+    """Creates the similarity index configured via SONG_INDEX_BACKEND ('exact' or 'lsh')."""
+    backend = backend or os.getenv("SONG_INDEX_BACKEND", "exact")
+    if backend == "exact":
+        return ExactSongIndex()
+    if backend == "lsh":
+        return LSHSongIndex(num_tables=int(os.getenv("SONG_INDEX_LSH_TABLES", 8)),
+                            num_bits=int(os.getenv("SONG_INDEX_LSH_BITS", 12)),
+                            num_probes=int(os.getenv("SONG_INDEX_LSH_PROBES", 2)))
+    raise ValueError(f"Unknown song index backend: {backend}")
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+from song_index import ExactSongIndex, LSHSongIndex, create_song_index
+
+
+def normalized_embeddings(num_rows, dim, seed=0):
+    embeddings = np.random.default_rng(seed).standard_normal((num_rows, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class TestSongIndex(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = normalized_embeddings(500, 16)
+
+    def test_exact_search_matches_full_sort(self):
+        index = ExactSongIndex()
+        index.build(self.embeddings)
+
+        positions, similarities = index.search(self.embeddings[7], 5, exclude=(7,))
+
+        expected = np.argsort(-(self.embeddings @ self.embeddings[7]))[1:6]
+        self.assertEqual(positions.tolist(), expected.tolist())
+        self.assertTrue(np.all(np.diff(similarities) <= 0))
+
+    def test_lsh_search_has_high_recall(self):
+        index = LSHSongIndex(num_tables=16, num_bits=6, num_probes=2)
+        index.build(self.embeddings)
+
+        hits = 0
+        for query in range(50):
+            expected = np.argsort(-(self.embeddings @ self.embeddings[query]))[1:11]
+            positions, _ = index.search(self.embeddings[query], 10, exclude=(query,))
+            hits += len(set(positions.tolist()) & set(expected.tolist()))
+        self.assertGreater(hits / 500, 0.8)
+
+    def test_incremental_add_matches_full_build(self):
+        full_index = LSHSongIndex(seed=1)
+        full_index.build(self.embeddings)
+        incremental_index = LSHSongIndex(seed=1)
+        incremental_index.build(self.embeddings[:300])
+        incremental_index.add(self.embeddings[300:])
+
+        self.assertEqual(len(incremental_index), 500)
+        self.assertEqual(full_index.buckets, incremental_index.buckets)
+
+    def test_create_song_index_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_song_index("unknown")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# title_matcher.py
+import html
+import re
+from collections import deque
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+QUOTE_TRANSLATION = str.maketrans({'‘': "'", '’': "'", '“': '"', '”': '"'})
+
+
+def normalize_text(text):
+    """Strips HTML markup and entities, lowercases and collapses whitespace."""
+    text = html.unescape(TAG_PATTERN.sub(' ', text))
+    text = text.translate(QUOTE_TRANSLATION).casefold()
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+class TitleMatcher:
+    """
+    Aho-Corasick automaton over normalized song titles.
+    Finds every title occurring in a status in a single pass over its text.
+    """
+
+    def __init__(self, titles):
+        self.titles = []
+        self.lengths = []
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+
+        seen = set()
+        for title in titles:
+            pattern = normalize_text(str(title))
+            # The first title wins when several normalize to the same text
+            if not pattern or pattern in seen:
+                continue
+            seen.add(pattern)
+            self._add_pattern(pattern, title)
+        self._build_failure_links()
+
+    def _add_pattern(self, pattern, title):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.outputs[state].append(len(self.titles))
+        self.titles.append(title)
+        self.lengths.append(len(pattern))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def find_all(self, text, normalized=False):
+        """Returns (start, end, title) of all title occurrences in the (normalized) text."""
+        if not normalized:
+            text = normalize_text(text)
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_index in self.outputs[state]:
+                end = position + 1
+                matches.append((end - self.lengths[pattern_index], end, self.titles[pattern_index]))
+        return matches
+
+    def best_match(self, text):
+        """
+        Returns the best matching title or None.
+        Matches on word boundaries are preferred, then longer titles, then earlier occurrences.
+        """
+        text = normalize_text(text)
+        best = None
+        best_rank = None
+        for start, end, title in self.find_all(text, normalized=True):
+            on_boundary = (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+            rank = (on_boundary, end - start, -start)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = title, rank
+        return best
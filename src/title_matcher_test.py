@@ -0,0 +1,28 @@
+import unittest
+from title_matcher import TitleMatcher, normalize_text
+
+class TestTitleMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = TitleMatcher(['Hello', 'Hello Goodbye', "Don't Stop Me Now", 'Lights', 'Blinding Lights'])
+
+    def test_normalize_text_strips_html(self):
+        self.assertEqual(normalize_text('<p>I  love <span>Don&#39;t Stop</span></p>'), "i love don't stop")
+
+    def test_best_match_prefers_longest_title(self):
+        self.assertEqual(self.matcher.best_match('Play Blinding Lights please'), 'Blinding Lights')
+        self.assertEqual(self.matcher.best_match('hello goodbye!'), 'Hello Goodbye')
+
+    def test_best_match_prefers_word_boundaries(self):
+        self.assertEqual(self.matcher.best_match('Othello and Lights'), 'Lights')
+
+    def test_best_match_in_mastodon_html(self):
+        content = '<p><span class="h-card"><a href="#">@<span>bot</span></a></span> dont&#39; know, ' \
+                  'maybe <strong>Don&#8217;t stop me now</strong>?</p>'
+        self.assertEqual(self.matcher.best_match(content), "Don't Stop Me Now")
+
+    def test_best_match_without_title(self):
+        self.assertIsNone(self.matcher.best_match('<p>nothing here</p>'))
+        self.assertEqual(self.matcher.find_all(''), [])
+
+if __name__ == '__main__':
+    unittest.main()
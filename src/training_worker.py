@@ -0,0 +1,129 @@
+# training_worker.py
+import logging
+import multiprocessing
+import os
+import contextlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+import torch.nn as nn
+import torch.optim as optim
+from model_aggregation import aggregate_model_states
+from profiling import capture
+
+
+class TrainingJob:
+    """
+    Everything a worker needs to train and aggregate a model, detached from the serving MLService.
+    All fields are plain tensors, arrays and dicts, so the job can be pickled into a worker process.
+    """
+
+    def __init__(self, model_dims, model_state, optimizer_state, lr, features, target, fit_options,
+                 peer_states=None, aggregation_options=None, profile_directory=None):
+        self.model_dims = model_dims
+        self.model_state = model_state
+        self.optimizer_state = optimizer_state
+        self.lr = lr
+        self.features = features
+        self.target = target
+        self.fit_options = fit_options
+        self.peer_states = peer_states or []
+        self.aggregation_options = aggregation_options or {}
+        # Set while the submitting process captures profiles, so the worker profiles the job too
+        self.profile_directory = profile_directory
+
+
+class TrainingResult:
+    def __init__(self, trained_state, model_state, optimizer_state, epochs, merged, elapsed):
+        # Weights after local training (what this node publishes to its peers)
+        self.trained_state = trained_state
+        # Weights to serve (trained, then aggregated with the peers)
+        self.model_state = model_state
+        self.optimizer_state = optimizer_state
+        self.epochs = epochs
+        self.merged = merged
+        self.elapsed = elapsed
+
+
+def run_training_job(job):
+    """Trains a fresh copy of the model on the job's examples and aggregates it with the peer states."""
+    # Imported here because machine_learning_service imports this module
+    from machine_learning_service import MLService, fit_model
+
+    profile = contextlib.nullcontext()
+    if job.profile_directory is not None:
+        profile = capture(job.profile_directory, "background_training")
+    with profile:
+        start_time = time.perf_counter()
+        model = MLService.ContentBasedNeuralNetwork(*job.model_dims)
+        model.load_state_dict(job.model_state)
+        optimizer = optim.Adam(model.parameters(), lr=job.lr)
+        if job.optimizer_state is not None:
+            optimizer.load_state_dict(job.optimizer_state)
+
+        epochs = 0
+        if len(job.target) > 0:
+            epochs = fit_model(model, job.features, job.target, nn.MSELoss(), optimizer, **job.fit_options)
+        trained_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+
+        model_state, merged = trained_state, 0
+        if job.peer_states:
+            model_state, merged = aggregate_model_states(trained_state, job.peer_states, **job.aggregation_options)
+        return TrainingResult(trained_state, model_state, optimizer.state_dict(), epochs, merged,
+                              time.perf_counter() - start_time)
+
+
+class BackgroundTrainer:
+    """
+    Runs training jobs one at a time outside the serving loop and hands back the finished weights.
+    By default jobs run in a separate process, so PyTorch never competes with serving for the GIL;
+    use_processes=False runs them on a thread instead (e.g. where processes cannot be spawned).
+    """
+
+    def __init__(self, use_processes=None):
+        if use_processes is None:
+            use_processes = os.getenv("BACKGROUND_TRAINING_PROCESSES", "true").lower() == "true"
+        if use_processes:
+            # spawn instead of fork: forking a process that already runs torch threads can deadlock
+            self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="training")
+        self.future = None
+
+    def is_busy(self):
+        return self.future is not None and not self.future.done()
+
+    def submit(self, job):
+        """Starts a job unless one is still running; returns whether the job was accepted."""
+        if self.is_busy():
+            logging.info("[TRAINING] Previous training job still running, skipping")
+            return False
+        self.future = self.executor.submit(run_training_job, job)
+        return True
+
+    def poll(self, timeout=0):
+        """
+        Returns the result of the finished job, or None if no job finished (yet).
+        A failed job is logged and dropped, so the serving model stays as it was.
+        """
+        if self.future is None:
+            return None
+        try:
+            result = self.future.result(timeout=timeout)
+        except TimeoutError:
+            return None
+        except Exception as e:
+            logging.error(f"[TRAINING] Background training failed: {e}", exc_info=True)
+            self.future = None
+            return None
+        self.future = None
+        logging.info(f"[TRAINING] Background training finished after {result.elapsed:.2f}s "
+                     f"({result.epochs} epochs, {result.merged} peers aggregated)")
+        return result
+
+    def shutdown(self, wait=True):
+        # cancel_futures needs Python 3.9; on 3.8 a queued job still runs before the executor exits
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+        else:
+            self.executor.shutdown(wait=wait)
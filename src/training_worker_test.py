@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+import torch
+import pandas as pd
+from machine_learning_service import MLService
+from training_worker import BackgroundTrainer, TrainingJob, run_training_job
+
+
+class MockRDFKnowledgeGraph:
+    def __init__(self):
+        self.songs_data = pd.DataFrame({
+            'song_id': [1, 2, 3, 4],
+            'title': ['Song A', 'Song B', 'Song C', 'Song D'],
+            'genre': ['Rock', 'Pop', 'Jazz', 'Rock'],
+            'artist': ['Artist1', 'Artist2', 'Artist3', 'Artist1'],
+            'tempo': [120, 130, 140, 100],
+            'duration': [200, 220, 180, 240]
+        })
+
+
+class TestTrainingWorker(unittest.TestCase):
+    def setUp(self):
+        self.service = MLService(rdf_knowledge_graph=MockRDFKnowledgeGraph(), num_epochs=3)
+        self.service.user_ratings_data = pd.DataFrame({'user_id': [1, 1, 2, 2], 'song_id': [1, 2, 3, 4],
+                                                       'rating': [5.0, 1.0, 4.0, 2.0]})
+
+    def test_run_training_job_trains_a_copy(self):
+        before = {k: v.clone() for k, v in self.service.model.get_state().items()}
+        result = run_training_job(self.service.training_job())
+
+        self.assertGreater(result.epochs, 0)
+        self.assertEqual(result.merged, 0)
+        self.assertFalse(torch.equal(result.model_state['fc1.weight'], before['fc1.weight']))
+        # The serving model is not touched by the job
+        self.assertTrue(torch.equal(self.service.model.get_state()['fc1.weight'], before['fc1.weight']))
+
+    def test_run_training_job_aggregates_peers(self):
+        peer_state = {k: torch.zeros_like(v) for k, v in self.service.model.get_state().items()}
+        job = self.service.training_job(peer_states=[{"model": "peer", "modelState": peer_state}],
+                                        aggregation_options={"strategy": "mean", "current_model_weight": 0.5})
+        result = run_training_job(job)
+
+        self.assertEqual(result.merged, 1)
+        for name, tensor in result.trained_state.items():
+            self.assertTrue(torch.allclose(result.model_state[name], tensor * 0.5))
+
+    def test_run_training_job_writes_profile(self):
+        job = self.service.training_job()
+        with tempfile.TemporaryDirectory() as directory:
+            job.profile_directory = directory
+            run_training_job(job)
+
+            self.assertIn("background_training.prof", os.listdir(directory))
+
+    def test_background_trainer_in_thread(self):
+        trainer = BackgroundTrainer(use_processes=False)
+        try:
+            self.assertIsNone(trainer.poll())
+            self.assertTrue(trainer.submit(self.service.training_job()))
+            result = trainer.poll(timeout=60)
+            self.assertIsNotNone(result)
+            self.assertFalse(trainer.is_busy())
+            self.service.swap_model(result.model_state, result.optimizer_state)
+            self.assertEqual(len(self.service.get_song_recommendations('Song A', top_n=2)), 2)
+        finally:
+            trainer.shutdown()
+
+    def test_background_trainer_in_process(self):
+        trainer = BackgroundTrainer(use_processes=True)
+        try:
+            self.assertTrue(trainer.submit(self.service.training_job()))
+            result = trainer.poll(timeout=120)
+            self.assertIsNotNone(result)
+            self.assertEqual(set(result.model_state), set(self.service.model.get_state()))
+        finally:
+            trainer.shutdown()
+
+    def test_failed_job_is_dropped(self):
+        trainer = BackgroundTrainer(use_processes=False)
+        try:
+            job = TrainingJob((1, 1, 1), {}, None, 0.001, None, torch.zeros(0), {})
+            trainer.submit(job)
+            self.assertIsNone(trainer.poll(timeout=60))
+            self.assertFalse(trainer.is_busy())
+        finally:
+            trainer.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()